@@ -0,0 +1,948 @@
+"""
+Absence storage backends
+
+Every roll-call session (class, date, time slot) is stored as the list of
+absent students; the presence of the whole roster is kept apart, as one
+bitmap per session (see presence.py). The statistics pages only talk to
+the AbsenceStore API, the actual layout on disk is chosen with the
+'absence_backend' setting:
+
+    sqlite  one indexed table in absences/absences.sqlite (default)
+    xlsx    legacy layout, one workbook per session in absences/<class>/
+"""
+import abc
+import io
+import json
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date as date_type, datetime
+from pathlib import Path
+
+import pandas as pd
+
+from alerts import attach_alerts
+from heatmap import attach_heatmaps
+from presence import attach_presence
+from config import ABSENCE_DIR, file_stamp, sanitize_filename
+from rollups import ROLLUP_FILENAME, AbsenceRollups
+from storage import (
+    append_journal, atomic_write_bytes, atomic_write_json, checkpoint_journal, read_journal,
+    uncommitted_journal
+)
+
+
+ABSENCE_COLUMNS = ['Code Massar', 'Nom', 'Absence', 'Date', 'Heure', 'Classe']
+ROW_COLUMNS = ['Classe', 'Date', 'Heure', 'Code Massar', 'Nom']
+ROW_FETCH_SIZE = 1000
+SQLITE_FILENAME = "absences.sqlite"
+INDEX_FILENAME = ".absence_index.json"
+CACHE_DIRNAME = ".absence_cache"
+JOURNAL_FILENAME = "journal.jsonl"
+# Checkpointed journal records are moved there past JOURNAL_ROTATE_BYTES
+JOURNAL_HISTORY_FILENAME = "journal_history.jsonl"
+JOURNAL_ROTATE_BYTES = 4 * 1024 * 1024
+# Legacy workbooks are moved there once imported into the SQLite store
+LEGACY_DIRNAME = "legacy_xlsx"
+MIGRATED_KEY = "xlsx_migrated_at"
+PARALLEL_MIN_FILES = 8
+
+SESSION_FILE_RE = re.compile(r'^absences_(\d{4}-\d{2}-\d{2})_')
+MONTH_FILE_RE = re.compile(r'^absences_(\d{4}-\d{2})_mois\.xlsx$')
+
+logger = logging.getLogger(__name__)
+
+
+def format_date(value):
+    """Return a date, datetime or ISO string as 'YYYY-MM-DD'"""
+    if isinstance(value, (date_type, datetime, pd.Timestamp)):
+        return value.strftime('%Y-%m-%d')
+    return pd.Timestamp(value).strftime('%Y-%m-%d')
+
+
+def month_bounds(year, month):
+    """Return the first and last day of a month as 'YYYY-MM-DD' strings"""
+    first = pd.Timestamp(year=year, month=month, day=1)
+    return format_date(first), format_date(first + pd.offsets.MonthEnd(0))
+
+
+def empty_absences():
+    """Return an empty frame with the absence columns and their dtypes"""
+    df = pd.DataFrame(columns=ABSENCE_COLUMNS)
+    df['Absence'] = df['Absence'].astype(bool)
+    df['Date'] = df['Date'].astype('datetime64[ns]')
+    return df
+
+
+def _student_pairs(df):
+    return [[None if pd.isna(code) else str(code), None if pd.isna(nom) else str(nom)]
+            for code, nom in zip(df['Code Massar'], df['Nom'])]
+
+
+def session_record(df_students, class_name, date, time_slot):
+    """
+    Return the journal record of a roll-call session
+
+    'absences' lists the absent students, 'roster' the whole class in
+    roster order, both as [Code Massar, Nom] pairs.
+    """
+    return {
+        'saved_at': datetime.now().isoformat(timespec='seconds'),
+        'class_name': class_name,
+        'date': format_date(date),
+        'time_slot': time_slot,
+        'absences': _student_pairs(df_students.loc[df_students['Absence']]),
+        'roster': _student_pairs(df_students),
+    }
+
+
+def record_absences(record):
+    """Return the absences of a session record as a (Code Massar, Nom) frame"""
+    return pd.DataFrame(record['absences'], columns=['Code Massar', 'Nom'])
+
+
+class AbsenceStore(abc.ABC):
+    """Base class of the absence storage backends"""
+
+    name = None
+    journal_path = None
+    journal_history_path = None
+    rollups = None
+    alerts = None
+    presence = None
+    heatmaps = None
+
+    def __init__(self):
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Register callback(records) run after session records are written"""
+        self._listeners.append(callback)
+        return callback
+
+    def save_session(self, df_students, class_name, date, time_slot):
+        """
+        Record the absent students of a roll-call session
+
+        Any previous record of the same class, date and time slot is
+        replaced. The session is first appended to the store journal, it
+        can be replayed if writing the store itself fails.
+
+        Args:
+            df_students (pd.DataFrame): Roster with a boolean Absence column
+            class_name (str): Class name as found in the class file
+            date: Session date
+            time_slot (str): Session time slot, e.g. "8h30-9h30"
+
+        Returns:
+            int: Number of absences recorded
+        """
+        record = session_record(df_students, class_name, date, time_slot)
+        self.journal(record)
+        self.apply_records([record])
+        return len(record['absences'])
+
+    def journal(self, record):
+        """Append a session record to the store journal"""
+        if self.journal_path is not None:
+            append_journal(self.journal_path, record)
+
+    def apply_records(self, records):
+        """Write session records, in order, without journaling them"""
+        self._write_records(records)
+        for callback in self._listeners:
+            try:
+                callback(records)
+            except Exception:
+                # The sessions are saved, derived data is repaired by its own checker
+                logger.exception("Absence store listener failed")
+
+    def _write_records(self, records):
+        for record in records:
+            self.replace_session(record['class_name'], record['date'], record['time_slot'],
+                                 record_absences(record))
+
+    @abc.abstractmethod
+    def replace_session(self, class_name, date, time_slot, absences):
+        """Replace the absences (Code Massar, Nom) of one session"""
+
+    @abc.abstractmethod
+    def query(self, class_name=None, start=None, end=None):
+        """
+        Return the recorded absences
+
+        The date bounds are applied by the backend before any row is
+        loaded, the cost depends on the selected period only.
+
+        Args:
+            class_name (str): Restrict to one class, all classes when None
+            start: First date included, no lower bound when None
+            end: Last date included, no upper bound when None
+
+        Returns:
+            pd.DataFrame: ABSENCE_COLUMNS with Date as datetime64
+        """
+
+    def student_counts(self, class_name=None, start=None, end=None):
+        """Return the number of absences per student over a period"""
+        df = self.query(class_name, start, end)
+        counts = df.groupby(['Code Massar', 'Nom'], as_index=False).size()
+        counts.columns = ['Code Massar', 'Nom', "Nombre d'absences"]
+        return counts.sort_values("Nombre d'absences", ascending=False, ignore_index=True)
+
+    def iter_rows(self, class_name=None, start=None, end=None, code_massar=None):
+        """
+        Yield the recorded absences one at a time, for exports
+
+        Backends stream their rows instead of building a frame, memory use
+        does not grow with the length of the history.
+
+        Args:
+            class_name (str): Restrict to one class, all classes when None
+            start: First date included, no lower bound when None
+            end: Last date included, no upper bound when None
+            code_massar (str): Restrict to one student
+
+        Yields:
+            tuple: (Classe, Date 'YYYY-MM-DD', Heure, Code Massar, Nom)
+        """
+        df = self.query(class_name, start, end)
+        if code_massar is not None:
+            df = df[df['Code Massar'].astype(str) == str(code_massar)]
+        for code, nom, day, heure, classe in zip(df['Code Massar'], df['Nom'], df['Date'],
+                                                 df['Heure'], df['Classe']):
+            yield classe, format_date(day), heure, str(code), nom
+
+    @abc.abstractmethod
+    def classes(self):
+        """Return the names of the classes with recorded absences"""
+
+    @abc.abstractmethod
+    def purge(self, before):
+        """
+        Delete every absence dated before a day
+
+        Returns:
+            int: Number of absence rows deleted
+        """
+
+    def compact(self, before=None):
+        """
+        Reclaim space left by deleted or replaced sessions
+
+        Args:
+            before: Backends storing one file per session merge the files
+                of the months ending before this day
+
+        Returns:
+            int: Number of files removed by the compaction
+        """
+        return 0
+
+
+class SQLiteAbsenceStore(AbsenceStore):
+    """Absences stored as rows of a single indexed SQLite table"""
+
+    name = 'sqlite'
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.journal_path = self.path.parent / JOURNAL_FILENAME
+        self.journal_history_path = self.path.parent / JOURNAL_HISTORY_FILENAME
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS absences (
+                    class_key TEXT NOT NULL,
+                    classe TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    heure TEXT NOT NULL,
+                    code_massar TEXT NOT NULL,
+                    nom TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_absences_class_date
+                ON absences (class_key, date, heure)
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_absences_code
+                ON absences (code_massar, date)
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def _replace(conn, class_name, date, time_slot, absences):
+        class_key = sanitize_filename(class_name)
+        rows = [
+            (class_key, class_name, date, time_slot, str(code), nom)
+            for code, nom in zip(absences['Code Massar'], absences['Nom'])
+        ]
+        conn.execute(
+            "DELETE FROM absences WHERE class_key = ? AND date = ? AND heure = ?",
+            (class_key, date, time_slot)
+        )
+        conn.executemany("INSERT INTO absences VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def replace_session(self, class_name, date, time_slot, absences):
+        with self._connect() as conn:
+            self._replace(conn, class_name, date, time_slot, absences)
+
+    def _write_records(self, records):
+        # One transaction for the whole batch
+        with self._connect() as conn:
+            for record in records:
+                self._replace(conn, record['class_name'], record['date'], record['time_slot'],
+                              record_absences(record))
+
+    def _select(self, where, params):
+        sql = """
+            SELECT code_massar AS "Code Massar", nom AS "Nom", 1 AS "Absence",
+                   date AS "Date", heure AS "Heure", classe AS "Classe"
+            FROM absences
+        """
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY date, heure, classe"
+        with self._connect() as conn:
+            df = pd.read_sql_query(sql, conn, params=params)
+        df['Absence'] = df['Absence'].astype(bool)
+        df['Date'] = pd.to_datetime(df['Date'])
+        return df
+
+    @staticmethod
+    def _where(class_name, start, end):
+        where, params = [], []
+        if class_name is not None:
+            where.append("class_key = ?")
+            params.append(sanitize_filename(class_name))
+        if start is not None:
+            where.append("date >= ?")
+            params.append(format_date(start))
+        if end is not None:
+            where.append("date <= ?")
+            params.append(format_date(end))
+        return where, params
+
+    def query(self, class_name=None, start=None, end=None):
+        return self._select(*self._where(class_name, start, end))
+
+    def student_counts(self, class_name=None, start=None, end=None):
+        where, params = self._where(class_name, start, end)
+        sql = """
+            SELECT code_massar AS "Code Massar", MAX(nom) AS "Nom",
+                   COUNT(*) AS "Nombre d'absences"
+            FROM absences
+        """
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += """ GROUP BY code_massar ORDER BY "Nombre d'absences" DESC"""
+        with self._connect() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    def iter_rows(self, class_name=None, start=None, end=None, code_massar=None):
+        where, params = self._where(class_name, start, end)
+        if code_massar is not None:
+            where.append("code_massar = ?")
+            params.append(str(code_massar))
+        sql = "SELECT classe, date, heure, code_massar, nom FROM absences"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        # Same order as the (class_key, date, heure) index, no sort needed
+        sql += " ORDER BY class_key, date, heure"
+        conn = self._connect()
+        try:
+            cursor = conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(ROW_FETCH_SIZE)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+
+    def classes(self):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT DISTINCT classe FROM absences ORDER BY classe")
+            return [row[0] for row in rows]
+
+    def is_empty(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM absences LIMIT 1").fetchone() is None
+
+    def get_meta(self, key):
+        """Return a value of the meta table, None when it is not set"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+            return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def purge(self, before):
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM absences WHERE date < ?",
+                                (format_date(before),)).rowcount
+
+    def compact(self, before=None):
+        conn = self._connect()
+        try:
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            conn.close()
+        return 0
+
+
+class XlsxAbsenceStore(AbsenceStore):
+    """
+    Legacy layout: absences/<class>/absences_<date>_<slot>.xlsx per session
+
+    Parsed workbooks are remembered so that repeated queries only read
+    new or modified sessions: a per-folder index file holds the stamp and
+    date range of each workbook, its rows are cached in a sidecar file
+    read only when the workbook falls in the queried range.
+    """
+
+    name = 'xlsx'
+
+    def __init__(self, root):
+        super().__init__()
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.journal_path = self.root / JOURNAL_FILENAME
+        self.journal_history_path = self.root / JOURNAL_HISTORY_FILENAME
+
+    def session_path(self, class_name, date, time_slot):
+        safe_time = time_slot.replace(':', '_')
+        return self.root / sanitize_filename(class_name) / f'absences_{date}_{safe_time}.xlsx'
+
+    def month_path(self, class_name, month):
+        """Return the workbook merging the sessions of a compacted month"""
+        return self.root / sanitize_filename(class_name) / f'absences_{month}_mois.xlsx'
+
+    @staticmethod
+    def _write_rows(filename, rows):
+        df = pd.DataFrame(rows, columns=['Code Massar', 'Nom', 'Date', 'Heure', 'Classe'])
+        df.insert(2, 'Absence', True)
+        buffer = io.BytesIO()
+        df.to_excel(buffer, index=False)
+        atomic_write_bytes(filename, buffer.getvalue())
+
+    def replace_session(self, class_name, date, time_slot, absences):
+        # A session of a compacted month moves back to its own file
+        month_file = self.month_path(class_name, date[:7])
+        if month_file.exists():
+            rows = read_session_rows(month_file)
+            kept = [row for row in rows if (row[2], row[3]) != (date, time_slot)]
+            if not kept:
+                month_file.unlink()
+            elif len(kept) != len(rows):
+                self._write_rows(month_file, kept)
+
+        filename = self.session_path(class_name, date, time_slot)
+        if absences.empty:
+            filename.unlink(missing_ok=True)
+            return
+        filename.parent.mkdir(exist_ok=True)
+        absences = absences.copy()
+        absences['Absence'] = True
+        absences['Date'] = date
+        absences['Heure'] = time_slot
+        absences['Classe'] = class_name
+        buffer = io.BytesIO()
+        absences.to_excel(buffer, index=False)
+        atomic_write_bytes(filename, buffer.getvalue())
+
+    def class_files(self, class_name=None, start=None, end=None):
+        """
+        Return the session workbooks of one or every class folder
+
+        Files are pruned on the date or month encoded in their name, files
+        whose name carries neither are always returned.
+        """
+        if class_name is not None:
+            files = (self.root / sanitize_filename(class_name)).glob('*.xlsx')
+        else:
+            files = self.root.glob('*/*.xlsx')
+        start = format_date(start) if start is not None else None
+        end = format_date(end) if end is not None else None
+
+        selected = []
+        for file in files:
+            match = SESSION_FILE_RE.match(file.name)
+            if match:
+                day = match.group(1)
+                if (start is not None and day < start) or (end is not None and day > end):
+                    continue
+            match = MONTH_FILE_RE.match(file.name)
+            if match:
+                month = match.group(1)
+                if (start is not None and month < start[:7]) or (end is not None and month > end[:7]):
+                    continue
+            selected.append(file)
+        return sorted(selected)
+
+    @staticmethod
+    def read_file(file):
+        """Read one session workbook, None when it holds no usable rows"""
+        df = pd.read_excel(file)
+        if 'Date' not in df.columns:
+            return None
+        # Ensure Date column is datetime and drop rows with invalid dates
+        df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+        df = df.dropna(subset=['Date'])
+        if df.empty:
+            return None
+        if 'Classe' not in df.columns:
+            df['Classe'] = file.parent.name
+        df['Absence'] = True
+        return df
+
+    def _read_index(self, folder):
+        try:
+            with open(folder / INDEX_FILENAME, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, folder, index):
+        atomic_write_json(folder / INDEX_FILENAME, index)
+
+    @staticmethod
+    def _cache_path(file):
+        return file.parent / CACHE_DIRNAME / f"{file.name}.json"
+
+    def _read_cache(self, file, stamp):
+        """Return the cached rows and counts of a workbook, None when missing or stale"""
+        try:
+            with open(self._cache_path(file), 'r') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return cache if cache.get('stamp') == stamp else None
+
+    def _write_cache(self, file, stamp, rows):
+        cache = {'stamp': stamp, 'rows': rows, 'counts': count_rows(rows)}
+        self._cache_path(file).parent.mkdir(exist_ok=True)
+        atomic_write_json(self._cache_path(file), cache)
+        return cache
+
+    def load_entries(self, files, start=None, end=None):
+        """
+        Return the cached rows of the session workbooks holding absences in a range
+
+        Each folder keeps an index mapping file names to their stamp and
+        the first and last day of their rows, the rows and per-student
+        counts of each file are kept in a sidecar under .absence_cache/.
+        Only files that are new or changed since the last call are parsed,
+        in a process pool when there are enough of them; entries and
+        sidecars of deleted files are dropped. Sidecars are only read for
+        files whose days overlap start..end. Unreadable files are recorded
+        with no rows and their 'error', so that they are retried only once
+        they change.
+
+        Returns:
+            list: dicts with 'rows' and 'counts' keys, one per file in range
+        """
+        start = format_date(start) if start is not None else None
+        end = format_date(end) if end is not None else None
+        by_folder = {}
+        for file in files:
+            by_folder.setdefault(file.parent, []).append(file)
+
+        entries = []
+        for folder, folder_files in by_folder.items():
+            index = self._read_index(folder)
+            changed = False
+
+            existing = {f.name for f in folder.glob('*.xlsx')}
+            for name in list(index):
+                if name not in existing:
+                    del index[name]
+                    (folder / CACHE_DIRNAME / f"{name}.json").unlink(missing_ok=True)
+                    changed = True
+
+            stamps = {file: list(file_stamp(file)) for file in folder_files}
+            # Entries without a day range come from indexes holding the rows
+            stale = [file for file in folder_files
+                     if index.get(file.name, {}).get('stamp') != stamps[file]
+                     or 'first' not in index[file.name]]
+            parsed = {}
+            for file, rows, error in parse_session_files(stale):
+                parsed[file] = self._write_cache(file, stamps[file], rows)
+                days = [row[2] for row in rows]
+                index[file.name] = {
+                    'stamp': stamps[file],
+                    'first': min(days, default=None),
+                    'last': max(days, default=None),
+                }
+                if error is not None:
+                    # Not parsed again until the file changes
+                    index[file.name]['error'] = str(error)
+                changed = True
+
+            for file in folder_files:
+                meta = index.get(file.name)
+                if (meta is None or meta['first'] is None
+                        or (start is not None and meta['last'] < start)
+                        or (end is not None and meta['first'] > end)):
+                    continue
+                cache = parsed.get(file) or self._read_cache(file, stamps[file])
+                if cache is None:
+                    # Sidecar lost: parse the file again
+                    _, rows, _ = next(parse_session_files([file]))
+                    cache = self._write_cache(file, stamps[file], rows)
+                entries.append(cache)
+
+            if changed:
+                self._write_index(folder, index)
+        return entries
+
+    def query(self, class_name=None, start=None, end=None):
+        entries = self.load_entries(self.class_files(class_name, start, end), start, end)
+        rows = [row for entry in entries for row in entry['rows']]
+        if not rows:
+            return empty_absences()
+        df = pd.DataFrame(rows, columns=['Code Massar', 'Nom', 'Date', 'Heure', 'Classe'])
+        df['Absence'] = True
+        df['Date'] = pd.to_datetime(df['Date'])
+        df = df[ABSENCE_COLUMNS]
+        # Files without a date in their name were not pruned
+        if start is not None:
+            df = df[df['Date'] >= pd.Timestamp(start)]
+        if end is not None:
+            df = df[df['Date'] <= pd.Timestamp(end)]
+        return df.sort_values(['Date', 'Heure', 'Classe'], ignore_index=True)
+
+    def student_counts(self, class_name=None, start=None, end=None):
+        files = self.class_files(class_name, start, end)
+        if any(not SESSION_FILE_RE.match(file.name) for file in files):
+            return super().student_counts(class_name, start, end)
+        totals = {}
+        for entry in self.load_entries(files, start, end):
+            for code, (nom, count) in entry['counts'].items():
+                totals[code] = (nom, totals.get(code, (nom, 0))[1] + count)
+        return pd.DataFrame(
+            [(code, nom, count) for code, (nom, count) in totals.items()],
+            columns=['Code Massar', 'Nom', "Nombre d'absences"]
+        ).sort_values("Nombre d'absences", ascending=False, ignore_index=True)
+
+    def iter_rows(self, class_name=None, start=None, end=None, code_massar=None):
+        # One workbook at a time, straight from the files
+        start = format_date(start) if start is not None else None
+        end = format_date(end) if end is not None else None
+        code_massar = str(code_massar) if code_massar is not None else None
+        for file in self.class_files(class_name, start, end):
+            try:
+                rows = read_session_rows(file)
+            except Exception as e:
+                logger.warning("Impossible de lire le fichier %s: %s", file.name, e)
+                continue
+            for code, nom, day, heure, classe in rows:
+                if ((start is not None and day < start) or (end is not None and day > end)
+                        or (code_massar is not None and code != code_massar)):
+                    continue
+                yield classe, day, heure, code, nom
+
+    def classes(self):
+        # Skip the archive and outbox folders
+        return sorted(p.name for p in self.root.iterdir() if p.is_dir() and any(p.glob('*.xlsx')))
+
+    def purge(self, before):
+        before = format_date(before)
+        removed = 0
+        for file in self.class_files(end=before):
+            match = SESSION_FILE_RE.match(file.name)
+            if match and match.group(1) >= before:
+                continue
+            rows = read_session_rows(file)
+            kept = [row for row in rows if row[2] >= before]
+            if not kept:
+                file.unlink()
+            elif len(kept) != len(rows):
+                self._write_rows(file, kept)
+            removed += len(rows) - len(kept)
+        return removed
+
+    def compact(self, before=None):
+        """Merge the session files of every month ending before a day"""
+        last_month = (format_date(before) if before is not None
+                      else format_date(datetime.today()))[:7]
+        by_month = {}
+        for file in self.class_files():
+            match = SESSION_FILE_RE.match(file.name)
+            if match and match.group(1)[:7] < last_month:
+                by_month.setdefault((file.parent, match.group(1)[:7]), []).append(file)
+
+        removed = 0
+        for (folder, month), files in by_month.items():
+            month_file = folder / f'absences_{month}_mois.xlsx'
+            if len(files) < 2 and not month_file.exists():
+                continue
+            rows = read_session_rows(month_file) if month_file.exists() else []
+            for file in files:
+                rows.extend(read_session_rows(file))
+            rows.sort(key=lambda row: (row[2], row[3]))
+            self._write_rows(month_file, rows)
+            for file in files:
+                file.unlink()
+            removed += len(files)
+        return removed
+
+
+def read_session_rows(path):
+    """Return the absence rows of one session workbook as plain lists"""
+    df = XlsxAbsenceStore.read_file(Path(path))
+    if df is None:
+        return []
+    return [
+        [str(code), None if pd.isna(nom) else str(nom), format_date(day), str(heure), str(classe)]
+        for code, nom, day, heure, classe
+        in zip(df['Code Massar'], df['Nom'], df['Date'], df['Heure'], df['Classe'])
+    ]
+
+
+def parse_session_files(files):
+    """
+    Yield (file, rows, error) for every session workbook
+
+    Large batches are parsed in a process pool. Unreadable files are
+    logged and yielded with no rows and the exception raised.
+    """
+    if len(files) < PARALLEL_MIN_FILES:
+        results = ((file, _safe_read(file)) for file in files)
+    else:
+        workers = min(len(files), os.cpu_count() or 1)
+        # Spawned, not forked: the caller may be a threaded server
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            results = list(zip(files, pool.map(_safe_read, files, chunksize=16)))
+    for file, result in results:
+        if isinstance(result, Exception):
+            logger.warning("Impossible de lire le fichier %s: %s", file.name, result)
+            yield file, [], result
+        else:
+            yield file, result, None
+
+
+def _safe_read(path):
+    try:
+        return read_session_rows(path)
+    except Exception as e:
+        return e
+
+
+def count_rows(rows):
+    """Return {Code Massar: [Nom, count]} for a list of absence rows"""
+    counts = {}
+    for code, nom, *_ in rows:
+        counts.setdefault(code, [nom, 0])[1] += 1
+    return counts
+
+
+def migrate_xlsx_absences(store, source_root=ABSENCE_DIR, archive=False):
+    """
+    Import legacy per-session workbooks into another store
+
+    Sessions are replaced rather than appended, running the migration
+    twice leaves the target store unchanged. With archive=True every
+    imported workbook is moved to <source_root>/legacy_xlsx/<class>/,
+    where the xlsx layout no longer sees it and retention purges it.
+    Unreadable workbooks stay in place.
+
+    Returns:
+        tuple: (number of sessions imported, list of unreadable files)
+    """
+    legacy = XlsxAbsenceStore(source_root)
+    sessions, failed = 0, []
+    for file in legacy.class_files():
+        try:
+            df = legacy.read_file(file)
+        except Exception:
+            failed.append(file)
+            continue
+        if df is not None:
+            df['Code Massar'] = df['Code Massar'].astype(str)
+            for (class_name, day, time_slot), rows in df.groupby(['Classe', 'Date', 'Heure']):
+                store.replace_session(str(class_name), format_date(day), str(time_slot),
+                                      rows[['Code Massar', 'Nom']])
+                sessions += 1
+        if archive:
+            target = Path(source_root) / LEGACY_DIRNAME / file.parent.name / file.name
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(file, target)
+    if archive:
+        for index in Path(source_root).glob(f'*/{INDEX_FILENAME}'):
+            if not any(index.parent.glob('*.xlsx')):
+                index.unlink()
+                shutil.rmtree(index.parent / CACHE_DIRNAME, ignore_errors=True)
+    return sessions, failed
+
+
+def replay_journal(store, journal_path=None, since=None):
+    """
+    Re-apply the journaled sessions to a store, in order
+
+    Args:
+        store (AbsenceStore): Target store
+        journal_path: Journal to read, the store journal and its history
+            when None
+        since (str): Only replay sessions saved at or after this ISO time
+
+    Returns:
+        int: Number of sessions replayed
+    """
+    paths = [journal_path] if journal_path else [store.journal_history_path, store.journal_path]
+    records = [
+        record for path in paths for record in read_journal(path)
+        if since is None or record['saved_at'] >= since
+    ]
+    store.apply_records(records)
+    return len(records)
+
+
+def _is_saved(store, record):
+    """Tell whether the presence log holds a version of a journaled session at least as recent"""
+    if 'roster' not in record:
+        # Journaled before the presence log existed, left to replay_journal
+        return True
+    saved_at = store.presence.saved_time(sanitize_filename(record['class_name']),
+                                         record['date'], record['time_slot'])
+    return (saved_at or '') >= record['saved_at']
+
+
+def commit_journal(store, given_up=()):
+    """
+    Checkpoint the store journal past the sessions written to the store
+
+    The checkpoint stops at the first journaled session not written yet,
+    whichever process journaled it; the sessions of given_up, (class name,
+    date, time slot, saved_at) tuples, do not stop it. The journal is
+    rotated to the journal history once the checkpoint passes
+    JOURNAL_ROTATE_BYTES.
+
+    Returns:
+        int: Checkpoint offset in the journal
+    """
+    if store.presence is None or store.journal_path is None:
+        return 0
+    given_up = set(given_up)
+    return checkpoint_journal(
+        store.journal_path,
+        lambda record: ((record['class_name'], record['date'], record['time_slot'],
+                         record['saved_at']) in given_up or _is_saved(store, record)),
+        store.journal_history_path, JOURNAL_ROTATE_BYTES
+    )
+
+
+def recover_journal(store):
+    """
+    Apply the journaled sessions that never reached the store
+
+    A session is journaled before the background writer writes it, a
+    process dying in between leaves it only in the journal. Only the
+    records after the journal checkpoint are read; a session is applied
+    again, in journal order, when the presence log has no version of it
+    at least as recent, then the checkpoint moves past them.
+
+    Sessions that cannot be written are logged and given up, they stay in
+    the journal for replay_journal.
+
+    Returns:
+        int: Number of sessions applied
+    """
+    if store.presence is None or store.journal_path is None:
+        return 0
+    records = [record for record in uncommitted_journal(store.journal_path)
+               if not _is_saved(store, record)]
+    applied, given_up = 0, []
+    for record in records:
+        try:
+            store.apply_records([record])
+            applied += 1
+        except Exception:
+            logger.exception("Journaled session %s %s %s could not be applied",
+                             record['class_name'], record['date'], record['time_slot'])
+            given_up.append((record['class_name'], record['date'], record['time_slot'],
+                             record['saved_at']))
+    if applied:
+        logger.warning("%d journaled session(s) missing from the %s store applied",
+                       applied, store.name)
+    commit_journal(store, given_up)
+    return applied
+
+
+def rollup_path(backend, root=ABSENCE_DIR):
+    """Return the rollup database of a backend, one per backend and root"""
+    return Path(root) / f"{backend}_{ROLLUP_FILENAME}"
+
+
+def attach_rollups(store, path):
+    """
+    Keep the rollups at path up to date with the sessions written to store
+
+    Rollups that do not exist yet are built from the store content.
+    """
+    rollups = AbsenceRollups(path)
+    if rollups.created:
+        rollups.rebuild(store)
+    store.add_listener(rollups.apply_records)
+    store.rollups = rollups
+    return rollups
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(backend='sqlite', root=ABSENCE_DIR):
+    """
+    Return the process-wide store for a backend and root directory
+
+    The first time the SQLite store is opened, legacy workbooks found
+    under root are imported into it and moved to root/legacy_xlsx; the
+    meta table records that the migration ran, so that a store emptied
+    by retention is not filled again. The store
+    comes with its rollups, presence log, alert engine and heatmap cache
+    attached (store.rollups, store.presence, store.alerts, store.heatmaps),
+    and the journaled sessions a dead process did not write are applied.
+    """
+    key = (backend, str(Path(root).resolve()))
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            if backend == 'sqlite':
+                store = SQLiteAbsenceStore(Path(root) / SQLITE_FILENAME)
+                if store.get_meta(MIGRATED_KEY) is None:
+                    # A store filled before the marker existed was migrated already
+                    if store.is_empty() and any(Path(root).glob('*/*.xlsx')):
+                        migrate_xlsx_absences(store, root, archive=True)
+                    store.set_meta(MIGRATED_KEY, datetime.now().isoformat(timespec='seconds'))
+            elif backend == 'xlsx':
+                store = XlsxAbsenceStore(root)
+            else:
+                raise ValueError(f"Unknown absence backend: {backend}")
+            attach_rollups(store, rollup_path(backend, root))
+            attach_presence(store, root)
+            attach_alerts(store, root)
+            attach_heatmaps(store)
+            recover_journal(store)
+            _stores[key] = store
+        return store
@@ -0,0 +1,302 @@
+"""
+Alerts on chronic absentees
+
+Rules are evaluated on each batch of session records written to the
+absence store (a store listener), never on the whole history:
+
+    rolling      more than N absences over the last D days, one indexed
+                 count per absent student in the rollups
+    consecutive  absent from M roll-call sessions of the class in a row,
+                 from per-class streak counters
+
+New alerts are queued in absences/alerts.json and sent together as one
+digest once the oldest has waited alert_digest_minutes. The sender is
+chosen with the 'alert_sender' setting: 'file' writes .eml files to
+absences/outbox/ (default, nothing leaves the machine), 'smtp' sends to
+smtp_host:smtp_port, e.g. a local debugging server started with
+    python -m aiosmtpd -n -l localhost:1025
+Other senders can be added with register_sender. Nothing is evaluated
+while the email_notifications setting is off.
+"""
+import re
+import smtplib
+import uuid
+from datetime import date as date_type, datetime, timedelta
+from email.message import EmailMessage
+from pathlib import Path
+
+from config import ABSENCE_DIR, load_settings, sanitize_filename
+from storage import atomic_write_bytes, read_json, update_json
+
+
+ALERTS_FILENAME = "alerts.json"
+OUTBOX_DIRNAME = "outbox"
+ALERTED_RETENTION_DAYS = 120  # how long fired alerts are remembered for deduplication
+
+RULE_ROLLING = 'rolling'
+RULE_CONSECUTIVE = 'consecutive'
+
+DEFAULT_SETTINGS = {
+    'email_notifications': False,
+    'email': '',
+    'alert_max_absences': 10,
+    'alert_window_days': 30,
+    'alert_consecutive_slots': 3,
+    'alert_digest_minutes': 60,
+    'alert_sender': 'file',
+    'alert_from': 'absences@localhost',
+    'smtp_host': 'localhost',
+    'smtp_port': 1025,
+}
+
+SLOT_RE = re.compile(r'^\s*(\d{1,2})\s*[h:H]\s*(\d{2})?')
+
+
+def empty_state():
+    return {'streaks': {}, 'alerted': {}, 'pending': []}
+
+
+def alert_settings(settings=None):
+    """Return the alert settings, defaults filled in"""
+    settings = load_settings() if settings is None else settings
+    return {key: settings.get(key, default) for key, default in DEFAULT_SETTINGS.items()}
+
+
+def slot_key(time_slot):
+    """Sort key of a time slot on its start time ('8h30-9h30' before '10h30-11h30')"""
+    match = SLOT_RE.match(str(time_slot))
+    if not match:
+        return (24 * 60, str(time_slot))
+    return (int(match.group(1)) * 60 + int(match.group(2) or 0), str(time_slot))
+
+
+def session_key(session):
+    day, time_slot = session
+    return day, slot_key(time_slot)
+
+
+class FileOutboxSender:
+    """Write every message as an .eml file in a folder"""
+
+    def __init__(self, folder):
+        self.folder = Path(folder)
+
+    def send(self, message):
+        self.folder.mkdir(parents=True, exist_ok=True)
+        name = f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}.eml"
+        atomic_write_bytes(self.folder / name, bytes(message))
+
+
+class SMTPSender:
+    """Send messages through an SMTP server, without authentication"""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, int(port)
+
+    def send(self, message):
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            smtp.send_message(message)
+
+
+SENDERS = {
+    'file': lambda settings, root: FileOutboxSender(Path(root) / OUTBOX_DIRNAME),
+    'smtp': lambda settings, root: SMTPSender(settings['smtp_host'], settings['smtp_port']),
+}
+
+
+def register_sender(name, factory):
+    """Register factory(settings, root) returning an object with send(EmailMessage)"""
+    SENDERS[name] = factory
+
+
+def digest_message(alerts, recipient, sender):
+    """Return the digest e-mail of a list of alerts, grouped by class"""
+    by_class = {}
+    for alert in alerts:
+        by_class.setdefault(alert['class_name'], []).append(alert)
+    lines = [f"{len(alerts)} alerte(s) d'absentéisme :", ""]
+    for class_name in sorted(by_class):
+        lines.append(f"Classe {class_name}")
+        lines.extend(f"  - {alert['date']} : {alert['message']}" for alert in by_class[class_name])
+        lines.append("")
+
+    message = EmailMessage()
+    message['Subject'] = f"[Absences] {len(alerts)} alerte(s)"
+    message['From'] = sender
+    message['To'] = recipient
+    message.set_content("\n".join(lines))
+    return message
+
+
+class AlertEngine:
+    """Alert rules, queue and digest of one absence store"""
+
+    def __init__(self, rollups, root=ABSENCE_DIR):
+        self.rollups = rollups
+        self.root = Path(root)
+        self.path = self.root / ALERTS_FILENAME
+
+    def on_records(self, records):
+        """Store listener: evaluate the rules, then send the digest if due"""
+        settings = alert_settings()
+        if settings['email_notifications']:
+            self.evaluate(records, settings)
+            self.send_digest(settings)
+
+    def evaluate(self, records, settings=None):
+        """
+        Apply the rules to newly written session records
+
+        The cost depends on the records only: one count per absent student
+        and the streak counters of the classes involved.
+
+        Returns:
+            list: New alerts, also queued for the next digest
+        """
+        settings = alert_settings(settings)
+        if not settings['email_notifications']:
+            return []
+        limit = int(settings['alert_max_absences'])
+        window = int(settings['alert_window_days'])
+        consecutive = int(settings['alert_consecutive_slots'])
+        queued_at = datetime.now().isoformat(timespec='seconds')
+
+        # Index lookups happen before taking the state lock
+        rolling = []
+        for record in records:
+            end = date_type.fromisoformat(record['date'])
+            start = (end - timedelta(days=window - 1)).isoformat()
+            for code, nom in record['absences']:
+                count = self.rollups.student_count(code, start, record['date'])
+                if count > limit:
+                    rolling.append(self._alert(
+                        RULE_ROLLING, record, code, nom, count,
+                        f"{count} absences sur les {window} derniers jours"))
+
+        def update(state):
+            new = []
+            for alert in rolling:
+                key = f"{RULE_ROLLING}|{alert['code_massar']}"
+                last = state['alerted'].get(key)
+                if last and date_type.fromisoformat(alert['date']) - date_type.fromisoformat(last) \
+                        < timedelta(days=window):
+                    continue
+                state['alerted'][key] = alert['date']
+                new.append(alert)
+            for record in records:
+                new.extend(self._update_streaks(state, record, consecutive))
+            for alert in new:
+                alert['queued_at'] = queued_at
+            state['pending'].extend(new)
+            if records:
+                self._prune(state, max(record['date'] for record in records))
+            return new
+
+        return update_json(self.path, update, default=empty_state())
+
+    @staticmethod
+    def _alert(rule, record, code, nom, count, message):
+        return {
+            'rule': rule,
+            'class_name': record['class_name'],
+            'date': record['date'],
+            'time_slot': record['time_slot'],
+            'code_massar': code,
+            'nom': nom,
+            'count': count,
+            'message': f"{nom} ({code}) : {message}",
+        }
+
+    def _update_streaks(self, state, record, limit):
+        """
+        Move the consecutive absence counters of a class to a new session
+
+        Sessions are expected in chronological order. Saving the latest
+        session again recomputes it from the counters before it; saving an
+        older session does not move the counters.
+        """
+        class_key = sanitize_filename(record['class_name'])
+        session = [record['date'], record['time_slot']]
+        entry = state['streaks'].get(class_key)
+        if entry and entry['session'] == session:
+            before = entry['before']
+        elif entry and session_key(session) < session_key(entry['session']):
+            return []
+        else:
+            before = entry['streaks'] if entry else {}
+
+        streaks = {
+            code: [before.get(code, [0, None])[0] + 1, nom] for code, nom in record['absences']
+        }
+        state['streaks'][class_key] = {'session': session, 'before': before, 'streaks': streaks}
+
+        alerts = []
+        for code, (count, nom) in streaks.items():
+            if count != limit:
+                continue
+            key = f"{RULE_CONSECUTIVE}|{class_key}|{code}|{record['date']}|{record['time_slot']}"
+            if key in state['alerted']:
+                continue
+            state['alerted'][key] = record['date']
+            alerts.append(self._alert(RULE_CONSECUTIVE, record, code, nom, count,
+                                      f"absent(e) {count} séances consécutives"))
+        return alerts
+
+    @staticmethod
+    def _prune(state, latest):
+        # Relative to the sessions, back-dated entries are deduplicated too
+        oldest = (date_type.fromisoformat(latest)
+                  - timedelta(days=ALERTED_RETENTION_DAYS)).isoformat()
+        for key in [key for key, day in state['alerted'].items() if day < oldest]:
+            del state['alerted'][key]
+
+    def pending(self):
+        """Return the alerts waiting for the next digest"""
+        return read_json(self.path, empty_state())['pending']
+
+    def send_digest(self, settings=None, force=False):
+        """
+        Send the queued alerts as one message
+
+        Args:
+            force (bool): Send now, even if the oldest alert waited less
+                than alert_digest_minutes
+
+        Returns:
+            int: Number of alerts sent
+        """
+        settings = alert_settings(settings)
+        if not settings['email']:
+            return 0
+        delay = timedelta(minutes=int(settings['alert_digest_minutes']))
+        now = datetime.now()
+
+        def take(state):
+            pending = state['pending']
+            if not pending:
+                return []
+            if not force and now - datetime.fromisoformat(pending[0]['queued_at']) < delay:
+                return []
+            state['pending'] = []
+            return pending
+
+        alerts = update_json(self.path, take, default=empty_state())
+        if not alerts:
+            return 0
+        try:
+            sender = SENDERS[settings['alert_sender']](settings, self.root)
+            sender.send(digest_message(alerts, settings['email'], settings['alert_from']))
+        except Exception:
+            # Queue them again for the next attempt
+            update_json(self.path, lambda state: state.update(pending=alerts + state['pending']),
+                        default=empty_state())
+            raise
+        return len(alerts)
+
+
+def attach_alerts(store, root=ABSENCE_DIR):
+    """Evaluate the alert rules on every batch written to store"""
+    engine = AlertEngine(store.rollups, root)
+    store.add_listener(engine.on_records)
+    store.alerts = engine
+    return engine
@@ -0,0 +1,348 @@
+"""
+Headless JSON API for roll-call clients
+
+Run with:
+    uvicorn api:app --host 0.0.0.0 --port 8000
+
+Endpoints (all but /api/health and /api/token need "Authorization: Bearer <token>"):
+    GET  /api/health
+    POST /api/token                             {"username", "password"}
+    GET  /api/classes
+    GET  /api/classes/{class}/students
+    POST /api/classes/{class}/attendance        {"date", "time_slot", "absent": [Code Massar]}
+    GET  /api/attendance/{ticket}
+    GET  /api/classes/{class}/statistics        ?year=&month= or ?start=&end=
+    GET  /api/students/{code}/absences          ?start=&end=
+    GET  /api/export                            ?format=csv|xlsx&class=&start=&end=&student=
+    GET  /metrics                               Prometheus text, no token
+
+Every request is timed under the 'api.<endpoint>' operation and counted
+per status class ('api.responses.2xx', ...) in the metrics registry.
+
+Tokens are HMAC-signed with ATTENDANCE_API_SECRET, or with a key generated
+once in .api_secret, so every worker process accepts them. Attendance is
+queued on the write-behind writer and answered with 202 and a ticket;
+tickets live in the process that issued them, run a single worker when
+clients poll /api/attendance/{ticket}.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from pathlib import Path
+
+import pandas as pd
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.background import BackgroundTask
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+from absence_store import format_date, get_store, month_bounds
+from attendance_writer import get_writer
+from auth import get_auth_manager
+from class_cache import load_class
+from class_registry import available_classes, class_path, find_student
+from config import load_settings
+from export import EXPORT_FORMATS, MIME_TYPES, export_to_file
+from metrics import get_registry, render_prometheus
+from school_stats import TIME_SLOTS
+from storage import atomic_write_bytes, file_lock
+
+
+TOKEN_TTL = 12 * 3600  # seconds
+SECRET_FILE = ".api_secret"
+
+
+def _load_secret():
+    """Return the token signing key, shared by every worker process"""
+    secret = os.environ.get("ATTENDANCE_API_SECRET")
+    if secret:
+        return secret.encode()
+    with file_lock(SECRET_FILE):
+        if not Path(SECRET_FILE).exists():
+            atomic_write_bytes(SECRET_FILE, os.urandom(32).hex().encode())
+        return Path(SECRET_FILE).read_bytes().strip()
+
+
+_secret = None
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def issue_token(username, role, ttl=TOKEN_TTL):
+    """Return a signed bearer token for a user"""
+    global _secret
+    _secret = _secret or _load_secret()
+    payload = json.dumps({'sub': username, 'role': role, 'exp': int(time.time()) + ttl},
+                         separators=(',', ':')).encode()
+    signature = hmac.new(_secret, payload, hashlib.sha256).digest()
+    return f"{_b64(payload)}.{_b64(signature)}"
+
+
+def read_token(token):
+    """Return the claims of a valid token, None otherwise"""
+    global _secret
+    _secret = _secret or _load_secret()
+    try:
+        payload_part, signature_part = token.split('.')
+        payload = _unb64(payload_part)
+        expected = hmac.new(_secret, payload, hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _unb64(signature_part)):
+            return None
+        claims = json.loads(payload)
+    except (ValueError, TypeError):
+        return None
+    return claims if claims.get('exp', 0) > time.time() else None
+
+
+def require_user(request):
+    header = request.headers.get('authorization', '')
+    if not header.lower().startswith('bearer '):
+        raise HTTPException(401, "Missing bearer token")
+    claims = read_token(header[7:].strip())
+    if claims is None:
+        raise HTTPException(401, "Invalid or expired token")
+    return claims
+
+
+def absence_store():
+    return get_store(load_settings().get('absence_backend', 'sqlite'))
+
+
+def _class_or_404(name):
+    if name not in available_classes():
+        raise HTTPException(404, f"Unknown class: {name}")
+    return load_class(class_path(name))
+
+
+async def _json_body(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(400, "Body must be JSON")
+    if not isinstance(body, dict):
+        raise HTTPException(400, "Body must be a JSON object")
+    return body
+
+
+async def health(request):
+    return JSONResponse({'status': 'ok'})
+
+
+async def token(request):
+    body = await _json_body(request)
+    username, password = body.get('username'), body.get('password')
+    if not username or not password:
+        raise HTTPException(400, "username and password are required")
+    success, user = await run_in_threadpool(get_auth_manager().verify_user, username, password)
+    if not success:
+        raise HTTPException(401, "Invalid username or password")
+    return JSONResponse({
+        'token': issue_token(username, user['role']),
+        'expires_in': TOKEN_TTL,
+        'name': user['name'],
+        'role': user['role'],
+    })
+
+
+async def list_classes(request):
+    require_user(request)
+    names = await run_in_threadpool(available_classes)
+    return JSONResponse({'classes': names})
+
+
+async def students(request):
+    require_user(request)
+    info, roster = await run_in_threadpool(_class_or_404, request.path_params['name'])
+    return JSONResponse({
+        'info': {key: None if value is None else str(value) for key, value in info.items()},
+        'students': [
+            {'code_massar': code, 'nom': nom}
+            for code, nom in zip(roster['Code Massar'], roster['Nom'])
+        ],
+    })
+
+
+async def submit_attendance(request):
+    claims = require_user(request)
+    body = await _json_body(request)
+    try:
+        date = format_date(body['date'])
+        time_slot = str(body['time_slot'])
+        absent = set(map(str, body.get('absent', [])))
+    except (KeyError, ValueError, TypeError):
+        raise HTTPException(400, "date, time_slot and absent are required")
+    if time_slot not in TIME_SLOTS:
+        raise HTTPException(400, f"time_slot must be one of: {', '.join(TIME_SLOTS)}")
+
+    info, roster = await run_in_threadpool(_class_or_404, request.path_params['name'])
+    unknown = absent - set(roster['Code Massar'].astype(str))
+    if unknown:
+        raise HTTPException(422, f"Unknown students: {', '.join(sorted(unknown))}")
+    roster['Absence'] = roster['Code Massar'].astype(str).isin(absent)
+
+    store = absence_store()
+    ticket = await run_in_threadpool(
+        get_writer(store).submit, roster, info['Classe'], date, time_slot)
+    return JSONResponse({
+        'ticket': ticket,
+        'absences': len(absent),
+        'submitted_by': claims['sub'],
+    }, status_code=202)
+
+
+async def attendance_status(request):
+    require_user(request)
+    status = get_writer(absence_store()).status(request.path_params['ticket'])
+    if status is None:
+        raise HTTPException(404, "Unknown ticket")
+    return JSONResponse(status)
+
+
+async def statistics(request):
+    require_user(request)
+    name = request.path_params['name']
+    params = request.query_params
+    try:
+        if 'month' in params:
+            today = pd.Timestamp.today()
+            start, end = month_bounds(int(params.get('year', today.year)), int(params['month']))
+        else:
+            start, end = params.get('start'), params.get('end')
+            start = format_date(start) if start else None
+            end = format_date(end) if end else None
+    except ValueError:
+        raise HTTPException(400, "Invalid period")
+
+    def compute():
+        df = absence_store().query(name, start, end)
+        counts = df.groupby(['Code Massar', 'Nom'], as_index=False).size()
+        counts = counts.sort_values('size', ascending=False)
+        return {
+            'class': name,
+            'start': start,
+            'end': end,
+            'total_absences': len(df),
+            'students_absent': int(df['Code Massar'].nunique()),
+            'days_with_absences': int(df['Date'].nunique()),
+            'by_student': [
+                {'code_massar': code, 'nom': nom, 'absences': int(n)}
+                for code, nom, n in counts.itertuples(index=False)
+            ],
+        }
+
+    return JSONResponse(await run_in_threadpool(compute))
+
+
+async def student_absences(request):
+    require_user(request)
+    code = request.path_params['code']
+    params = request.query_params
+    try:
+        start = format_date(params['start']) if params.get('start') else None
+        end = format_date(params['end']) if params.get('end') else None
+    except ValueError:
+        raise HTTPException(400, "Invalid period")
+
+    def lookup():
+        history = absence_store().rollups.student_history(code, start, end)
+        return {
+            'code_massar': code,
+            'classes': [{'class': name, 'nom': nom} for name, nom in find_student(code)],
+            'total_absences': len(history),
+            'absences': [
+                {'date': day.strftime('%Y-%m-%d'), 'time_slot': heure, 'class': classe}
+                for day, heure, classe in zip(history['Date'], history['Heure'],
+                                              history['Classe'])
+            ],
+        }
+
+    return JSONResponse(await run_in_threadpool(lookup))
+
+
+async def export(request):
+    require_user(request)
+    params = request.query_params
+    fmt = params.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(400, f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    try:
+        start = format_date(params['start']) if params.get('start') else None
+        end = format_date(params['end']) if params.get('end') else None
+    except ValueError:
+        raise HTTPException(400, "Invalid period")
+
+    path, _ = await run_in_threadpool(
+        export_to_file, absence_store(), fmt, params.getlist('class'), start, end,
+        params.get('student'))
+    # Streamed from disk, then deleted
+    return FileResponse(path, media_type=MIME_TYPES[fmt],
+                        filename=f"absences_{start or 'debut'}_{end or 'fin'}.{fmt}",
+                        background=BackgroundTask(os.unlink, path))
+
+
+async def metrics(request):
+    return PlainTextResponse(render_prometheus(),
+                             media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class MetricsMiddleware:
+    """Time every request per endpoint and count the responses per status class"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched endpoint in the scope
+            endpoint = scope.get('endpoint')
+            name = getattr(endpoint, '__name__', 'not_found')
+            registry = get_registry()
+            registry.observe(f"api.{name}", time.perf_counter() - start)
+            registry.inc(f"api.responses.{status // 100}xx")
+
+
+async def http_error(request, exc):
+    return JSONResponse({'error': exc.detail}, status_code=exc.status_code)
+
+
+routes = [
+    Route('/api/health', health),
+    Route('/api/token', token, methods=['POST']),
+    Route('/api/classes', list_classes),
+    Route('/api/classes/{name}/students', students),
+    Route('/api/classes/{name}/attendance', submit_attendance, methods=['POST']),
+    Route('/api/attendance/{ticket}', attendance_status),
+    Route('/api/classes/{name}/statistics', statistics),
+    Route('/api/students/{code}/absences', student_absences),
+    Route('/api/export', export),
+    Route('/metrics', metrics),
+]
+
+app = Starlette(routes=routes, exception_handlers={HTTPException: http_error},
+                middleware=[Middleware(MetricsMiddleware)])
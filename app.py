@@ -1,24 +1,42 @@
 import streamlit as st
 import pandas as pd
-import os
 from datetime import datetime, timedelta
 import warnings
 import plotly.express as px
-import json
+import plotly.graph_objects as go
+import queue
 from pathlib import Path
 
 # Import authentication functions
 from auth import check_authentication, show_login, show_user_management, logout
+from massar import read_general_info
+from class_cache import load_class
+from class_registry import available_classes, class_path, find_student, save_class_workbook
+from class_import import STATUS_IMPORTED, STATUS_VALID, parse_sources, status_table, write_classes
+from absence_store import format_date, get_store, month_bounds
+from attendance_writer import STATE_FAILED, STATE_SAVED, get_writer
+from school_stats import COUNT_COLUMN, school_report
+from export import MIME_TYPES, export_to_file
+from alerts import SENDERS, alert_settings
+from retention import format_bytes, run_retention
+from metrics import get_registry, maybe_dump, start_trace, timed
+from presence import RATE_COLUMN
+from heatmap import TERMS, current_term, term_bounds
+from student_search import get_student_index
+from warmup import get_warmup, start_warmup, warm_class
+from grades import (
+    ABSENCES_COLUMN, AVERAGE_COLUMN, CORRELATION_COLUMN, correlations, get_gradebook,
+    with_absences
+)
+from config import (
+    CLASSES_DIR, ABSENCE_DIR,
+    load_settings, save_settings, sanitize_filename
+)
 
 
 warnings.simplefilter("ignore", UserWarning)
 pd.set_option('display.max_columns', None)
 
-# Constants
-CLASSES_DIR = "classes"  # New directory for class files
-ABSENCE_DIR = "absences"
-SETTINGS_FILE = "settings.json"
-
 # Theme Configuration
 THEME = {
     'primary': '#1E88E5',
@@ -30,17 +48,6 @@ THEME = {
 }
 
 
-def load_settings():
-    if os.path.exists(SETTINGS_FILE):
-        with open(SETTINGS_FILE, 'r') as f:
-            return json.load(f)
-    return {}
-
-def save_settings(settings):
-    with open(SETTINGS_FILE, 'w') as f:
-        json.dump(settings, f)
-
-
 def apply_custom_theme():
     """Apply custom theme to Streamlit interface"""
     st.markdown("""
@@ -100,71 +107,30 @@ def apply_custom_theme():
 
 
 
-def extract_students(file):
-    try:
-        df = pd.read_excel(file, engine="openpyxl")
-        code_massar = df.iloc[16:, 2].reset_index(drop=True)
-        nom = df.iloc[16:, 3].reset_index(drop=True)
-        # Create DataFrame with Absence column initialized to False
-        return pd.DataFrame({
-            'Code Massar': code_massar,
-            'Nom': nom,
-            'Absence': False  # Initialize all students as present
-        })
-    except Exception as e:
-        st.error(f"Erreur lors de l'extraction des étudiants: {str(e)}")
-        return None
-
-
-def sanitize_filename(name):
-    """
-    Sanitize filename by removing/replacing invalid characters
-    
-    Args:
-        name (str): Original filename
-        
-    Returns:
-        str: Sanitized filename safe for filesystem
-    """
-    # Replace invalid characters with underscores
-    invalid_chars = '<>:"/\\|?*'
-    for char in invalid_chars:
-        name = name.replace(char, '_')
-    
-    # Remove any other potentially problematic characters
-    name = ''.join(c for c in name if c.isprintable())
-    
-    # Limit length to avoid potential issues
-    return name[:100]
+def get_absence_store():
+    """Return the absence store selected in the settings"""
+    return get_store(load_settings().get('absence_backend', 'sqlite'))
 
 
+@timed("save_attendance_data")
 def save_attendance_data(df_students, class_name, date, time_slot):
     """
-    Save attendance data to class-specific directory
+    Save attendance data to the absence store
+
+    The session is handed to the background writer, the click returns as
+    soon as it is journaled. Falls back to a direct write when the write
+    queue stays full.
     """
     try:
-        # Get absent students
-        absences = df_students[df_students['Absence']].copy()
-        
-        if len(absences) > 0:
-            # Create class directory if it doesn't exist
-            safe_class_name = sanitize_filename(class_name)
-            class_dir = Path(ABSENCE_DIR) / safe_class_name
-            class_dir.mkdir(exist_ok=True)
-            
-            # Create filename with date and time
-            safe_date = date.strftime('%Y-%m-%d')
-            safe_time = time_slot.replace(':', '_')
-            filename = class_dir / f'absences_{safe_date}_{safe_time}.xlsx'
-            
-            # Add date and time information
-            absences['Date'] = safe_date
-            absences['Heure'] = time_slot
-            absences['Classe'] = class_name
-            
-            # Save to Excel
-            absences.to_excel(filename, index=False)
-            st.success(f"✅ Absences enregistrées dans {filename}")
+        store = get_absence_store()
+        absent = int(df_students['Absence'].sum())
+        try:
+            ticket = get_writer(store).submit(df_students, class_name, date, time_slot)
+            st.session_state['last_attendance_ticket'] = (id(store), ticket)
+        except queue.Full:
+            store.save_session(df_students, class_name, date, time_slot)
+        if absent > 0:
+            st.success(f"✅ {absent} absence(s) enregistrée(s) pour {class_name}")
         else:
             st.info("ℹ️ Aucune absence à enregistrer")
             
@@ -172,46 +138,44 @@ def save_attendance_data(df_students, class_name, date, time_slot):
         st.error(f"Erreur lors de l'enregistrement des absences: {str(e)}")
 
 
+def show_last_save_status():
+    """Show the write status of the last session submitted in this session"""
+    last = st.session_state.get('last_attendance_ticket')
+    store = get_absence_store()
+    if not last or last[0] != id(store):
+        return
+    status = get_writer(store).status(last[1])
+    if status is None:
+        return
+    label = f"{status['class_name']} · {status['date']} · {status['time_slot']}"
+    if status['state'] == STATE_SAVED:
+        st.caption(f"💾 Dernière séance écrite sur disque à {status['saved_at'][11:]} ({label})")
+    elif status['state'] == STATE_FAILED:
+        st.error(f"Échec de l'écriture de la séance {label}: {status['error']}")
+    else:
+        st.caption(f"⏳ Écriture en cours de la séance {label}")
+
+
 def init_directories():
     """Initialize necessary directories"""
     for directory in [CLASSES_DIR, ABSENCE_DIR]:
         Path(directory).mkdir(exist_ok=True)
 
 def save_class_file(uploaded_file, class_name):
-    """Save uploaded class file with sanitized name"""
-    safe_class_name = sanitize_filename(class_name)
-    file_path = Path(CLASSES_DIR) / f"{safe_class_name}.xlsx"
-    with open(file_path, 'wb') as f:
-        f.write(uploaded_file.getvalue())
+    """Save uploaded class file with sanitized name and warm its caches"""
+    file_path = save_class_workbook(uploaded_file.getvalue(), class_name)
+    warm_class(get_absence_store(), class_name)
     return file_path
 
+@timed("get_available_classes")
 def get_available_classes():
     """Get list of available class files"""
-    return [f.stem for f in Path(CLASSES_DIR).glob('*.xlsx')]
+    return available_classes()
 
+@timed("extract_general_info")
 def extract_general_info(file):
     try:
-        df_annee = pd.read_excel(file, skiprows=12, engine="openpyxl")
-        df_semestre = pd.read_excel(file, skiprows=10, engine="openpyxl")
-        df_matiere = pd.read_excel(file, skiprows=10, engine="openpyxl")
-        df_academie = pd.read_excel(file, skiprows=6, engine="openpyxl")
-        df_province = pd.read_excel(file, skiprows=6, engine="openpyxl")
-        df_ecole = pd.read_excel(file, skiprows=6, engine="openpyxl")
-        df_niveau = pd.read_excel(file, skiprows=8, engine="openpyxl")
-        df_professeur = pd.read_excel(file, skiprows=8, engine="openpyxl")
-        df_classe = pd.read_excel(file, skiprows=8, engine="openpyxl")
-
-        return {
-            'Année Scolaire': df_annee.columns[3],
-            'Semestre': df_semestre.columns[3],
-            'Matière': df_matiere.columns[14],
-            'Académie': df_academie.columns[3],
-            'Province': df_province.columns[8],
-            'Ecole': df_ecole.columns[14],
-            'Niveau': df_niveau.columns[3],
-            'Professeur': df_professeur.columns[14],
-            'Classe': df_classe.columns[8],
-        }
+        return read_general_info(file)
     except Exception as e:
         st.error(f"Erreur lors de l'extraction des informations: {str(e)}")
         return None
@@ -220,13 +184,27 @@ def show_class_management():
     """New function to handle class file uploads"""
     st.subheader("📚 Gestion des Classes")
     
-    uploaded_file = st.file_uploader("📂 Importer un nouveau fichier de classe", type=["xlsx"])
+    report = st.session_state.pop('bulk_import_report', None)
+    if report is not None:
+        st.dataframe(report, use_container_width=True, hide_index=True)
+        st.success("✅ Import terminé")
+
+    # A new key empties the uploader once a batch is saved
+    uploaded_files = st.file_uploader(
+        "📂 Importer des fichiers de classe (exports Massar, listes d'élèves ou archive zip)",
+        type=["xlsx", "xls", "zip"],
+        accept_multiple_files=True,
+        key=f"class_upload_{st.session_state.get('class_upload_round', 0)}"
+    )
     
-    if uploaded_file:
+    if len(uploaded_files) > 1 or (uploaded_files and not uploaded_files[0].name.lower().endswith('.xlsx')):
+        show_bulk_import(uploaded_files)
+    elif uploaded_files:
+        uploaded_file = uploaded_files[0]
         general_info = extract_general_info(uploaded_file)
         if general_info:
             st.success("✅ Informations de classe extraites avec succès")
-            
+        
             # Show class information
             with st.expander("🏫 Informations de la Classe", expanded=True):
                 cols = st.columns(3)
@@ -238,7 +216,7 @@ def show_class_management():
                                 <div class="metric-value">{value}</div>
                             </div>
                         """, unsafe_allow_html=True)
-            
+        
             if st.button("💾 Enregistrer la Classe"):
                 try:
                     file_path = save_class_file(uploaded_file, general_info['Classe'])
@@ -255,6 +233,30 @@ def show_class_management():
     else:
         st.info("Aucune classe enregistrée")
 
+def show_bulk_import(uploaded_files):
+    """Validate many uploaded files in parallel and save every class at once"""
+    batch_key = tuple((f.name, f.size) for f in uploaded_files)
+    if st.session_state.get('bulk_import_key') != batch_key:
+        with st.spinner("Analyse des fichiers..."):
+            st.session_state['bulk_import_results'] = parse_sources(
+                (f.name, f.getvalue()) for f in uploaded_files
+            )
+        st.session_state['bulk_import_key'] = batch_key
+    results = st.session_state['bulk_import_results']
+    
+    valid = sum(1 for r in results if r['Statut'] == STATUS_VALID)
+    st.dataframe(status_table(results), use_container_width=True, hide_index=True)
+    
+    if valid and st.button(f"💾 Enregistrer {valid} classe(s)"):
+        write_classes(results)
+        store = get_absence_store()
+        for class_name in {r['Classe'] for r in results if r['Statut'] == STATUS_IMPORTED}:
+            warm_class(store, class_name)
+        # The statuses now read imported, the batch cannot be saved twice
+        st.session_state['bulk_import_report'] = status_table(results)
+        st.session_state['class_upload_round'] = st.session_state.get('class_upload_round', 0) + 1
+        st.rerun()
+
 def show_attendance_management():
     """Modified attendance management with class selection"""
     st.subheader("📝 Gestion des Présences")
@@ -265,13 +267,14 @@ def show_attendance_management():
         st.warning("⚠️ Aucune classe disponible. Veuillez d'abord importer des classes.")
         return
         
-    selected_class = st.selectbox("Sélectionner une classe", available_classes)
+    if st.session_state.get('attendance_class') not in available_classes:
+        st.session_state.pop('attendance_class', None)
+    selected_class = st.selectbox("Sélectionner une classe", available_classes,
+                                  key="attendance_class")
     
     # Load selected class file
     try:
-        file_path = Path(CLASSES_DIR) / f"{selected_class}.xlsx"
-        class_info = extract_general_info(file_path)
-        students_df = extract_students(file_path)
+        class_info, students_df = load_class(class_path(selected_class))
         
         if class_info and students_df is not None:
             # Display class info
@@ -310,41 +313,50 @@ def show_attendance_management():
         st.error(f"Erreur lors du chargement de la classe: {str(e)}")
 
 def show_attendance_interface(df_students, class_name, date, time_slot):
-    """Separated attendance interface logic"""
+    """
+    Separated attendance interface logic
+
+    The roster is edited inside a form: ticking absences does not rerun
+    the script, the whole session is submitted in one round-trip.
+    """
     st.subheader("👨‍🎓 Gestion des Présences")
     
+    editor_key = f"attendance_{sanitize_filename(class_name)}_{date}_{time_slot}"
+    default_key = f"{editor_key}_default"
+    
     # Quick Actions
     col1, col2 = st.columns(2)
     with col1:
         if st.button("✅ Marquer tous présents"):
-            df_students['Absence'] = False
+            st.session_state[default_key] = False
+            st.session_state.pop(editor_key, None)
     with col2:
         if st.button("❌ Marquer tous absents"):
-            df_students['Absence'] = True
+            st.session_state[default_key] = True
+            st.session_state.pop(editor_key, None)
     
-    # Student Cards
-    for i in range(0, len(df_students), 5):
-        cols = st.columns(5)
-        for j, col in enumerate(cols):
-            if i + j < len(df_students):
-                student = df_students.iloc[i + j]
-                with col:
-                    is_absent = st.checkbox(
-                        f"Absent - {student['Nom']}",
-                        key=f"absent_{student['Code Massar']}"
-                    )
-                    df_students.loc[df_students.index[i + j], 'Absence'] = is_absent
-                    
-                    st.markdown(f"""
-                        <div class="student-card {'absent' if is_absent else ''}">
-                            <div class="metric-title">{student['Nom']}</div>
-                            <div class="metric-value">{'Absent' if is_absent else 'Présent'}</div>
-                        </div>
-                    """, unsafe_allow_html=True)
+    df_students['Absence'] = st.session_state.get(default_key, False)
+    
+    # Student Roster
+    with st.form(f"{editor_key}_form"):
+        edited_students = st.data_editor(
+            df_students,
+            key=editor_key,
+            hide_index=True,
+            use_container_width=True,
+            height=min(40 + 35 * len(df_students), 1200),
+            disabled=['Code Massar', 'Nom'],
+            column_config={
+                'Absence': st.column_config.CheckboxColumn("Absent", default=False)
+            }
+        )
+        
+        # Save Absences
+        submitted = st.form_submit_button("💾 Enregistrer les Absences", type="primary")
     
-    # Save Absences
-    if st.button("💾 Enregistrer les Absences", type="primary"):
-        save_attendance_data(df_students, class_name, date, time_slot)
+    if submitted:
+        save_attendance_data(edited_students, class_name, date, time_slot)
+    show_last_save_status()
 
 
 def show_statistics():
@@ -358,103 +370,246 @@ def show_statistics():
             st.info("Aucune donnée d'absence disponible")
             return
             
+        with st.expander("📥 Exporter un rapport"):
+            show_export(classes)
+
         selected_class = st.selectbox("Sélectionner une classe", classes)
         
         # Month selection
         current_date = datetime.now()
-        selected_month = st.selectbox(
-            "Sélectionner un mois",
-            range(1, 13),
-            index=current_date.month - 1,
-            format_func=lambda x: datetime(2024, x, 1).strftime('%B')
-        )
+        col1, col2 = st.columns(2)
+        with col1:
+            selected_month = st.selectbox(
+                "Sélectionner un mois",
+                range(1, 13),
+                index=current_date.month - 1,
+                format_func=lambda x: datetime(2024, x, 1).strftime('%B')
+            )
+        with col2:
+            years = list(range(current_date.year, current_date.year - 4, -1))
+            selected_year = st.selectbox("Sélectionner une année", years)
         
         # Get statistics for selected month
-        df_stats = get_monthly_statistics(selected_class, selected_month)
+        stats = get_monthly_statistics(selected_class, selected_month, selected_year)
+        presence = get_presence_statistics(selected_class, selected_month, selected_year)
+        has_sessions = presence is not None and len(presence) > 0
         
-        # Check if DataFrame is empty before proceeding
-        if df_stats is None or df_stats.empty:
-            st.info("Aucune donnée pour cette période")
-            return
-        
-        # Display statistics only if we have data
-        show_monthly_statistics(df_stats)
+        # Check if there is any absence before proceeding
+        if stats is None or stats['summary']['total'] == 0:
+            st.info("Aucune absence pour cette période" if has_sessions
+                    else "Aucune donnée pour cette période")
+        else:
+            # Display statistics only if we have data
+            show_monthly_statistics(stats)
+
+        if has_sessions:
+            show_presence_statistics(presence)
+
+        show_absence_heatmap(selected_class, selected_year if selected_month >= 9
+                             else selected_year - 1)
         
     except Exception as e:
         st.error(f"Une erreur s'est produite: {str(e)}")
         
-def get_monthly_statistics(class_name, month):
-    """Get statistics for a specific month"""
+def show_export(classes):
+    """Export absences over a period as CSV or Excel"""
+    today = datetime.today().date()
+    school_year_start = datetime(school_year_of_month(9, today), 9, 1).date()
+
+    with st.form("export_form"):
+        export_classes = st.multiselect("Classes (toutes si vide)", classes)
+        col1, col2 = st.columns(2)
+        with col1:
+            start = st.date_input("Du", value=school_year_start, key="export_start")
+        with col2:
+            end = st.date_input("Au", value=today, key="export_end")
+        code_massar = st.text_input("Code Massar de l'élève (optionnel)").strip()
+        fmt = st.radio("Format", ['csv', 'xlsx'], horizontal=True,
+                       format_func=lambda f: "CSV" if f == 'csv' else "Excel")
+        submitted = st.form_submit_button("Générer l'export")
+
+    if submitted:
+        try:
+            previous = st.session_state.pop('export_file', None)
+            if previous:
+                Path(previous['path']).unlink(missing_ok=True)
+            with st.spinner("Export en cours..."):
+                path, count = export_to_file(get_absence_store(), fmt, export_classes,
+                                             start, end, code_massar or None)
+            st.session_state.export_file = {
+                'path': path,
+                'name': f"absences_{start}_{end}.{fmt}",
+                'mime': MIME_TYPES[fmt],
+                'count': count,
+            }
+        except Exception as e:
+            st.error(f"Erreur lors de l'export: {str(e)}")
+
+    export_file = st.session_state.get('export_file')
+    if export_file and Path(export_file['path']).exists():
+        st.caption(f"{export_file['count']} absence(s) exportée(s)")
+        with open(export_file['path'], 'rb') as f:
+            st.download_button("⬇️ Télécharger", f, file_name=export_file['name'],
+                               mime=export_file['mime'])
+
+
+def school_year_of_month(month, today=None):
+    """Return the calendar year of a month within the current school year"""
+    today = today or datetime.today()
+    start_year = today.year if today.month >= 9 else today.year - 1
+    return start_year if month >= 9 else start_year + 1
+
+
+@timed("get_monthly_statistics")
+def get_monthly_statistics(class_name, month, year=None):
+    """
+    Get the pre-aggregated statistics of a month from the rollups
+
+    Args:
+        class_name (str): Class name
+        month (int): Month number
+        year (int): Calendar year, the current school year when None
+
+    Returns:
+        dict: 'summary' metrics and per student, day and slot counts,
+            None on error
+    """
+    if year is None:
+        year = school_year_of_month(month)
+    start, end = month_bounds(year, month)
     try:
-        folder_path = Path(ABSENCE_DIR) / sanitize_filename(class_name)
-        if not folder_path.exists():
-            return pd.DataFrame()
-        
-        all_absences = []
-        for file in folder_path.glob('*.xlsx'):
-            try:
-                df = pd.read_excel(file)
-                if 'Date' not in df.columns:
-                    continue
-                    
-                # Ensure Date column is datetime
-                df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-                
-                # Remove rows with invalid dates
-                df = df.dropna(subset=['Date'])
-                
-                # Filter for selected month
-                df = df[df['Date'].dt.month == month]
-                
-                if not df.empty:
-                    all_absences.append(df)
-                    
-            except Exception as e:
-                st.warning(f"Impossible de lire le fichier {file.name}: {str(e)}")
-                continue
-        
-        if not all_absences:
-            return pd.DataFrame()
-        
-        result_df = pd.concat(all_absences, ignore_index=True)
-        
-        # Ensure required columns exist
-        required_columns = ['Code Massar', 'Nom', 'Date']
-        if not all(col in result_df.columns for col in required_columns):
-            st.error("Les données ne contiennent pas toutes les colonnes requises")
-            return pd.DataFrame()
-            
-        return result_df
-        
+        rollups = get_absence_store().rollups
+        return {
+            'summary': rollups.summary(class_name, start, end),
+            'students': rollups.student_counts(class_name, start, end),
+            'days': rollups.day_counts(class_name, start, end),
+            'slots': rollups.slot_counts(class_name, start, end),
+        }
     except Exception as e:
         st.error(f"Erreur lors de la récupération des statistiques: {str(e)}")
-        return pd.DataFrame()
+        return None
+
+
+@timed("get_presence_statistics")
+def get_presence_statistics(class_name, month, year=None):
+    """
+    Load the presence bitmaps of a class over a month
+
+    Returns:
+        PresenceMatrix: Sessions x students, None on error
+    """
+    if year is None:
+        year = school_year_of_month(month)
+    try:
+        return get_absence_store().presence.load(class_name, *month_bounds(year, month))
+    except Exception as e:
+        st.error(f"Erreur lors de la récupération des présences: {str(e)}")
+        return None
 
-def show_monthly_statistics(df_stats):
+
+def show_presence_statistics(presence):
+    """Display attendance rates, absence streaks and per slot attendance"""
+    try:
+        st.subheader("Assiduité")
+        summary = presence.summary()
+        streaks = presence.streaks()
+        consecutive = int(alert_settings()['alert_consecutive_slots'])
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Séances enregistrées", summary['sessions'])
+        with col2:
+            st.metric(RATE_COLUMN, f"{summary['rate']} %")
+        with col3:
+            st.metric(f"Élèves absents {consecutive} séances de suite ou plus",
+                      int((streaks['Série la plus longue'] >= consecutive).sum()))
+
+        students = presence.rates().merge(streaks.drop(columns='Nom'), on='Code Massar')
+        st.dataframe(students, use_container_width=True, hide_index=True)
+
+        fig = px.bar(presence.slot_coverage(), x='Heure', y=RATE_COLUMN,
+                     hover_data=['Séances', 'Présences attendues', 'Présences'],
+                     title="Taux de présence par créneau", range_y=[0, 100])
+        st.plotly_chart(fig, use_container_width=True)
+        st.caption("Seules les séances enregistrées depuis le suivi des présences sont comptées.")
+    except Exception as e:
+        st.error(f"Erreur lors de l'affichage de l'assiduité: {str(e)}")
+
+
+@timed("get_absence_heatmap")
+def get_absence_heatmap(class_name, start_year, term):
+    """
+    Get the cached student x day absence matrix of a class over a term
+
+    Returns:
+        tuple: (codes, names, days, counts) or None on error
+    """
+    try:
+        return get_absence_store().heatmaps.get(class_name, *term_bounds(start_year, term))
+    except Exception as e:
+        st.error(f"Erreur lors de la récupération du calendrier: {str(e)}")
+        return None
+
+
+@timed("show_absence_heatmap")
+def show_absence_heatmap(class_name, start_year):
+    """Display the absences of a class as a student x school day heatmap"""
+    st.subheader(f"🗓️ Calendrier des absences {start_year}/{start_year + 1}")
+    term = st.radio("Période du calendrier", list(TERMS), format_func=TERMS.get,
+                    index=list(TERMS).index(current_term(start_year)), horizontal=True,
+                    key="heatmap_term")
+    heatmap = get_absence_heatmap(class_name, start_year, term)
+    if heatmap is None:
+        return
+    codes, names, days, counts = heatmap
+    if not counts.any():
+        st.info("Aucune absence sur cette période")
+        return
+
+    try:
+        # Homonyms would share a row of the heatmap
+        duplicated = pd.Series(names).duplicated(keep=False)
+        labels = [f"{nom} ({code})" if dup else nom
+                  for code, nom, dup in zip(codes, names, duplicated)]
+        ticks = days[::max(1, len(days) // 20)]
+        fig = go.Figure(go.Heatmap(
+            z=counts, x=days, y=labels, zmin=0,
+            colorscale=[[0, THEME['surface']], [1, THEME['error']]],
+            xgap=1, ygap=1,
+            colorbar={'title': "Créneaux"},
+            hovertemplate="%{y}<br>%{x}<br>%{z} créneau(x) d'absence<extra></extra>",
+        ))
+        fig.update_xaxes(type='category', tickvals=ticks,
+                         ticktext=[f"{day[8:]}/{day[5:7]}" for day in ticks])
+        fig.update_yaxes(autorange='reversed')
+        fig.update_layout(height=max(300, 18 * len(labels) + 120),
+                          margin={'l': 10, 'r': 10, 't': 30, 'b': 10})
+        st.plotly_chart(fig, use_container_width=True)
+    except Exception as e:
+        st.error(f"Erreur lors de l'affichage du calendrier: {str(e)}")
+
+
+@timed("show_monthly_statistics")
+def show_monthly_statistics(stats):
     """Display monthly statistics"""
     try:
+        summary = stats['summary']
         # Overall metrics
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            total_absences = len(df_stats) if not df_stats.empty else 0
-            st.metric("Total des absences", total_absences)
+            st.metric("Total des absences", summary['total'])
             
         with col2:
-            unique_students = df_stats['Code Massar'].nunique() if not df_stats.empty else 0
-            st.metric("Étudiants uniques absents", unique_students)
+            st.metric("Étudiants uniques absents", summary['students'])
             
         with col3:
-            unique_days = df_stats['Date'].nunique() if not df_stats.empty else 0
-            st.metric("Jours avec absences", unique_days)
+            st.metric("Jours avec absences", summary['days'])
         
-        if df_stats.empty:
+        if summary['total'] == 0:
             return
             
         # Student-wise absence count
-        student_absences = df_stats.groupby(['Code Massar', 'Nom'], as_index=False).size()
-        student_absences.columns = ['Code Massar', 'Nom', "Nombre d'absences"]
-        student_absences = student_absences.sort_values("Nombre d'absences", ascending=False)
+        student_absences = stats['students']
         
         # Display detailed student statistics
         st.subheader("Détail des absences par élève")
@@ -475,11 +630,321 @@ def show_monthly_statistics(df_stats):
                 height=500
             )
             st.plotly_chart(fig, use_container_width=True)
+
+        col1, col2 = st.columns(2)
+        with col1:
+            fig = px.bar(stats['days'], x='Date', y=COUNT_COLUMN, title="Absences par jour")
+            st.plotly_chart(fig, use_container_width=True)
+        with col2:
+            fig = px.bar(stats['slots'], x='Heure', y=COUNT_COLUMN, title="Absences par créneau")
+            st.plotly_chart(fig, use_container_width=True)
             
     except Exception as e:
         st.error(f"Erreur lors de l'affichage des statistiques: {str(e)}")
 
 
+def show_student_history():
+    """Absence history of one student, across every class"""
+    st.subheader("🧑‍🎓 Historique d'un Élève")
+
+    try:
+        today = datetime.today().date()
+        school_year_start = datetime(school_year_of_month(9, today), 9, 1).date()
+        col1, col2 = st.columns(2)
+        with col1:
+            code_massar = st.text_input("Code Massar", key="history_code").strip()
+        with col2:
+            period = st.date_input("Période", value=(school_year_start, today),
+                                   key="history_period")
+        if not code_massar:
+            return
+        if not isinstance(period, (tuple, list)) or len(period) != 2:
+            st.info("Sélectionnez une date de début et une date de fin")
+            return
+        start, end = period
+
+        rosters = find_student(code_massar)
+        history = get_absence_store().rollups.student_history(
+            code_massar, format_date(start), format_date(end))
+        if rosters:
+            classes = ", ".join(class_name for class_name, _ in rosters)
+            st.markdown(f"**{rosters[0][1]}** — Classe(s) : {classes}")
+            cols = st.columns(len(rosters))
+            for col, (class_name, _) in zip(cols, rosters):
+                with col:
+                    st.button(f"📝 Ouvrir {class_name}", key=f"history_open_{class_name}",
+                              on_click=open_class, args=(class_name,))
+        elif history.empty:
+            st.info("Aucun élève ni absence pour ce Code Massar")
+            return
+
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Total des absences", len(history))
+        with col2:
+            st.metric("Jours avec absences", history['Date'].nunique())
+        with col3:
+            st.metric("Classes", history['Classe'].nunique())
+
+        if history.empty:
+            st.info("Aucune absence pour cette période")
+            return
+
+        monthly = history.groupby(history['Date'].dt.strftime('%Y-%m')).size().reset_index()
+        monthly.columns = ['Mois', COUNT_COLUMN]
+        fig = px.bar(monthly, x='Mois', y=COUNT_COLUMN, title="Absences par mois")
+        st.plotly_chart(fig, use_container_width=True)
+
+        history['Date'] = history['Date'].dt.strftime('%d/%m/%Y')
+        st.dataframe(history[['Date', 'Heure', 'Classe']], use_container_width=True,
+                     hide_index=True)
+
+    except Exception as e:
+        st.error(f"Erreur lors de la récupération de l'historique: {str(e)}")
+
+
+def open_class(class_name):
+    """Jump to the attendance page of a class"""
+    st.session_state['menu'] = "Gestion des Présences"
+    st.session_state['attendance_class'] = class_name
+
+
+def open_student(code_massar, class_name):
+    """Jump to the history of a student, their class preselected for attendance"""
+    st.session_state['menu'] = "Historique Élève"
+    st.session_state['history_code'] = code_massar
+    st.session_state['attendance_class'] = class_name
+    st.session_state['student_search'] = ""
+
+
+@timed("search_students")
+def search_students(query):
+    """Find students by partial name or Code Massar in every saved class"""
+    index = get_student_index()
+    index.refresh()
+    return index.search(query, limit=10)
+
+
+def show_student_search():
+    """Sidebar search box across the rosters of every class"""
+    query = st.sidebar.text_input("🔍 Rechercher un élève", key="student_search",
+                                  placeholder="Nom ou Code Massar")
+    if not query.strip():
+        return
+    try:
+        results = search_students(query)
+    except Exception as e:
+        st.sidebar.error(f"Erreur lors de la recherche: {str(e)}")
+        return
+    if not results:
+        st.sidebar.caption("Aucun élève trouvé")
+    for i, (class_name, code, nom) in enumerate(results):
+        st.sidebar.button(f"{nom} · {class_name}", key=f"student_search_{i}", help=code,
+                          on_click=open_student, args=(code, class_name),
+                          use_container_width=True)
+
+
+def show_school_statistics():
+    """School-wide statistics across every class"""
+    st.subheader("🏫 Statistiques de l'Établissement")
+
+    try:
+        today = datetime.today().date()
+        school_start = today.replace(year=today.year if today.month >= 9 else today.year - 1,
+                                     month=9, day=1)
+        period = st.date_input("Période", value=(school_start, today))
+        if not isinstance(period, (tuple, list)) or len(period) != 2:
+            st.info("Sélectionnez une date de début et une date de fin")
+            return
+        start, end = period
+
+        reports = school_report(get_absence_store(), start, end)
+        df_absences = reports.pop('absences')
+        if df_absences.empty:
+            st.info("Aucune donnée pour cette période")
+            return
+
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Total des absences", len(df_absences))
+        with col2:
+            st.metric("Étudiants uniques absents", df_absences['Code Massar'].nunique())
+        with col3:
+            st.metric("Classes concernées", df_absences['Classe'].nunique())
+
+        tabs = st.tabs(list(reports))
+        for tab, (name, report) in zip(tabs, reports.items()):
+            with tab:
+                if name != 'Par élève':
+                    x = report.columns[1] if name == 'Par classe' else report.columns[0]
+                    fig = px.bar(report, x=x, y=COUNT_COLUMN, title=f"Absences {name.lower()}")
+                    fig.update_layout(showlegend=False, height=400)
+                    st.plotly_chart(fig, use_container_width=True)
+                st.dataframe(report, use_container_width=True)
+
+    except Exception as e:
+        st.error(f"Erreur lors du calcul des statistiques: {str(e)}")
+
+
+@timed("get_grades_statistics")
+def get_grades_statistics(start, end):
+    """
+    Join the grades of every saved class to the absences of a period
+
+    Returns:
+        pd.DataFrame: One row per student with a grades row, None on error
+    """
+    try:
+        book = get_gradebook()
+        book.sync()
+        counts = get_absence_store().student_counts(None, format_date(start), format_date(end))
+        return with_absences(book.grades(), counts)
+    except Exception as e:
+        st.error(f"Erreur lors de la lecture des notes: {str(e)}")
+        return None
+
+
+def show_grades_statistics():
+    """Grades of the continuous assessments against absences"""
+    st.subheader("📝 Notes et Absences")
+
+    try:
+        today = datetime.today().date()
+        school_start = today.replace(year=today.year if today.month >= 9 else today.year - 1,
+                                     month=9, day=1)
+        period = st.date_input("Période des absences", value=(school_start, today),
+                               key="grades_period")
+        if not isinstance(period, (tuple, list)) or len(period) != 2:
+            st.info("Sélectionnez une date de début et une date de fin")
+            return
+
+        df = get_grades_statistics(*period)
+        if df is None:
+            return
+        graded = df[df[AVERAGE_COLUMN].notna()]
+        if graded.empty:
+            st.info("Aucune note trouvée dans les fichiers de classe")
+            return
+
+        overall = correlations(graded.assign(Tous="Établissement"), 'Tous')
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Élèves notés", len(graded))
+        with col2:
+            st.metric("Moyenne générale", f"{graded[AVERAGE_COLUMN].mean():.2f}")
+        with col3:
+            r = overall[CORRELATION_COLUMN].iloc[0]
+            st.metric("Corrélation absences / moyenne", "—" if pd.isna(r) else f"{r:.2f}")
+
+        tab_class, tab_subject = st.tabs(["Par classe", "Par matière"])
+        with tab_class:
+            st.dataframe(correlations(graded, 'Classe'), use_container_width=True,
+                         hide_index=True)
+        with tab_subject:
+            st.dataframe(correlations(graded, 'Matière'), use_container_width=True,
+                         hide_index=True)
+
+        scope = st.selectbox("Nuage de points", ["Tout l'établissement"]
+                             + sorted(graded['Classe'].unique()))
+        points = graded if scope == "Tout l'établissement" else graded[graded['Classe'] == scope]
+        fig = px.scatter(points, x=ABSENCES_COLUMN, y=AVERAGE_COLUMN, color='Classe',
+                         hover_data=['Nom', 'Code Massar', 'Matière'],
+                         title="Moyenne des contrôles continus selon les absences")
+        fig.update_layout(height=500)
+        st.plotly_chart(fig, use_container_width=True)
+        st.caption("Un coefficient proche de -1 indique que les élèves les plus absents "
+                   "ont les moyennes les plus faibles.")
+
+    except Exception as e:
+        st.error(f"Erreur lors de l'analyse des notes: {str(e)}")
+
+
+def show_alert_settings(settings):
+    """Alert rules, digest and sender settings, with the pending alerts"""
+    current = alert_settings(settings)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        settings['alert_max_absences'] = st.number_input(
+            "Alerte au-delà de N absences", min_value=1,
+            value=int(current['alert_max_absences'])
+        )
+    with col2:
+        settings['alert_window_days'] = st.number_input(
+            "Sur une période glissante de (jours)", min_value=1,
+            value=int(current['alert_window_days'])
+        )
+    with col3:
+        settings['alert_consecutive_slots'] = st.number_input(
+            "Alerte après M séances consécutives", min_value=1,
+            value=int(current['alert_consecutive_slots'])
+        )
+
+    col1, col2 = st.columns(2)
+    with col1:
+        settings['alert_digest_minutes'] = st.number_input(
+            "Regrouper les alertes pendant (minutes)", min_value=0,
+            value=int(current['alert_digest_minutes'])
+        )
+    with col2:
+        senders = sorted(SENDERS)
+        settings['alert_sender'] = st.selectbox(
+            "Envoi", senders, index=senders.index(current['alert_sender']),
+            format_func=lambda x: {'file': "Fichiers .eml (absences/outbox)",
+                                   'smtp': "Serveur SMTP"}.get(x, x)
+        )
+    if settings['alert_sender'] == 'smtp':
+        col1, col2 = st.columns(2)
+        with col1:
+            settings['smtp_host'] = st.text_input("Serveur SMTP", value=current['smtp_host'])
+        with col2:
+            settings['smtp_port'] = st.number_input("Port SMTP", min_value=1, max_value=65535,
+                                                    value=int(current['smtp_port']))
+
+    engine = get_absence_store().alerts
+    pending = engine.pending()
+    st.caption(f"{len(pending)} alerte(s) en attente d'envoi")
+    if pending and st.button("Envoyer les alertes maintenant"):
+        try:
+            sent = engine.send_digest(force=True)
+            st.success(f"{sent} alerte(s) envoyée(s)")
+        except Exception as e:
+            st.error(f"Erreur lors de l'envoi des alertes: {str(e)}")
+
+
+def show_retention(retention_days):
+    """Run the retention job, as a simulation or for real"""
+    archive = st.checkbox("Archiver les absences supprimées (absences/archive)", value=True)
+    col1, col2 = st.columns(2)
+    with col1:
+        simulate = st.button("Simuler le nettoyage")
+    with col2:
+        apply = st.button("Appliquer le nettoyage")
+    if not (simulate or apply):
+        return
+
+    try:
+        with st.spinner("Nettoyage en cours..."):
+            report = run_retention(get_absence_store(), ABSENCE_DIR, retention_days,
+                                   archive=archive, dry_run=simulate)
+        prefix = "Simulation : " if report['dry_run'] else ""
+        st.success(
+            f"{prefix}{report['rows_removed']} absence(s) antérieure(s) au {report['cutoff']} "
+            f"supprimée(s), {report['files_merged']} fichier(s) fusionné(s), "
+            f"{report['legacy_files_removed']} ancien(s) classeur(s) supprimé(s)"
+        )
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Fichiers récupérés", report['files_reclaimed'])
+        with col2:
+            st.metric("Espace récupéré", format_bytes(report['bytes_reclaimed']))
+        with col3:
+            st.metric("Enregistrements du journal", report['journal_records_removed'])
+        if report['archives']:
+            st.caption("Archives : " + ", ".join(Path(p).name for p in report['archives']))
+    except Exception as e:
+        st.error(f"Erreur lors du nettoyage des données: {str(e)}")
+
+
 def show_settings():
     st.subheader("⚙️ Paramètres")
     
@@ -497,6 +962,7 @@ def show_settings():
             "Email pour les notifications",
             value=settings.get('email', '')
         )
+        show_alert_settings(settings)
     
     # Data Retention
     st.subheader("Conservation des données")
@@ -505,7 +971,16 @@ def show_settings():
         min_value=30,
         value=settings.get('data_retention_days', 365)
     )
-    
+    show_retention(settings['data_retention_days'])
+
+    # Absence Storage: not switchable here, the other backend would not see the data
+    backend = settings.get('absence_backend', 'sqlite')
+    st.caption(
+        "Stockage des absences : "
+        + {'sqlite': "Base SQLite", 'xlsx': "Un fichier Excel par séance"}[backend]
+        + " (les classeurs Excel s'importent dans SQLite avec `python cli.py migrate-absences`)"
+    )
+
     # Save Settings
     if st.button("Sauvegarder les paramètres"):
         save_settings(settings)
@@ -513,6 +988,48 @@ def show_settings():
 
 
 
+def show_warmup_progress():
+    """Show the progress of the background cache warmup, for admins"""
+    progress = get_warmup().progress()
+    if progress['running']:
+        st.sidebar.progress(progress['done'] / progress['total'],
+                            text=f"⏳ Préchargement : {progress['done']}/{progress['total']}")
+    elif progress['failed']:
+        st.sidebar.warning(f"Préchargement incomplet : {', '.join(progress['failed'])}")
+    elif progress['total']:
+        st.sidebar.caption(f"✅ Préchargement de {progress['total']} tâche(s) "
+                           f"terminé en {progress['seconds']:.1f} s")
+
+
+def show_metrics_panel(trace):
+    """Show where the time of the current rerun went, for admins"""
+    total = trace.elapsed()
+    spans = trace.breakdown()
+    measured = sum(seconds for _, _, seconds, depth in spans if depth == 0)
+    with st.sidebar.expander("⏱️ Performances"):
+        st.caption(f"Cet affichage : {total * 1000:.0f} ms, dont "
+                   f"{(total - measured) * 1000:.0f} ms hors opérations mesurées "
+                   "(widgets, graphiques, rendu)")
+        if spans:
+            st.dataframe(pd.DataFrame({
+                'Opération': ["· " * depth + name for name, _, _, depth in spans],
+                'Durée (ms)': [round(seconds * 1000, 1) for _, _, seconds, _ in spans],
+            }), hide_index=True, use_container_width=True)
+
+        operations = get_registry().snapshot()['operations']
+        if operations:
+            st.caption("Depuis le démarrage du serveur")
+            st.dataframe(pd.DataFrame([
+                {
+                    'Opération': name,
+                    'Appels': op['count'],
+                    'Moyenne (ms)': round(op['mean'] * 1000, 1),
+                    'p95 (ms) ≤': round(op['p95'] * 1000, 1),
+                    'Max (ms)': round(op['max'] * 1000, 1),
+                }
+                for name, op in sorted(operations.items())
+            ]), hide_index=True, use_container_width=True)
+
 
 def main():
     st.set_page_config(
@@ -520,8 +1037,13 @@ def main():
         page_icon="📚",
         layout="wide"
     )
+    trace = start_trace()
     
     init_directories()
+    try:
+        start_warmup(get_absence_store())
+    except Exception as e:
+        st.error(f"Erreur lors du préchargement: {str(e)}")
     apply_custom_theme()
 
         # Check authentication
@@ -532,6 +1054,7 @@ def main():
     # Show logout button in sidebar
     st.sidebar.write(f"👤 Connected as: {st.session_state.user_name}")
     logout()
+    show_student_search()
     
     
     st.title("📚 Système de Gestion des Présences")
@@ -553,12 +1076,13 @@ def main():
 
 
     # Enhanced navigation with role-based access
-    menu_options = ["Gestion des Classes", "Gestion des Présences", "Statistiques"]
+    menu_options = ["Gestion des Classes", "Gestion des Présences", "Statistiques",
+                    "Historique Élève", "Statistiques Établissement", "Notes et Absences"]
     if st.session_state.user_role == "admin":
         menu_options.append("Gestion des Utilisateurs")
         menu_options.append("Paramètres")
     
-    menu = st.sidebar.selectbox("Navigation", menu_options)
+    menu = st.sidebar.selectbox("Navigation", menu_options, key="menu")
     
     if menu == "Gestion des Classes":
         show_class_management()
@@ -566,10 +1090,25 @@ def main():
         show_attendance_management()
     elif menu == "Statistiques":
         show_statistics()
+    elif menu == "Historique Élève":
+        show_student_history()
+    elif menu == "Statistiques Établissement":
+        show_school_statistics()
+    elif menu == "Notes et Absences":
+        show_grades_statistics()
     elif menu == "Gestion des Utilisateurs" and st.session_state.user_role == "admin":
         show_user_management()
     elif menu == "Paramètres" and st.session_state.user_role == "admin":
         show_settings()
 
+    get_registry().observe("rerun", trace.elapsed())
+    if st.session_state.user_role == "admin":
+        show_warmup_progress()
+        show_metrics_panel(trace)
+    try:
+        maybe_dump()
+    except OSError:
+        pass
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
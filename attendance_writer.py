@@ -0,0 +1,211 @@
+"""
+Write-behind queue for attendance sessions
+
+submit() journals the session (a short append + fsync) and returns a
+ticket right away; a background thread writes the pending sessions to the
+absence store in batches. Sessions submitted again for the same class,
+date and time slot before being written are coalesced, only the latest
+version is written. After each batch the journal checkpoint moves past
+the written sessions (absence_store.commit_journal). Pending sessions are
+flushed at interpreter exit, and remain after the checkpoint if the
+process dies first: the next process to open the store applies them
+(absence_store.recover_journal).
+"""
+import atexit
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from absence_store import commit_journal, session_record
+from metrics import inc, timed
+
+
+DEFAULT_MAX_PENDING = 256
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_BATCH_DELAY = 0.05  # seconds spent gathering a batch
+MAX_TICKETS = 4096  # finished tickets kept for status queries
+
+STATE_PENDING = 'pending'
+STATE_SAVED = 'saved'
+STATE_FAILED = 'failed'
+
+logger = logging.getLogger(__name__)
+
+
+class AttendanceWriter:
+    """Background writer of attendance sessions for one absence store"""
+
+    def __init__(self, store, max_pending=DEFAULT_MAX_PENDING,
+                 batch_size=DEFAULT_BATCH_SIZE, batch_delay=DEFAULT_BATCH_DELAY):
+        self.store = store
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._pending = OrderedDict()  # (class, date, slot) -> (record, [tickets])
+        self._tickets = OrderedDict()  # ticket -> status dict
+        self._ticket_ids = itertools.count(1)
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._given_up = set()  # sessions that failed, not to hold the checkpoint back
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="attendance-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, df_students, class_name, date, time_slot, timeout=5.0):
+        """
+        Queue a roll-call session for writing
+
+        Returns:
+            str: Ticket to pass to status()
+
+        Raises:
+            queue.Full: More than max_pending sessions wait for more than
+                timeout seconds
+            RuntimeError: The writer was closed
+        """
+        record = session_record(df_students, class_name, date, time_slot)
+        key = (record['class_name'], record['date'], record['time_slot'])
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Attendance writer is closed")
+            if key not in self._pending and not self._condition.wait_for(
+                    lambda: len(self._pending) < self.max_pending or self._closed, timeout):
+                raise queue.Full("Attendance write queue is full")
+            self.store.journal(record)
+
+            ticket = f"{next(self._ticket_ids)}"
+            self._tickets[ticket] = {
+                'state': STATE_PENDING,
+                'class_name': record['class_name'],
+                'date': record['date'],
+                'time_slot': record['time_slot'],
+                'absences': len(record['absences']),
+                'submitted_at': record['saved_at'],
+                'saved_at': None,
+                'error': None,
+            }
+            previous = self._pending.pop(key, None)
+            tickets = (previous[1] if previous else []) + [ticket]
+            self._pending[key] = (record, tickets)
+            self._condition.notify_all()
+        return ticket
+
+    def status(self, ticket):
+        """Return the status dict of a ticket, None when unknown"""
+        with self._condition:
+            status = self._tickets.get(ticket)
+            return dict(status) if status else None
+
+    def pending_count(self):
+        """Return the number of sessions not written yet"""
+        with self._condition:
+            return len(self._pending) + self._in_flight
+
+    def flush(self, timeout=None):
+        """Wait until every submitted session is written, True on success"""
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._pending and not self._in_flight, timeout)
+
+    def close(self, timeout=None):
+        """Flush pending sessions and stop the writer thread"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+    def _take_batch(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending or self._closed)
+            if not self._pending:
+                return None
+        if not self._closed:
+            # Let a burst of submissions accumulate and coalesce
+            time.sleep(self.batch_delay)
+        with self._condition:
+            batch = []
+            while self._pending and len(batch) < self.batch_size:
+                batch.append(self._pending.popitem(last=False)[1])
+            self._in_flight = len(batch)
+            self._condition.notify_all()
+            return batch
+
+    def _finish(self, batch, errors):
+        with self._condition:
+            now = datetime.now().isoformat(timespec='seconds')
+            for (_, tickets), error in zip(batch, errors):
+                for ticket in tickets:
+                    status = self._tickets.get(ticket)
+                    if status is not None:
+                        status['state'] = STATE_FAILED if error else STATE_SAVED
+                        status['saved_at'] = None if error else now
+                        status['error'] = str(error) if error else None
+            while len(self._tickets) > MAX_TICKETS:
+                self._tickets.popitem(last=False)
+            self._in_flight = 0
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            records = [record for record, _ in batch]
+            try:
+                with timed("attendance_writer.batch"):
+                    self.store.apply_records(records)
+                errors = [None] * len(records)
+            except Exception:
+                logger.exception("Attendance batch could not be written, retrying each session")
+                # One bad session must not fail the others of the batch;
+                # writing a session again only replaces it
+                errors = [self._apply_one(record) for record in records]
+            inc("attendance_writer.sessions", errors.count(None))
+            self._finish(batch, errors)
+            self._given_up.update(
+                (record['class_name'], record['date'], record['time_slot'], record['saved_at'])
+                for record, error in zip(records, errors) if error
+            )
+            try:
+                commit_journal(self.store, self._given_up)
+            except Exception:
+                # The sessions are saved, the next batch or start moves the checkpoint
+                logger.exception("Attendance journal could not be checkpointed")
+
+    def _apply_one(self, record):
+        """Write one session record, returning the exception raised if any"""
+        try:
+            self.store.apply_records([record])
+        except Exception as e:
+            logger.exception("Attendance session %s %s %s could not be written",
+                             record['class_name'], record['date'], record['time_slot'])
+            inc("attendance_writer.failures")
+            return e
+        return None
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(store):
+    """Return the process-wide writer of an absence store"""
+    with _writers_lock:
+        writer = _writers.get(id(store))
+        if writer is None:
+            writer = _writers[id(store)] = AttendanceWriter(store)
+        return writer
+
+
+@atexit.register
+def close_writers():
+    """Flush and stop every writer, run at interpreter exit"""
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
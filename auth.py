@@ -1,11 +1,40 @@
 import streamlit as st
-import json
+import copy
 import hashlib
+import hmac
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from config import file_stamp
+from metrics import timed
+from storage import atomic_write_json, file_lock, update_json
+
+# Password hashing parameters, raise them as hardware gets faster
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 600_000
+SALT_BYTES = 16
+
+# KDF work runs here rather than on the Streamlit script thread; the pool
+# size also caps how many logins can burn CPU at the same time
+_kdf_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="kdf")
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r * p)
+
+
 class AuthManager:
-    def __init__(self):
-        self.users_file = "users.json"
+    def __init__(self, users_file="users.json"):
+        self.users_file = users_file
+        self._lock = threading.RLock()
+        self._users = {}
+        self._users_stamp = None
         self.initialize_users_file()
         
     def initialize_users_file(self):
@@ -23,55 +52,154 @@ class AuthManager:
     
     @staticmethod
     def hash_password(password):
-        """Hash password using SHA-256"""
-        return hashlib.sha256(password.encode()).hexdigest()
+        """Hash password with a salted scrypt (PBKDF2-SHA256 when unavailable)"""
+        salt = os.urandom(SALT_BYTES)
+        if hasattr(hashlib, 'scrypt'):
+            digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+            return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, PBKDF2_ITERATIONS)
+        return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${salt.hex()}${digest.hex()}"
     
-    def load_users(self):
-        """Load users from JSON file"""
+    @staticmethod
+    def check_password(password, stored):
+        """Check a password against a stored hash of any supported format"""
+        parts = stored.split('$')
+        if parts[0] == 'scrypt' and len(parts) == 6:
+            n, r, p = (int(x) for x in parts[1:4])
+            digest = _scrypt(password, bytes.fromhex(parts[4]), n, r, p)
+            return hmac.compare_digest(digest.hex(), parts[5])
+        if parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+            digest = hashlib.pbkdf2_hmac('sha256', password.encode(),
+                                         bytes.fromhex(parts[2]), int(parts[1]))
+            return hmac.compare_digest(digest.hex(), parts[3])
+        # Legacy unsalted SHA-256
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+    
+    @staticmethod
+    def needs_rehash(stored):
+        """Tell whether a stored hash is legacy or uses outdated parameters"""
+        if hasattr(hashlib, 'scrypt'):
+            current = ['scrypt', str(SCRYPT_N), str(SCRYPT_R), str(SCRYPT_P)]
+            return stored.split('$')[:4] != current
+        return stored.split('$')[:2] != ['pbkdf2_sha256', str(PBKDF2_ITERATIONS)]
+    
+    def _refresh(self):
+        """Reload the user index when users.json changed on disk"""
         try:
-            with open(self.users_file, 'r') as f:
-                return json.load(f)
+            stamp = file_stamp(self.users_file)
+        except OSError:
+            stamp = None
+        if stamp == self._users_stamp:
+            return
+        try:
+            with timed("auth.read_users"), open(self.users_file, 'r') as f:
+                self._users = json.load(f)
         except Exception:
-            return {}
+            self._users = {}
+        self._users_stamp = stamp
+    
+    def load_users(self):
+        """Load users from JSON file"""
+        with self._lock:
+            self._refresh()
+            return copy.deepcopy(self._users)
     
+    @timed("auth.save_users")
     def save_users(self, users):
         """Save users to JSON file"""
-        with open(self.users_file, 'w') as f:
-            json.dump(users, f, indent=4)
+        with self._lock:
+            with file_lock(self.users_file):
+                atomic_write_json(self.users_file, users, indent=4)
+            self._users = copy.deepcopy(users)
+            self._users_stamp = file_stamp(self.users_file)
+    
+    @timed("auth.update_users")
+    def update_users(self, update):
+        """
+        Apply update(users) to users.json under its file lock
+
+        Safe against concurrent writers in other worker processes.
+
+        Returns:
+            The value returned by update
+        """
+        with self._lock:
+            result = update_json(self.users_file, update, default={}, indent=4)
+            self._users_stamp = None
+            self._refresh()
+            return result
     
     def add_teacher(self, username, access_code, name):
         """Add a new teacher account"""
-        users = self.load_users()
-        if username in users:
-            return False, "Username already exists"
+        password = _kdf_pool.submit(self.hash_password, access_code).result()
+        
+        def add(users):
+            if username in users:
+                return False, "Username already exists"
+            users[username] = {
+                "password": password,
+                "role": "teacher",
+                "name": name
+            }
+            return True, "Teacher added successfully"
         
-        users[username] = {
-            "password": self.hash_password(access_code),
-            "role": "teacher",
-            "name": name
-        }
-        self.save_users(users)
-        return True, "Teacher added successfully"
+        return self.update_users(add)
     
     def remove_teacher(self, username):
         """Remove a teacher account"""
-        users = self.load_users()
-        if username not in users or users[username]["role"] == "admin":
-            return False, "Invalid username or cannot remove admin"
+        def remove(users):
+            if username not in users or users[username]["role"] == "admin":
+                return False, "Invalid username or cannot remove admin"
+            del users[username]
+            return True, "Teacher removed successfully"
         
-        del users[username]
-        self.save_users(users)
-        return True, "Teacher removed successfully"
+        return self.update_users(remove)
     
+    @timed("auth.verify_user")
     def verify_user(self, username, password):
-        """Verify user credentials"""
-        users = self.load_users()
-        if username not in users:
+        """
+        Verify user credentials
+
+        Legacy or outdated hashes are replaced after a successful login.
+        """
+        with self._lock:
+            self._refresh()
+            user = copy.deepcopy(self._users.get(username))
+        
+        if user is None:
+            # Spend the same time as for a real account
+            _kdf_pool.submit(self.check_password, password, _DUMMY_HASH).result()
+            return False, None
+        
+        stored = user["password"]
+        if not _kdf_pool.submit(self.check_password, password, stored).result():
             return False, None
         
-        if users[username]["password"] == self.hash_password(password):
-            return True, users[username]
-        return False, None
+        if self.needs_rehash(stored):
+            new_hash = _kdf_pool.submit(self.hash_password, password).result()
+            
+            def rehash(users):
+                # Leave the entry alone if it changed since it was checked
+                if users.get(username, {}).get("password") == stored:
+                    users[username]["password"] = new_hash
+            
+            self.update_users(rehash)
+        return True, user
+
+
+_DUMMY_HASH = AuthManager.hash_password("")
+
+_auth_manager = None
+_auth_manager_lock = threading.Lock()
+
+
+def get_auth_manager():
+    """Return the AuthManager shared by every session of the process"""
+    global _auth_manager
+    with _auth_manager_lock:
+        if _auth_manager is None:
+            _auth_manager = AuthManager()
+        return _auth_manager
 
 def show_login():
     """Display login form"""
@@ -81,7 +209,7 @@ def show_login():
     password = st.text_input("Password", type="password")
     
     if st.button("Login"):
-        auth_manager = AuthManager()
+        auth_manager = get_auth_manager()
         success, user = auth_manager.verify_user(username, password)
         
         if success:
@@ -98,7 +226,7 @@ def show_user_management():
     """Display user management interface for admin"""
     st.subheader("👥 User Management")
     
-    auth_manager = AuthManager()
+    auth_manager = get_auth_manager()
     
     # Add new teacher
     st.write("### Add New Teacher")
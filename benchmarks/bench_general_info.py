@@ -0,0 +1,81 @@
+"""
+Compare the legacy nine-pass header extraction with massar.read_general_info
+
+Usage:
+    python benchmarks/bench_general_info.py [files...]
+"""
+import sys
+import time
+import warnings
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from massar import read_general_info  # noqa: E402
+
+
+warnings.simplefilter("ignore", UserWarning)
+
+
+def legacy_general_info(file):
+    """Header extraction as done before massar.read_general_info"""
+    df_annee = pd.read_excel(file, skiprows=12, engine="openpyxl")
+    df_semestre = pd.read_excel(file, skiprows=10, engine="openpyxl")
+    df_matiere = pd.read_excel(file, skiprows=10, engine="openpyxl")
+    df_academie = pd.read_excel(file, skiprows=6, engine="openpyxl")
+    df_province = pd.read_excel(file, skiprows=6, engine="openpyxl")
+    df_ecole = pd.read_excel(file, skiprows=6, engine="openpyxl")
+    df_niveau = pd.read_excel(file, skiprows=8, engine="openpyxl")
+    df_professeur = pd.read_excel(file, skiprows=8, engine="openpyxl")
+    df_classe = pd.read_excel(file, skiprows=8, engine="openpyxl")
+    return {
+        'Année Scolaire': df_annee.columns[3],
+        'Semestre': df_semestre.columns[3],
+        'Matière': df_matiere.columns[14],
+        'Académie': df_academie.columns[3],
+        'Province': df_province.columns[8],
+        'Ecole': df_ecole.columns[14],
+        'Niveau': df_niveau.columns[3],
+        'Professeur': df_professeur.columns[14],
+        'Classe': df_classe.columns[8],
+    }
+
+
+def best_of(func, file, repeat):
+    """Return (best elapsed seconds, last result)"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(file)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(argv):
+    files = [Path(a) for a in argv] or sorted(Path('data').glob('export_notesCC_*.xlsx'))
+    if not files:
+        print("No workbook found")
+        return 1
+
+    print(f"{'file':<40} {'legacy ms':>10} {'single ms':>10} {'speed-up':>9}")
+    total_legacy = total_single = 0.0
+    for file in files:
+        legacy_time, legacy = best_of(legacy_general_info, file, 3)
+        single_time, single = best_of(read_general_info, file, 3)
+        if legacy != single:
+            print(f"{file.name}: results differ\n  legacy: {legacy}\n  single: {single}")
+            return 1
+        total_legacy += legacy_time
+        total_single += single_time
+        print(f"{file.name:<40} {legacy_time * 1000:>10.1f} {single_time * 1000:>10.1f} "
+              f"{legacy_time / single_time:>8.1f}x")
+
+    print(f"{'total':<40} {total_legacy * 1000:>10.1f} {total_single * 1000:>10.1f} "
+          f"{total_legacy / total_single:>8.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,159 @@
+"""
+Load test of the JSON API
+
+Opens C keep-alive connections to a running API (uvicorn api:app) and
+sends requests as fast as they are answered for a number of seconds,
+then prints the throughput and latency percentiles of each endpoint.
+Uses asyncio streams only, no HTTP client library is needed.
+
+Usage:
+    python benchmarks/load_api.py --class 1APIC-1 [--url http://127.0.0.1:8000]
+        [--user admin --password admin123] [--connections 50] [--duration 10]
+        [--submit-ratio 0.1]
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from pathlib import Path
+from urllib.parse import quote, urlsplit
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from school_stats import TIME_SLOTS  # noqa: E402
+
+
+class Connection:
+    """Minimal HTTP/1.1 keep-alive client connection"""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None, token=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        payload = json.dumps(body).encode() if body is not None else b""
+        headers = [f"{method} {path} HTTP/1.1", f"Host: {self.host}",
+                   f"Content-Length: {len(payload)}"]
+        if body is not None:
+            headers.append("Content-Type: application/json")
+        if token:
+            headers.append(f"Authorization: Bearer {token}")
+        self.writer.write(("\r\n".join(headers) + "\r\n\r\n").encode() + payload)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by the server")
+        status = int(status_line.split()[1])
+        length, close = 0, False
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode().partition(":")
+            name = name.strip().lower()
+            if name == "content-length":
+                length = int(value)
+            elif name == "connection" and value.strip().lower() == "close":
+                close = True
+        data = await self.reader.readexactly(length)
+        if close:
+            self.close()
+        return status, data
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float('nan')
+
+
+async def worker(host, port, token, class_name, deadline, submit_ratio, codes, results):
+    conn = Connection(host, port)
+    name = quote(class_name, safe="")
+    try:
+        while time.perf_counter() < deadline:
+            if random.random() < submit_ratio:
+                label, method, path = "submit", "POST", f"/api/classes/{name}/attendance"
+                body = {'date': "2024-01-15", 'time_slot': random.choice(TIME_SLOTS),
+                        'absent': random.sample(codes, min(3, len(codes)))}
+            elif random.random() < 0.5:
+                label, method, path, body = "roster", "GET", f"/api/classes/{name}/students", None
+            else:
+                label, method, path, body = (
+                    "statistics", "GET", f"/api/classes/{name}/statistics?year=2024&month=1", None)
+            start = time.perf_counter()
+            try:
+                status, _ = await conn.request(method, path, body, token)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                conn.close()
+                results.setdefault(label, {'latencies': [], 'errors': 0})['errors'] += 1
+                continue
+            entry = results.setdefault(label, {'latencies': [], 'errors': 0})
+            entry['latencies'].append(time.perf_counter() - start)
+            if status >= 400:
+                entry['errors'] += 1
+    finally:
+        conn.close()
+
+
+async def run(args):
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    conn = Connection(host, port)
+    status, data = await conn.request(
+        "POST", "/api/token", {'username': args.user, 'password': args.password})
+    if status != 200:
+        raise SystemExit(f"Login failed ({status}): {data.decode()}")
+    token = json.loads(data)['token']
+    status, data = await conn.request(
+        "GET", f"/api/classes/{quote(args.class_name, safe='')}/students", token=token)
+    conn.close()
+    if status != 200:
+        raise SystemExit(f"Roster request failed ({status}): {data.decode()}")
+    codes = [s['code_massar'] for s in json.loads(data)['students']]
+
+    results = {}
+    deadline = time.perf_counter() + args.duration
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        worker(host, port, token, args.class_name, deadline, args.submit_ratio, codes, results)
+        for _ in range(args.connections)
+    ))
+    elapsed = time.perf_counter() - start
+
+    total = sum(len(r['latencies']) for r in results.values())
+    print(f"{total} requests over {args.connections} connections in {elapsed:.1f}s "
+          f"({total / elapsed:.0f} req/s)")
+    print(f"{'endpoint':<12}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for label, r in sorted(results.items()):
+        lat = r['latencies']
+        print(f"{label:<12}{len(lat):>8}{r['errors']:>8}"
+              f"{percentile(lat, 0.50) * 1000:>10.1f}{percentile(lat, 0.95) * 1000:>10.1f}"
+              f"{percentile(lat, 0.99) * 1000:>10.1f}")
+    return 1 if any(r['errors'] for r in results.values()) else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--user", default="admin")
+    parser.add_argument("--password", default="admin123")
+    parser.add_argument("--class", dest="class_name", required=True)
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--submit-ratio", type=float, default=0.1)
+    args = parser.parse_args(argv)
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,305 @@
+"""
+Benchmark suite of the parsing, saving and statistics hot paths
+
+Generates a synthetic school (benchmarks/synthetic.py) in a temporary
+folder, then times every benchmark (best and median of --repeat runs) and
+measures its peak Python memory with tracemalloc in one extra run.
+
+Scales: small (1 class x 1 month), medium (10 classes x 6 months) and
+large (50 classes x 36 months); --classes/--months/--students override.
+
+Results can be saved with --output and compared with a previous run with
+--baseline: a benchmark slower (or using more memory) than the baseline
+by more than --tolerance makes the script exit with 1.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--scale medium] [--backend sqlite]
+        [--repeat 5] [--only stats] [--output results.json]
+        [--baseline baseline.json] [--tolerance 1.25]
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import synthetic  # noqa: E402
+from absence_store import format_date, get_store, month_bounds  # noqa: E402
+from attendance_writer import get_writer  # noqa: E402
+from class_cache import load_class  # noqa: E402
+from export import export_absences  # noqa: E402
+from massar import compile_class, read_general_info, read_students  # noqa: E402
+from school_stats import school_report  # noqa: E402
+
+
+SCALES = {
+    'small': {'classes': 1, 'months': 1},
+    'medium': {'classes': 10, 'months': 6},
+    'large': {'classes': 50, 'months': 36},
+}
+
+BENCHMARKS = {}
+MIN_DELTA_MS = 1.0
+MIN_DELTA_KIB = 64
+
+warnings.simplefilter("ignore", UserWarning)
+
+
+def benchmark(name, setup=None):
+    """Register func(context) as a benchmark, setup(context) runs untimed before each call"""
+    def register(func):
+        BENCHMARKS[name] = (func, setup)
+        return func
+    return register
+
+
+class Context:
+    """Synthetic school shared by the benchmarks"""
+
+    def __init__(self, root, classes, months, students, backend):
+        self.root = Path(root)
+        self.class_names = synthetic.class_names(classes)
+        self.class_name = self.class_names[0]
+        self.workbook = self.root / "classes" / f"{self.class_name}.xlsx"
+        for name in self.class_names:
+            synthetic.make_class_workbook(self.root / "classes" / f"{name}.xlsx", name, students)
+        self.store = get_store(backend, self.root / "absences")
+        start = time.perf_counter()
+        self.sessions = synthetic.make_absence_history(self.store, self.class_names, students,
+                                                       months)
+        self.history_seconds = time.perf_counter() - start
+        self.month = month_bounds(2023, 9)  # first month of the synthetic history
+        _, self.roster = load_class(self.workbook)
+        self.student = self.roster['Code Massar'].iloc[0]
+        self.saves = 0
+
+    def next_session(self):
+        """Return a roster with absences and a session key outside the history"""
+        self.saves += 1
+        roster = self.roster.copy()
+        roster['Absence'] = [i % 7 == self.saves % 7 for i in range(len(roster))]
+        return roster, self.class_name, "2030-01-01", f"slot-{self.saves % 64}"
+
+
+@benchmark("parse.general_info")
+def bench_general_info(ctx):
+    read_general_info(ctx.workbook)
+
+
+@benchmark("parse.students")
+def bench_students(ctx):
+    read_students(ctx.workbook)
+
+
+@benchmark("parse.compile_class")
+def bench_compile_class(ctx):
+    compile_class(ctx.workbook)
+
+
+@benchmark("load.class_cached")
+def bench_load_class(ctx):
+    load_class(ctx.workbook)
+
+
+@benchmark("save.session")
+def bench_save_session(ctx):
+    ctx.store.save_session(*ctx.next_session())
+
+
+def flush_writer(ctx):
+    get_writer(ctx.store).flush()
+
+
+@benchmark("save.session_queued", setup=flush_writer)
+def bench_save_queued(ctx):
+    # What the teacher waits for, the write itself happens in the background
+    get_writer(ctx.store).submit(*ctx.next_session())
+
+
+@benchmark("stats.monthly_rollups")
+def bench_monthly_rollups(ctx):
+    rollups = ctx.store.rollups
+    rollups.summary(ctx.class_name, *ctx.month)
+    rollups.student_counts(ctx.class_name, *ctx.month)
+    rollups.day_counts(ctx.class_name, *ctx.month)
+    rollups.slot_counts(ctx.class_name, *ctx.month)
+
+
+@benchmark("stats.monthly_raw")
+def bench_monthly_raw(ctx):
+    df = ctx.store.query(ctx.class_name, *ctx.month)
+    df.groupby(['Code Massar', 'Nom']).size()
+    df['Code Massar'].nunique(), df['Date'].nunique()
+
+
+@benchmark("stats.school_month")
+def bench_school_month(ctx):
+    school_report(ctx.store, *ctx.month)
+
+
+@benchmark("stats.presence_month")
+def bench_presence_month(ctx):
+    presence = ctx.store.presence.load(ctx.class_name, *ctx.month)
+    presence.rates(), presence.streaks(), presence.slot_coverage()
+
+
+@benchmark("stats.presence_school")
+def bench_presence_school(ctx):
+    ctx.store.presence.load().rates()
+
+
+@benchmark("stats.heatmap_incremental")
+def bench_heatmap_incremental(ctx):
+    # A Saturday session: its column does not exist yet in the cached matrix
+    roster, class_name, _, time_slot = ctx.next_session()
+    saturday = pd.Timestamp(ctx.month[0]) + pd.offsets.Week(ctx.saves % 4, weekday=5)
+    ctx.store.save_session(roster, class_name, format_date(saturday), time_slot)
+    ctx.store.heatmaps.get(class_name, *ctx.month)
+
+
+@benchmark("history.student")
+def bench_student_history(ctx):
+    ctx.store.rollups.student_history(ctx.student)
+
+
+@benchmark("export.csv_month")
+def bench_export_month(ctx):
+    export_absences(ctx.store, io.BytesIO(), 'csv', start=ctx.month[0], end=ctx.month[1])
+
+
+def measure(func, setup, ctx, repeat):
+    """Return the timing and peak memory of a benchmark"""
+    setup = setup or (lambda ctx: None)
+    setup(ctx)
+    func(ctx)  # warm-up, fills caches like a running app would
+    times = []
+    for _ in range(repeat):
+        setup(ctx)
+        start = time.perf_counter()
+        func(ctx)
+        times.append(time.perf_counter() - start)
+    setup(ctx)
+    tracemalloc.start()
+    try:
+        func(ctx)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'best_ms': min(times) * 1000,
+        'median_ms': statistics.median(times) * 1000,
+        'repeat': repeat,
+        'peak_kib': peak / 1024,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print the comparison with a baseline, return the names of the regressions
+
+    Differences below MIN_DELTA_MS and MIN_DELTA_KIB are treated as noise.
+    """
+    if baseline['meta']['scale'] != results['meta']['scale']:
+        print(f"warning: baseline scale {baseline['meta']['scale']} "
+              f"differs from {results['meta']['scale']}")
+    print(f"\n{'benchmark':<24}{'time':>10}{'memory':>10}  status")
+    regressions = []
+    for name, result in results['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print(f"{name:<24}{'':>10}{'':>10}  new")
+            continue
+        time_ratio = result['best_ms'] / base['best_ms'] if base['best_ms'] else 1.0
+        memory_ratio = result['peak_kib'] / base['peak_kib'] if base['peak_kib'] else 1.0
+        slower = (time_ratio > tolerance
+                  and result['best_ms'] - base['best_ms'] > MIN_DELTA_MS)
+        bigger = (memory_ratio > tolerance
+                  and result['peak_kib'] - base['peak_kib'] > MIN_DELTA_KIB)
+        if slower or bigger:
+            status = "REGRESSION"
+            regressions.append(name)
+        elif time_ratio < 1 / tolerance:
+            status = "faster"
+        else:
+            status = "ok"
+        print(f"{name:<24}{time_ratio:>9.2f}x{memory_ratio:>9.2f}x  {status}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scale", default="small", choices=sorted(SCALES))
+    parser.add_argument("--classes", type=int, default=None)
+    parser.add_argument("--months", type=int, default=None)
+    parser.add_argument("--students", type=int, default=32)
+    parser.add_argument("--backend", default="sqlite", choices=["sqlite", "xlsx"])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", nargs="*", default=None,
+                        help="run the benchmarks whose name starts with one of these")
+    parser.add_argument("--output", default=None, help="write the results as JSON")
+    parser.add_argument("--baseline", default=None, help="compare with a previous --output")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    scale = dict(SCALES[args.scale])
+    scale.update({key: value for key, value in
+                  (('classes', args.classes), ('months', args.months)) if value is not None})
+    scale.update(students=args.students, backend=args.backend)
+    names = [name for name in BENCHMARKS
+             if not args.only or any(name.startswith(prefix) for prefix in args.only)]
+    baseline = json.loads(Path(args.baseline).read_text()) if args.baseline else None
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # Relative paths of the settings and class folders resolve in workdir
+        os.chdir(workdir)
+        try:
+            ctx = Context(workdir, scale['classes'], scale['months'], scale['students'],
+                          scale['backend'])
+            print(f"{len(ctx.class_names)} class(es), {ctx.sessions} session(s) generated "
+                  f"in {ctx.history_seconds:.1f}s ({scale['backend']})")
+            print(f"{'benchmark':<24}{'best ms':>10}{'median ms':>11}{'peak KiB':>11}")
+            results = {}
+            for name in names:
+                results[name] = measure(*BENCHMARKS[name], ctx, args.repeat)
+                r = results[name]
+                print(f"{name:<24}{r['best_ms']:>10.2f}{r['median_ms']:>11.2f}"
+                      f"{r['peak_kib']:>11.0f}")
+            get_writer(ctx.store).close()
+            mismatches = ctx.store.heatmaps.check()
+            for key in mismatches:
+                print(f"heatmap differs from a fresh build: {key}", file=sys.stderr)
+        finally:
+            os.chdir(cwd)
+
+    results = {
+        'meta': {
+            'scale': scale,
+            'sessions': ctx.sessions,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'date': datetime.now().isoformat(timespec='seconds'),
+        },
+        'results': results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+    if baseline and compare(results, baseline, args.tolerance):
+        return 1
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
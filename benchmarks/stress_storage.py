@@ -0,0 +1,100 @@
+"""
+Multi-process stress test of the storage layer
+
+Starts N writer processes at the same instant; each one repeatedly
+increments a shared JSON counter, adds its own teacher to users.json,
+stores its own settings key, appends journal records and saves
+attendance sessions. Any lost update makes the script exit with 1.
+
+Usage:
+    python benchmarks/stress_storage.py [--writers 50] [--iterations 20]
+"""
+import argparse
+import multiprocessing
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pandas as pd  # noqa: E402
+
+import auth  # noqa: E402
+from absence_store import SQLiteAbsenceStore  # noqa: E402
+from storage import append_journal, read_journal, read_json, update_json  # noqa: E402
+
+
+def increment(data):
+    data['count'] = data.get('count', 0) + 1
+
+
+def writer(worker_id, workdir, iterations, barrier):
+    workdir = Path(workdir)
+    # Cheap KDF parameters, the test is about the file, not the hash
+    auth.SCRYPT_N = 2 ** 10
+    manager = auth.AuthManager(str(workdir / "users.json"))
+    store = SQLiteAbsenceStore(workdir / "absences.sqlite")
+    roster = pd.DataFrame({'Code Massar': [f"S{worker_id}"], 'Nom': [f"Student {worker_id}"],
+                           'Absence': [True]})
+    barrier.wait()
+
+    manager.add_teacher(f"teacher{worker_id}", "code", f"Teacher {worker_id}")
+    update_json(workdir / "settings.json",
+                lambda settings: settings.update({f"worker{worker_id}": worker_id}), default={})
+    for i in range(iterations):
+        update_json(workdir / "counter.json", increment, default={})
+        append_journal(workdir / "stress.jsonl", {'worker': worker_id, 'i': i})
+        store.save_session(roster, "STRESS", "2024-01-01", f"slot-{worker_id}-{i}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--writers", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Create users.json before the writers race for it
+        auth.AuthManager(str(Path(workdir) / "users.json"))
+        barrier = multiprocessing.Barrier(args.writers)
+        processes = [
+            multiprocessing.Process(target=writer, args=(i, workdir, args.iterations, barrier))
+            for i in range(args.writers)
+        ]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        workdir = Path(workdir)
+        expected = args.writers * args.iterations
+        users = read_json(workdir / "users.json", {})
+        settings = read_json(workdir / "settings.json", {})
+        journal = list(read_journal(workdir / "stress.jsonl"))
+        store = SQLiteAbsenceStore(workdir / "absences.sqlite")
+        sessions = store.query("STRESS")
+        session_journal = list(read_journal(store.journal_path))
+        checks = {
+            "writer processes exited cleanly": all(p.exitcode == 0 for p in processes),
+            f"counter == {expected}": read_json(workdir / "counter.json", {}).get('count') == expected,
+            f"{args.writers} teachers in users.json":
+                all(f"teacher{i}" in users for i in range(args.writers)),
+            "admin kept in users.json": "admin" in users,
+            f"{args.writers} keys in settings.json":
+                all(f"worker{i}" in settings for i in range(args.writers)),
+            f"{expected} journal records": len(journal) == expected,
+            f"{expected} attendance sessions": len(sessions) == expected,
+            f"{expected} attendance journal records": len(session_journal) == expected,
+        }
+
+    print(f"{args.writers} writers x {args.iterations} iterations in {elapsed:.1f}s")
+    for label, ok in checks.items():
+        print(f"  [{'ok' if ok else 'FAIL'}] {label}")
+    return 0 if all(checks.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
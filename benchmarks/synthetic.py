@@ -0,0 +1,168 @@
+"""
+Synthetic Massar exports and absence histories for the benchmarks
+
+make_class_workbook writes a workbook with the NotesCC layout of the
+Massar exports in data/ (header cells, students from row 18, scores), and
+make_absence_history fills an absence store with random roll-call sessions.
+Both are seeded, the same arguments always produce the same data.
+
+Usage:
+    python benchmarks/synthetic.py OUTPUT_DIR [--classes 10] [--students 32] [--months 6]
+"""
+import argparse
+import hashlib
+import random
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+from openpyxl import Workbook
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from massar import HEADER_CELLS  # noqa: E402
+
+
+TIME_SLOTS = ["8h30-9h30", "9h30-10h30", "10h30-11h30", "11h30-12h30",
+              "13h30-14h30", "14h30-15h30", "15h30-16h30", "16h30-17h30"]
+LEVELS = ["1APIC", "2APIC", "3APIC"]
+FIRST_NAMES = ["محمد", "أمال", "رشيد", "سلمى", "يونس", "خديجة", "حسام", "مريم", "أيمن", "هبة"]
+LAST_NAMES = ["العلوي", "بنيس", "الصديقي", "خلدون", "الحجازي", "منير", "لفريندي", "بوحجلة"]
+FIRST_STUDENT_ROW = 18  # 1-based, as in the real exports
+SCORE_COLUMNS = [7, 9, 11, 13]  # 1-based, one column per test, absences in between
+
+
+def class_names(count):
+    """Return count class names spread over the three levels, e.g. '2APIC-4'"""
+    return [f"{LEVELS[i % len(LEVELS)]}-{i // len(LEVELS) + 1}" for i in range(count)]
+
+
+def student_codes(class_name, count):
+    """Return stable Code Massar values for the students of a class"""
+    seed = int(hashlib.md5(class_name.encode()).hexdigest(), 16) % 10 ** 6
+    return [f"G{seed:06d}{i:03d}" for i in range(count)]
+
+
+def make_class_workbook(path, class_name, students=32, seed=0):
+    """
+    Write a Massar grade export for one class
+
+    Returns:
+        Path: Written workbook
+    """
+    rng = random.Random(f"{seed}-{class_name}")
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = "NotesCC"
+    for col in range(1, 36):
+        sheet.cell(1, col, chr(ord('A') + (col - 1) % 26))
+
+    header = {
+        'Année Scolaire': "2023/2024",
+        'Semestre': "الدورة الأولى",
+        'Matière': "المعلوميات",
+        'Académie': "مراكش - آسفي",
+        'Province': "إقليم: الرحامنة",
+        'Ecole': "ثانوية إعدادية",
+        'Niveau': class_name.split('-')[0],
+        'Professeur': "أستاذ",
+        'Classe': class_name,
+    }
+    for key, (row, col) in HEADER_CELLS.items():
+        sheet.cell(row, col - 1, f"{key} :")
+        sheet.cell(row, col, header[key])
+
+    sheet.cell(16, 2, "ID")
+    sheet.cell(16, 3, "رقم  التلميذ")
+    sheet.cell(16, 4, "إسم التلميذ")
+    for col in SCORE_COLUMNS:
+        sheet.cell(16, col, f"الفرض {SCORE_COLUMNS.index(col) + 1}")
+        sheet.cell(17, col, "النقطة")
+        sheet.cell(17, col + 1, "التغيب")
+
+    for i, code in enumerate(student_codes(class_name, students)):
+        row = FIRST_STUDENT_ROW + i
+        sheet.cell(row, 2, rng.randrange(10 ** 6, 10 ** 7))
+        sheet.cell(row, 3, code)
+        sheet.cell(row, 4, f"{rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)}")
+        for col in SCORE_COLUMNS:
+            sheet.cell(row, col, round(rng.uniform(2, 20) * 4) / 4)
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    workbook.save(path)
+    return path
+
+
+def school_days(start, months):
+    """Yield the weekdays of months school months starting at start"""
+    day = start
+    end = date(start.year + (start.month - 1 + months) // 12, (start.month - 1 + months) % 12 + 1, 1)
+    while day < end:
+        if day.weekday() < 5:
+            yield day
+        day += timedelta(days=1)
+
+
+def session_records(classes, students=32, months=1, slots_per_day=4, absence_rate=0.08,
+                    start=date(2023, 9, 1), seed=0):
+    """Yield session records (see absence_store.session_record) in date order"""
+    rng = random.Random(seed)
+    rosters = {name: student_codes(name, students) for name in classes}
+    for day in school_days(start, months):
+        for class_name in classes:
+            for time_slot in rng.sample(TIME_SLOTS, slots_per_day):
+                roster = [[code, f"Élève {code[-4:]}"] for code in rosters[class_name]]
+                yield {
+                    'saved_at': f"{day.isoformat()}T18:00:00",
+                    'class_name': class_name,
+                    'date': day.isoformat(),
+                    'time_slot': time_slot,
+                    'absences': [pair for pair in roster if rng.random() < absence_rate],
+                    'roster': roster,
+                }
+
+
+def make_absence_history(store, classes, students=32, months=1, batch=2000, **kwargs):
+    """
+    Write a random absence history to a store, in batches
+
+    Returns:
+        int: Number of sessions written
+    """
+    sessions, pending = 0, []
+    for record in session_records(classes, students, months, **kwargs):
+        pending.append(record)
+        if len(pending) >= batch:
+            store.apply_records(pending)
+            sessions += len(pending)
+            pending = []
+    if pending:
+        store.apply_records(pending)
+        sessions += len(pending)
+    return sessions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("output", help="folder receiving classes/ and absences/")
+    parser.add_argument("--classes", type=int, default=10)
+    parser.add_argument("--students", type=int, default=32)
+    parser.add_argument("--months", type=int, default=6)
+    parser.add_argument("--backend", default="sqlite", choices=["sqlite", "xlsx"])
+    args = parser.parse_args(argv)
+
+    from absence_store import get_store
+
+    output = Path(args.output)
+    names = class_names(args.classes)
+    for name in names:
+        make_class_workbook(output / "classes" / f"{name}.xlsx", name, args.students)
+    store = get_store(args.backend, output / "absences")
+    sessions = make_absence_history(store, names, args.students, args.months)
+    print(f"{len(names)} class workbook(s) and {sessions} session(s) written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""Process-wide cache of parsed class files shared by all sessions and reruns"""
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from config import file_stamp
+from massar import read_class
+from metrics import inc, timed
+
+
+DEFAULT_MAXSIZE = 64
+
+
+class ClassCache:
+    """
+    LRU cache of parsed class files keyed by path and file version
+
+    An entry is reused only while the file keeps the same mtime and size.
+    Concurrent requests for the same missing entry wait on a per-path lock
+    so that each version of a file is parsed once.
+    """
+
+    def __init__(self, loader, maxsize=DEFAULT_MAXSIZE):
+        self.loader = loader
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # path -> (stamp, value)
+        self._lock = threading.Lock()
+        self._loading = {}  # path -> lock held while parsing that path
+
+    @staticmethod
+    def _key(path):
+        return str(Path(path).resolve())
+
+    def _lookup(self, key, stamp):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == stamp:
+            self._entries.move_to_end(key)
+            return entry[1]
+        return None
+
+    def get(self, path):
+        """Return the cached value for path, parsing the file if needed"""
+        key = self._key(path)
+        stamp = file_stamp(path)
+        with self._lock:
+            value = self._lookup(key, stamp)
+            if value is not None:
+                inc("class_cache.hits")
+                return value
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                value = self._lookup(key, stamp)
+                if value is not None:
+                    inc("class_cache.hits")
+                    return value
+
+            inc("class_cache.misses")
+            with timed("class_cache.load"):
+                value = self.loader(path)
+
+            with self._lock:
+                self._entries[key] = (stamp, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                self._loading.pop(key, None)
+        return value
+
+    def invalidate(self, path=None):
+        """Drop the entry for path, or every entry when path is None"""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(self._key(path), None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, path):
+        return self._key(path) in self._entries
+
+
+_cache = ClassCache(read_class)
+
+
+@timed("load_class")
+def load_class(path):
+    """
+    Return (general info, students DataFrame) for a saved class file
+
+    Both values are copies, callers are free to modify them.
+    """
+    info, students = _cache.get(path)
+    return dict(info), students.copy()
+
+
+def invalidate_class(path=None):
+    """Forget the parsed version of a class file (all files when None)"""
+    _cache.invalidate(path)
@@ -0,0 +1,211 @@
+"""
+Bulk import of Massar exports
+
+Accepts any mix of grade exports (export_notesCC_*.xlsx), student lists
+(ListEleve_*.xls, one class per sheet) and zip archives of them. Files
+are parsed and validated in worker processes, then every valid class is
+written at once.
+"""
+import io
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from class_registry import class_path, save_class_roster, save_class_workbook
+from config import CLASSES_DIR
+from massar import read_general_info, read_student_list, read_students
+
+
+SUPPORTED_SUFFIXES = ('.xlsx', '.xls', '.zip')
+PARALLEL_MIN_FILES = 8
+STATUS_COLUMNS = ['Fichier', 'Classe', 'Élèves', 'Statut', 'Message']
+
+STATUS_IMPORTED = "✅ Importé"
+STATUS_VALID = "✔️ Valide"
+STATUS_SKIPPED = "⚠️ Ignoré"
+STATUS_ERROR = "❌ Erreur"
+
+
+def expand_sources(sources):
+    """
+    Yield (name, bytes) for every workbook, unpacking zip archives
+
+    Args:
+        sources: Iterable of (file name, bytes) pairs
+    """
+    for name, data in sources:
+        suffix = Path(name).suffix.lower()
+        if suffix == '.zip':
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for member in archive.infolist():
+                    member_suffix = Path(member.filename).suffix.lower()
+                    if member.is_dir() or member_suffix not in ('.xlsx', '.xls'):
+                        continue
+                    if Path(member.filename).name.startswith(('~$', '.')):
+                        continue
+                    yield f"{name}/{member.filename}", archive.read(member)
+        else:
+            yield name, data
+
+
+def read_paths(paths):
+    """Yield (name, bytes) for files given on disk, folders are scanned"""
+    for path in map(Path, paths):
+        files = sorted(path.iterdir()) if path.is_dir() else [path]
+        for file in files:
+            if file.is_file() and file.suffix.lower() in SUPPORTED_SUFFIXES:
+                yield file.name, file.read_bytes()
+
+
+def _validate(info, students):
+    if not info.get('Classe'):
+        raise ValueError("Nom de classe introuvable")
+    if students.empty:
+        raise ValueError("Aucun élève trouvé")
+    if students['Code Massar'].isna().any():
+        raise ValueError("Code Massar manquant pour certains élèves")
+
+
+def parse_source(name, data):
+    """
+    Parse and validate one workbook
+
+    Returns:
+        list: dicts with kind, info and students, one per class found
+    """
+    suffix = Path(name).suffix.lower()
+    if suffix == '.xls':
+        found = read_student_list(io.BytesIO(data))
+        if not found:
+            raise ValueError("Aucune classe trouvée dans la liste")
+        for info, students in found:
+            _validate(info, students)
+        return [{'kind': 'list', 'info': info, 'students': students} for info, students in found]
+
+    if suffix != '.xlsx':
+        raise ValueError(f"Format non supporté: {suffix}")
+    info = read_general_info(io.BytesIO(data))
+    students = read_students(io.BytesIO(data))
+    students = students.dropna(subset=['Code Massar', 'Nom'], how='all')
+    _validate(info, students)
+    return [{'kind': 'workbook', 'info': info, 'students': students, 'data': data}]
+
+
+def _parse_worker(item):
+    name, data = item
+    try:
+        return name, parse_source(name, data), None
+    except Exception as e:
+        return name, None, str(e)
+
+
+def parse_sources(sources, workers=None):
+    """
+    Parse workbooks, in a process pool from PARALLEL_MIN_FILES files on
+
+    Smaller batches are parsed in this process, starting the workers
+    would cost more than the parses.
+
+    Returns:
+        list: one status dict per class found or per failed file; valid
+            entries carry the parsed class under the '_class' key
+    """
+    items = list(expand_sources(sources))
+    if len(items) >= PARALLEL_MIN_FILES and workers != 1:
+        workers = min(len(items), workers or os.cpu_count() or 1)
+        # Spawned, not forked: forking the threaded Streamlit server could
+        # copy locks held by its other threads
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            parsed = list(pool.map(_parse_worker, items))
+    else:
+        parsed = [_parse_worker(item) for item in items]
+
+    results = []
+    for name, classes, error in parsed:
+        if error is not None:
+            results.append({'Fichier': name, 'Classe': None, 'Élèves': 0,
+                            'Statut': STATUS_ERROR, 'Message': error})
+            continue
+        for parsed_class in classes:
+            results.append({
+                'Fichier': name,
+                'Classe': parsed_class['info']['Classe'],
+                'Élèves': len(parsed_class['students']),
+                'Statut': STATUS_VALID,
+                'Message': "Export de notes" if parsed_class['kind'] == 'workbook'
+                           else "Liste des élèves",
+                '_class': parsed_class,
+            })
+    return results
+
+
+def write_classes(results, classes_dir=CLASSES_DIR):
+    """
+    Write every valid parsed class and update the statuses in place
+
+    A grade export wins over a student list for the same class, both in
+    the batch and on disk; within the same kind the last file wins.
+    """
+    chosen = {}
+    for result in results:
+        parsed_class = result.get('_class')
+        if parsed_class is None:
+            continue
+        class_name = result['Classe']
+        previous = chosen.get(class_name)
+        if previous is not None:
+            if previous['_class']['kind'] == 'workbook' and parsed_class['kind'] == 'list':
+                result['Statut'] = STATUS_SKIPPED
+                result['Message'] = "Export de notes prioritaire dans cet import"
+                continue
+            previous['Statut'] = STATUS_SKIPPED
+            previous['Message'] = f"Remplacé par {result['Fichier']}"
+        chosen[class_name] = result
+
+    for class_name, result in chosen.items():
+        parsed_class = result['_class']
+        existing = class_path(class_name, classes_dir)
+        try:
+            if parsed_class['kind'] == 'workbook':
+                path = save_class_workbook(parsed_class['data'], class_name, classes_dir,
+                                           parsed_class['info'], parsed_class['students'])
+            elif existing.suffix == '.xlsx' and existing.exists():
+                result['Statut'] = STATUS_SKIPPED
+                result['Message'] = "Export de notes déjà présent pour cette classe"
+                continue
+            else:
+                path = save_class_roster(parsed_class['info'], parsed_class['students'],
+                                         classes_dir)
+            result['Statut'] = STATUS_IMPORTED
+            result['Message'] = str(path)
+        except Exception as e:
+            result['Statut'] = STATUS_ERROR
+            result['Message'] = str(e)
+    return results
+
+
+def status_table(results):
+    """Return the per-file status table of an import"""
+    return pd.DataFrame([{k: r[k] for k in STATUS_COLUMNS} for r in results],
+                        columns=STATUS_COLUMNS)
+
+
+def import_classes(sources, classes_dir=CLASSES_DIR, workers=None):
+    """
+    Parse, validate and save many class files in one operation
+
+    Args:
+        sources: Iterable of (file name, bytes) pairs, zip archives allowed
+        classes_dir (str): Destination folder
+        workers (int): Worker processes, one per CPU when None
+
+    Returns:
+        pd.DataFrame: Per-file status table
+    """
+    Path(classes_dir).mkdir(exist_ok=True)
+    return status_table(write_classes(parse_sources(sources, workers), classes_dir))
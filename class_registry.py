@@ -0,0 +1,100 @@
+"""Saved classes under classes/: Massar workbooks and roster-only imports"""
+from pathlib import Path
+
+from class_cache import invalidate_class, load_class
+from config import CLASSES_DIR, file_stamp, sanitize_filename
+from massar import COMPILED_SUFFIX, compile_class, compiled_path, write_compiled
+from storage import atomic_write_bytes
+
+
+_listeners = []
+
+
+def on_class_saved(callback):
+    """Register callback(class_name, path) run after a class is saved"""
+    _listeners.append(callback)
+    return callback
+
+
+def _notify(class_name, path):
+    for callback in _listeners:
+        callback(class_name, path)
+
+
+def class_path(class_name, classes_dir=CLASSES_DIR):
+    """
+    Return the file of a saved class
+
+    The Massar workbook is preferred, classes imported from a student
+    list only have their compiled roster.
+    """
+    safe_class_name = sanitize_filename(class_name)
+    workbook = Path(classes_dir) / f"{safe_class_name}.xlsx"
+    if workbook.exists():
+        return workbook
+    roster = Path(classes_dir) / f"{safe_class_name}{COMPILED_SUFFIX}"
+    if roster.exists():
+        return roster
+    return workbook
+
+
+def available_classes(classes_dir=CLASSES_DIR):
+    """Return the names of the saved classes"""
+    folder = Path(classes_dir)
+    names = {f.stem for f in folder.glob('*.xlsx')}
+    names.update(f.name[:-len(COMPILED_SUFFIX)] for f in folder.glob(f'*{COMPILED_SUFFIX}'))
+    return sorted(names)
+
+
+def find_student(code_massar, classes_dir=CLASSES_DIR):
+    """
+    Return the saved classes listing a student
+
+    Returns:
+        list: (class name, student name) tuples
+    """
+    found = []
+    for class_name in available_classes(classes_dir):
+        _, students = load_class(class_path(class_name, classes_dir))
+        match = students[students['Code Massar'].astype(str) == str(code_massar)]
+        found.extend((class_name, nom) for nom in match['Nom'])
+    return found
+
+
+def save_class_workbook(data, class_name, classes_dir=CLASSES_DIR, info=None, students=None):
+    """
+    Save a Massar workbook as classes/<class>.xlsx and compile its roster
+
+    Args:
+        data (bytes): Workbook content
+        class_name (str): Class name, sanitized for the file name
+        info (dict): Already parsed general info, parsed from data when None
+        students (pd.DataFrame): Already parsed roster
+
+    Returns:
+        Path: Saved workbook path
+    """
+    file_path = Path(classes_dir) / f"{sanitize_filename(class_name)}.xlsx"
+    atomic_write_bytes(file_path, data)
+    if info is None or students is None:
+        compile_class(file_path)
+    else:
+        write_compiled(compiled_path(file_path), info, students, file_stamp(file_path))
+    invalidate_class(file_path)
+    _notify(class_name, file_path)
+    return file_path
+
+
+def save_class_roster(info, students, classes_dir=CLASSES_DIR):
+    """
+    Save a class known only by its roster (e.g. from ListEleve_*.xls)
+
+    Returns:
+        Path: Saved .roster.json path
+    """
+    class_name = info['Classe']
+    file_path = Path(classes_dir) / f"{sanitize_filename(class_name)}{COMPILED_SUFFIX}"
+    write_compiled(file_path, info, students)
+    invalidate_class(file_path)
+    _notify(class_name, file_path)
+    return file_path
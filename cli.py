@@ -0,0 +1,194 @@
+"""
+Command line entry point for maintenance tasks
+
+Usage:
+    python cli.py migrate-absences [--source absences] [--target absences] [--keep-source]
+    python cli.py replay-journal [--backend sqlite] [--since 2024-01-01T00:00]
+    python cli.py import-classes PATH [PATH ...] [--classes-dir classes] [--workers N]
+    python cli.py check-rollups [--backend sqlite] [--repair]
+    python cli.py send-alerts [--backend sqlite] [--force]
+    python cli.py retention [--days N] [--no-archive] [--dry-run] [--backend sqlite]
+    python cli.py export-absences [-o report.xlsx] [--class NAME ...] [--start DATE]
+                                  [--end DATE] [--student CODE] [--backend sqlite]
+"""
+import argparse
+import sys
+from datetime import datetime
+from pathlib import Path
+
+from absence_store import (
+    MIGRATED_KEY, SQLiteAbsenceStore, SQLITE_FILENAME, get_store, migrate_xlsx_absences,
+    replay_journal, rollup_path
+)
+from class_import import STATUS_ERROR, import_classes, read_paths
+from config import ABSENCE_DIR, CLASSES_DIR, load_settings
+from export import EXPORT_FORMATS, export_absences
+from retention import DEFAULT_RETENTION_DAYS, format_bytes, run_retention
+from rollups import AbsenceRollups
+
+
+def cmd_migrate_absences(args):
+    """Import legacy per-session workbooks into the SQLite store"""
+    store = SQLiteAbsenceStore(Path(args.target) / SQLITE_FILENAME)
+    sessions, failed = migrate_xlsx_absences(store, args.source, archive=not args.keep_source)
+    store.set_meta(MIGRATED_KEY, datetime.now().isoformat(timespec='seconds'))
+    AbsenceRollups(rollup_path(store.name, args.target)).rebuild(store)
+    print(f"{sessions} session(s) imported into {store.path}")
+    for file in failed:
+        print(f"unreadable: {file}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def cmd_replay_journal(args):
+    """Re-apply journaled attendance sessions to the absence store"""
+    store = get_store(args.backend, args.root)
+    replayed = replay_journal(store, since=args.since)
+    print(f"{replayed} session(s) replayed into the {store.name} store")
+    return 0
+
+
+def cmd_check_rollups(args):
+    """Compare the dashboard rollups with the raw absences"""
+    store = get_store(args.backend, args.root)
+    mismatches = store.rollups.check(store)
+    for table, count in mismatches.items():
+        print(f"{table}: {count} mismatching key(s)")
+    if not any(mismatches.values()):
+        return 0
+    if args.repair:
+        sessions = store.rollups.rebuild(store)
+        print(f"Rollups rebuilt from {sessions} session(s)")
+        return 0
+    return 1
+
+
+def cmd_send_alerts(args):
+    """Send the queued absence alerts as a digest"""
+    store = get_store(args.backend, args.root)
+    sent = store.alerts.send_digest(force=args.force)
+    print(f"{sent} alert(s) sent, {len(store.alerts.pending())} pending")
+    return 0
+
+
+def cmd_retention(args):
+    """Archive and delete absences older than the retention window, then compact"""
+    days = args.days or load_settings().get('data_retention_days', DEFAULT_RETENTION_DAYS)
+    store = get_store(args.backend, args.root)
+    report = run_retention(store, args.root, days, archive=not args.no_archive,
+                           dry_run=args.dry_run)
+    print(f"{'[dry run] ' if report['dry_run'] else ''}cutoff {report['cutoff']} ({days} days)")
+    print(f"  absences removed:        {report['rows_removed']}")
+    print(f"  journal records removed: {report['journal_records_removed']}")
+    print(f"  presence sessions:       {report['presence_sessions_removed']}")
+    print(f"  legacy workbooks:        {report['legacy_files_removed']}")
+    print(f"  files merged:            {report['files_merged']}")
+    print(f"  files reclaimed:         {report['files_reclaimed']} "
+          f"({report['files_before']} -> {report['files_after']})")
+    print(f"  space reclaimed:         {format_bytes(report['bytes_reclaimed'])}"
+          f"{' (estimate)' if report['dry_run'] else ''}")
+    for path in report['archives']:
+        print(f"  archive: {path}")
+    return 0
+
+
+def cmd_import_classes(args):
+    """Import Massar exports, student lists and zip archives"""
+    table = import_classes(read_paths(args.paths), args.classes_dir, args.workers)
+    if table.empty:
+        print("No .xlsx, .xls or .zip file found", file=sys.stderr)
+        return 1
+    print(table.to_string(index=False))
+    return 1 if (table['Statut'] == STATUS_ERROR).any() else 0
+
+
+def cmd_export_absences(args):
+    """Export absences as CSV or Excel, streamed row by row"""
+    fmt = args.format
+    if fmt is None:
+        fmt = 'xlsx' if args.output and args.output.endswith('.xlsx') else 'csv'
+    if args.output is None and fmt != 'csv':
+        print("Excel exports need --output", file=sys.stderr)
+        return 1
+    store = get_store(args.backend, args.root)
+    out = args.output or sys.stdout.buffer
+    count = export_absences(store, out, fmt, args.classes, args.start, args.end, args.student)
+    print(f"{count} absence(s) exported", file=sys.stderr)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Attendance app maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate = commands.add_parser("migrate-absences", help=cmd_migrate_absences.__doc__)
+    migrate.add_argument("--source", default=ABSENCE_DIR,
+                         help="folder holding the <class>/absences_*.xlsx files")
+    migrate.add_argument("--target", default=ABSENCE_DIR,
+                         help="folder of the SQLite absence database")
+    migrate.add_argument("--keep-source", action="store_true",
+                         help="leave the imported workbooks in place instead of "
+                              "moving them to <source>/legacy_xlsx")
+    migrate.set_defaults(func=cmd_migrate_absences)
+
+    replay = commands.add_parser("replay-journal", help=cmd_replay_journal.__doc__)
+    replay.add_argument("--backend", default="sqlite", choices=["sqlite", "xlsx"])
+    replay.add_argument("--root", default=ABSENCE_DIR)
+    replay.add_argument("--since", default=None,
+                        help="only sessions saved at or after this ISO timestamp")
+    replay.set_defaults(func=cmd_replay_journal)
+
+    check = commands.add_parser("check-rollups", help=cmd_check_rollups.__doc__)
+    check.add_argument("--backend", default="sqlite", choices=["sqlite", "xlsx"])
+    check.add_argument("--root", default=ABSENCE_DIR)
+    check.add_argument("--repair", action="store_true",
+                       help="rebuild the rollups when they do not match")
+    check.set_defaults(func=cmd_check_rollups)
+
+    alerts = commands.add_parser("send-alerts", help=cmd_send_alerts.__doc__)
+    alerts.add_argument("--backend", default="sqlite", choices=["sqlite", "xlsx"])
+    alerts.add_argument("--root", default=ABSENCE_DIR)
+    alerts.add_argument("--force", action="store_true",
+                        help="send even if the digest delay has not elapsed")
+    alerts.set_defaults(func=cmd_send_alerts)
+
+    retention = commands.add_parser("retention", help=cmd_retention.__doc__)
+    retention.add_argument("--days", type=int, default=None,
+                           help="days of history kept, data_retention_days setting by default")
+    retention.add_argument("--no-archive", action="store_true",
+                           help="delete old absences without archiving them")
+    retention.add_argument("--dry-run", action="store_true", help="only report what would be done")
+    retention.add_argument("--backend", default="sqlite", choices=["sqlite", "xlsx"])
+    retention.add_argument("--root", default=ABSENCE_DIR)
+    retention.set_defaults(func=cmd_retention)
+
+    import_cmd = commands.add_parser("import-classes", help=cmd_import_classes.__doc__)
+    import_cmd.add_argument("paths", nargs="+", help="files or folders to import")
+    import_cmd.add_argument("--classes-dir", default=CLASSES_DIR)
+    import_cmd.add_argument("--workers", type=int, default=None,
+                            help="parser processes, one per CPU by default")
+    import_cmd.set_defaults(func=cmd_import_classes)
+
+    export = commands.add_parser("export-absences", help=cmd_export_absences.__doc__)
+    export.add_argument("-o", "--output", default=None,
+                        help="output file, CSV on standard output when omitted")
+    export.add_argument("--format", default=None, choices=EXPORT_FORMATS,
+                        help="guessed from the output extension by default")
+    export.add_argument("--class", dest="classes", action="append", default=[],
+                        help="class to export, repeat for several, all classes by default")
+    export.add_argument("--start", default=None, help="first date included (YYYY-MM-DD)")
+    export.add_argument("--end", default=None, help="last date included (YYYY-MM-DD)")
+    export.add_argument("--student", default=None, help="Code Massar of one student")
+    export.add_argument("--backend", default="sqlite", choices=["sqlite", "xlsx"])
+    export.add_argument("--root", default=ABSENCE_DIR)
+    export.set_defaults(func=cmd_export_absences)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
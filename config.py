@@ -0,0 +1,50 @@
+"""Shared paths, settings and file naming helpers"""
+import json
+import os
+from pathlib import Path
+
+from storage import update_json
+
+
+# Constants
+CLASSES_DIR = "classes"  # New directory for class files
+ABSENCE_DIR = "absences"
+SETTINGS_FILE = "settings.json"
+
+
+def load_settings():
+    if os.path.exists(SETTINGS_FILE):
+        with open(SETTINGS_FILE, 'r') as f:
+            return json.load(f)
+    return {}
+
+def save_settings(settings):
+    update_json(SETTINGS_FILE, lambda current: current.update(settings), default={})
+
+
+def sanitize_filename(name):
+    """
+    Sanitize filename by removing/replacing invalid characters
+
+    Args:
+        name (str): Original filename
+
+    Returns:
+        str: Sanitized filename safe for filesystem
+    """
+    # Replace invalid characters with underscores
+    invalid_chars = '<>:"/\\|?*'
+    for char in invalid_chars:
+        name = name.replace(char, '_')
+
+    # Remove any other potentially problematic characters
+    name = ''.join(c for c in name if c.isprintable())
+
+    # Limit length to avoid potential issues
+    return name[:100]
+
+
+def file_stamp(path):
+    """Return the (mtime_ns, size) pair identifying a version of a file"""
+    stat = Path(path).stat()
+    return stat.st_mtime_ns, stat.st_size
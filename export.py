@@ -0,0 +1,159 @@
+"""
+Streaming export of absence reports
+
+Rows flow from AbsenceStore.iter_rows through generator filters into a
+CSV writer or a write-only openpyxl workbook, one row at a time; peak
+memory stays flat whatever the size of the exported history.
+"""
+import csv
+import io
+import os
+import tempfile
+import time
+from itertools import chain
+from pathlib import Path
+
+from openpyxl import Workbook
+
+from absence_store import ROW_COLUMNS
+
+
+EXPORT_FORMATS = ('csv', 'xlsx')
+XLSX_MAX_ROWS = 1_048_576  # Excel sheet limit, header included
+EXPORT_PREFIX = "absences_"
+STALE_EXPORT_SECONDS = 3600  # temporary exports older than this are removed
+MIME_TYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def export_rows(store, class_names=None, start=None, end=None, code_massar=None):
+    """
+    Yield the absence rows of an export, class after class
+
+    Args:
+        store (AbsenceStore): Source store
+        class_names (list): Classes to export, every class when empty
+        start: First date included
+        end: Last date included
+        code_massar (str): Restrict to one student
+
+    Yields:
+        tuple: ROW_COLUMNS values
+    """
+    if not class_names:
+        return store.iter_rows(None, start, end, code_massar)
+    return chain.from_iterable(
+        store.iter_rows(class_name, start, end, code_massar) for class_name in class_names
+    )
+
+
+def write_csv(rows, out):
+    """
+    Write rows as UTF-8 CSV to a binary file object
+
+    A BOM is written first so that Excel shows Arabic names correctly.
+
+    Returns:
+        int: Number of rows written
+    """
+    text = io.TextIOWrapper(out, encoding='utf-8-sig', newline='', write_through=True)
+    try:
+        writer = csv.writer(text)
+        writer.writerow(ROW_COLUMNS)
+        count = 0
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+        text.flush()
+        return count
+    finally:
+        # Leave out open for the caller
+        text.detach()
+
+
+def write_xlsx(rows, out):
+    """
+    Write rows to a write-only workbook, starting a new sheet at the Excel limit
+
+    Returns:
+        int: Number of rows written
+    """
+    workbook = Workbook(write_only=True)
+    sheet, sheet_rows, count = None, XLSX_MAX_ROWS, 0
+    for row in rows:
+        if sheet_rows >= XLSX_MAX_ROWS:
+            sheet = workbook.create_sheet(f"Absences {len(workbook.worksheets) + 1}")
+            sheet.append(ROW_COLUMNS)
+            sheet_rows = 1
+        sheet.append(row)
+        sheet_rows += 1
+        count += 1
+    if sheet is None:
+        workbook.create_sheet("Absences 1").append(ROW_COLUMNS)
+    workbook.save(out)
+    return count
+
+
+def export_absences(store, out, fmt='csv', class_names=None, start=None, end=None,
+                    code_massar=None):
+    """
+    Export absences to a path or binary file object
+
+    Returns:
+        int: Number of absence rows exported
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    rows = export_rows(store, class_names, start, end, code_massar)
+    if fmt == 'xlsx':
+        return write_xlsx(rows, out)
+    if isinstance(out, (str, os.PathLike)):
+        with open(out, 'wb') as f:
+            return write_csv(rows, f)
+    return write_csv(rows, out)
+
+
+def remove_stale_exports(folder=None, max_age=STALE_EXPORT_SECONDS):
+    """
+    Delete the temporary export files left over by earlier exports
+
+    Returns:
+        int: Number of files deleted
+    """
+    folder = Path(folder or tempfile.gettempdir())
+    cutoff = time.time() - max_age
+    removed = 0
+    for fmt in EXPORT_FORMATS:
+        for path in folder.glob(f"{EXPORT_PREFIX}*.{fmt}"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    removed += 1
+            except OSError:
+                # Removed meanwhile by another process
+                continue
+    return removed
+
+
+def export_to_file(store, fmt='csv', class_names=None, start=None, end=None,
+                   code_massar=None, folder=None):
+    """
+    Export absences to a new temporary file, deleted if the export fails
+
+    Stale temporary exports are removed first. The caller deletes the
+    returned file once it is served.
+
+    Returns:
+        tuple: (path, number of absence rows exported)
+    """
+    remove_stale_exports(folder)
+    fd, path = tempfile.mkstemp(prefix=EXPORT_PREFIX, suffix=f".{fmt}", dir=folder)
+    os.close(fd)
+    try:
+        count = export_absences(store, path, fmt, class_names, start, end, code_massar)
+    except BaseException:
+        Path(path).unlink(missing_ok=True)
+        raise
+    return path, count
@@ -0,0 +1,257 @@
+"""
+Continuous assessment grades of the saved classes, joined to the absences
+
+The score columns of each Massar workbook (see massar.GRADE_COLUMNS) are
+parsed once per version of the file into classes/grades.sqlite, one typed
+row per class and student. Saving a class refreshes its rows (a
+class_registry.on_class_saved listener), sync() catches up with classes
+saved by other processes or before the table existed. Reading the grades
+of the whole school is then one query, no workbook is opened per request.
+
+with_absences() joins the grades to the absence counts of a period and
+correlations() measures, per class or per subject (Matière), how grades
+follow absences, both as whole-column pandas operations.
+"""
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from class_registry import on_class_saved
+from config import CLASSES_DIR, file_stamp, sanitize_filename
+from massar import GRADE_COLUMNS, read_general_info, read_grades
+from metrics import timed
+
+
+GRADES_FILENAME = "grades.sqlite"
+AVERAGE_COLUMN = "Moyenne"
+ABSENCES_COLUMN = "Absences"
+CORRELATION_COLUMN = "Corrélation"
+
+logger = logging.getLogger(__name__)
+
+# SQL column of each score, in GRADE_COLUMNS order
+SCORE_FIELDS = ['score_1', 'score_2', 'score_3', 'score_4']
+
+_SCHEMA = f"""
+    CREATE TABLE IF NOT EXISTS sources (
+        class_key TEXT PRIMARY KEY,
+        stamp TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS grades (
+        class_key TEXT NOT NULL,
+        classe TEXT NOT NULL,
+        matiere TEXT,
+        semestre TEXT,
+        code_massar TEXT NOT NULL,
+        nom TEXT,
+        {', '.join(f'{field} REAL' for field in SCORE_FIELDS)},
+        PRIMARY KEY (class_key, code_massar)
+    );
+    CREATE INDEX IF NOT EXISTS idx_grades_code ON grades (code_massar);
+"""
+
+
+def _stamp(path):
+    return ":".join(map(str, file_stamp(path)))
+
+
+class GradeBook:
+    """Grades of the workbooks of one classes folder"""
+
+    def __init__(self, classes_dir=CLASSES_DIR):
+        self.classes_dir = Path(classes_dir)
+        self.classes_dir.mkdir(parents=True, exist_ok=True)
+        self.path = self.classes_dir / GRADES_FILENAME
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    @timed("grades.ingest")
+    def ingest(self, class_name, path):
+        """
+        Replace the grades of a class with those of its file
+
+        Classes known only by their roster have no grades, their rows are
+        removed.
+
+        Returns:
+            int: Number of students with grades
+        """
+        path = Path(path)
+        class_key = sanitize_filename(class_name)
+        if path.suffix != '.xlsx':
+            self.remove(class_name)
+            return 0
+        stamp = _stamp(path)
+        info = read_general_info(path)
+        grades = read_grades(path)
+        rows = [
+            (class_key, class_name, info.get('Matière'), info.get('Semestre'), code, nom,
+             *(None if pd.isna(score) else float(score) for score in scores))
+            for code, nom, *scores in grades.itertuples(index=False)
+        ]
+        with self._connect() as conn:
+            conn.execute("DELETE FROM grades WHERE class_key = ?", (class_key,))
+            placeholders = ', '.join('?' * (6 + len(SCORE_FIELDS)))
+            conn.executemany(f"INSERT OR REPLACE INTO grades VALUES ({placeholders})", rows)
+            conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?)", (class_key, stamp))
+        return len(rows)
+
+    def remove(self, class_name):
+        """Forget the grades of a class"""
+        class_key = sanitize_filename(class_name)
+        with self._connect() as conn:
+            conn.execute("DELETE FROM grades WHERE class_key = ?", (class_key,))
+            conn.execute("DELETE FROM sources WHERE class_key = ?", (class_key,))
+
+    def sync(self):
+        """
+        Ingest the workbooks that are new or changed since their last ingestion
+
+        Only file stamps are compared, unchanged workbooks are not opened.
+        Unreadable workbooks are logged and retried on the next call.
+
+        Returns:
+            int: Number of classes ingested or removed
+        """
+        with self._connect() as conn:
+            known = dict(conn.execute("SELECT class_key, stamp FROM sources"))
+        workbooks = {path.stem: path for path in self.classes_dir.glob('*.xlsx')}
+        changed = 0
+        for class_name, path in sorted(workbooks.items()):
+            if known.get(sanitize_filename(class_name)) != _stamp(path):
+                try:
+                    self.ingest(class_name, path)
+                except Exception:
+                    logger.exception("Grades of %s could not be read", class_name)
+                    continue
+                changed += 1
+        for class_key in set(known) - {sanitize_filename(name) for name in workbooks}:
+            self.remove(class_key)
+            changed += 1
+        return changed
+
+    def grades(self, class_name=None, matiere=None):
+        """
+        Return the grades of one class, one subject or the whole school
+
+        Returns:
+            pd.DataFrame: Classe, Matière, Semestre, Code Massar, Nom, one
+                float64 column per score and their mean (Moyenne)
+        """
+        where, params = [], []
+        if class_name is not None:
+            where.append("class_key = ?")
+            params.append(sanitize_filename(class_name))
+        if matiere is not None:
+            where.append("matiere = ?")
+            params.append(matiere)
+        sql = f"""
+            SELECT classe AS "Classe", matiere AS "Matière", semestre AS "Semestre",
+                   code_massar AS "Code Massar", nom AS "Nom",
+                   {', '.join(f'{field} AS "{label}"'
+                              for field, label in zip(SCORE_FIELDS, GRADE_COLUMNS.values()))}
+            FROM grades
+        """
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY classe, nom"
+        with self._connect() as conn:
+            df = pd.read_sql_query(sql, conn, params=params)
+        scores = list(GRADE_COLUMNS.values())
+        df[scores] = df[scores].astype('float64')
+        df[AVERAGE_COLUMN] = df[scores].mean(axis=1).round(2)
+        return df
+
+    def subjects(self):
+        """Return the subjects found in the saved workbooks"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT DISTINCT matiere FROM grades WHERE matiere IS NOT NULL ORDER BY matiere")
+            return [row[0] for row in rows]
+
+
+def with_absences(grades, absence_counts):
+    """
+    Add the absence count of each student to a grades frame
+
+    Args:
+        grades (pd.DataFrame): GradeBook.grades() result
+        absence_counts (pd.DataFrame): Code Massar and a count column, as
+            returned by AbsenceStore.student_counts
+
+    Returns:
+        pd.DataFrame: grades with an Absences column, 0 for students never
+            absent over the period
+    """
+    counts = absence_counts.iloc[:, [0, -1]].copy()
+    counts.columns = ['Code Massar', ABSENCES_COLUMN]
+    counts['Code Massar'] = counts['Code Massar'].astype(str)
+    df = grades.merge(counts, on='Code Massar', how='left')
+    df[ABSENCES_COLUMN] = df[ABSENCES_COLUMN].fillna(0).astype('int64')
+    return df
+
+
+def correlations(df, by):
+    """
+    Correlate absences and average grade per group
+
+    Pearson's r is computed from per-group sums (n, Σx, Σy, Σx², Σy², Σxy)
+    in a single groupby; students without any score are left out.
+
+    Args:
+        df (pd.DataFrame): with_absences() result
+        by (str): 'Classe' or 'Matière'
+
+    Returns:
+        pd.DataFrame: by, Élèves, mean grade, mean absences and r, most
+            negative correlation first
+    """
+    data = df.loc[df[AVERAGE_COLUMN].notna(), [by, ABSENCES_COLUMN, AVERAGE_COLUMN]]
+    x = data[ABSENCES_COLUMN].astype('float64')
+    y = data[AVERAGE_COLUMN]
+    sums = pd.DataFrame({
+        by: data[by], 'n': 1, 'x': x, 'y': y, 'xx': x * x, 'yy': y * y, 'xy': x * y,
+    }).groupby(by, dropna=False).sum()
+    n = sums['n']
+    covariance = n * sums['xy'] - sums['x'] * sums['y']
+    spread = (n * sums['xx'] - sums['x'] ** 2) * (n * sums['yy'] - sums['y'] ** 2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = covariance / np.sqrt(spread)
+    result = pd.DataFrame({
+        'Élèves': n,
+        AVERAGE_COLUMN: (sums['y'] / n).round(2),
+        'Absences moyennes': (sums['x'] / n).round(1),
+        CORRELATION_COLUMN: r.replace([np.inf, -np.inf], np.nan).round(2) + 0.0,
+    })
+    return result.reset_index().sort_values(CORRELATION_COLUMN, ignore_index=True)
+
+
+_books = {}
+_books_lock = threading.Lock()
+
+
+def get_gradebook(classes_dir=CLASSES_DIR):
+    """Return the process-wide grade book of a classes folder"""
+    key = str(Path(classes_dir).resolve())
+    with _books_lock:
+        book = _books.get(key)
+        if book is None:
+            book = _books[key] = GradeBook(classes_dir)
+        return book
+
+
+@on_class_saved
+def _ingest_saved_class(class_name, path):
+    try:
+        get_gradebook(Path(path).parent).ingest(class_name, path)
+    except Exception:
+        # The class is saved, the next sync() retries
+        logger.exception("Grades of %s could not be read", class_name)
@@ -0,0 +1,274 @@
+"""
+Student x day absence matrices for the calendar heatmap
+
+An AbsenceMatrix holds, for one class over a term, the number of time
+slots each student missed each school day as a dense uint8 NumPy array
+(roster order x weekdays). Matrices are built once from the store and kept
+in a process-wide LRU cache per (class, term), they are never rebuilt on a
+rerun. Sessions saved afterwards are applied to them in place, read from
+the end of the store journal: every process journals its sessions before
+writing them, so the sessions saved through the API are seen by the
+Streamlit process too. Applying a session replaces its previous version,
+reading a record twice is harmless.
+
+A rewritten journal (retention) drops every matrix, saving a class file
+drops the matrices of the class, its roster order may have changed.
+"""
+import os
+import threading
+from collections import OrderedDict
+from datetime import date as date_type
+
+import numpy as np
+import pandas as pd
+
+from class_cache import load_class
+from class_registry import available_classes, class_path, on_class_saved
+from config import sanitize_filename
+from storage import tail_journal
+
+
+TERMS = {
+    'S1': "Semestre 1",
+    'S2': "Semestre 2",
+    'year': "Année scolaire",
+}
+DEFAULT_MAXSIZE = 128
+# Journal bytes re-read when a matrix is built, covering the sessions
+# journaled but not yet written to the store by a background writer
+JOURNAL_OVERLAP = 256 * 1024
+
+
+def term_bounds(start_year, term):
+    """
+    Return the first and last day of a term of a school year
+
+    Args:
+        start_year (int): Year the school year starts in (September)
+        term (str): 'S1' (September to January), 'S2' (February to July)
+            or 'year'
+
+    Returns:
+        tuple: ('YYYY-MM-DD', 'YYYY-MM-DD')
+    """
+    if term == 'S2':
+        first = date_type(start_year + 1, 2, 1)
+    else:
+        first = date_type(start_year, 9, 1)
+    last = date_type(start_year + 1, 1, 31) if term == 'S1' else date_type(start_year + 1, 7, 31)
+    return first.isoformat(), last.isoformat()
+
+
+def current_term(start_year, today=None):
+    """Return the term of a school year in progress, 'S1' outside of it"""
+    first, last = term_bounds(start_year, 'S2')
+    today = (today or date_type.today()).isoformat()
+    return 'S2' if first <= today <= last else 'S1'
+
+
+class AbsenceMatrix:
+    """
+    Absent slots per student and school day of one class
+
+    Attributes:
+        codes (list): Code Massar of each row, roster order first
+        names (list): Student name of each row
+        days (list): 'YYYY-MM-DD' of each column, every weekday of the term
+            plus the other days with a session
+        counts (np.ndarray): rows x days, uint8
+    """
+
+    def __init__(self, class_name, start, end, roster):
+        self.class_name = class_name
+        self.start, self.end = start, end
+        self.codes = [str(code) for code in roster['Code Massar']]
+        self.names = [None if pd.isna(nom) else str(nom) for nom in roster['Nom']]
+        self.days = [day.strftime('%Y-%m-%d') for day in pd.bdate_range(start, end)]
+        self._rows = {code: i for i, code in enumerate(self.codes)}
+        self._columns = {day: i for i, day in enumerate(self.days)}
+        self.counts = np.zeros((len(self.codes), len(self.days)), dtype=np.uint8)
+        self._sessions = {}  # (date, time slot) -> absent codes
+
+    def _row(self, code, nom):
+        row = self._rows.get(code)
+        if row is None:
+            # Absent student missing from the roster, e.g. moved to another class
+            row = self._rows[code] = len(self.codes)
+            self.codes.append(code)
+            self.names.append(nom)
+            self.counts = np.vstack([self.counts, np.zeros((1, len(self.days)), np.uint8)])
+        return row
+
+    def _column(self, day):
+        column = self._columns.get(day)
+        if column is None:
+            # Session on a weekend day
+            self.days = sorted(self.days + [day])
+            self._columns = {d: i for i, d in enumerate(self.days)}
+            column = self._columns[day]
+            self.counts = np.insert(self.counts, column, 0, axis=1)
+        return column
+
+    def apply(self, day, time_slot, absences):
+        """Replace the absences [Code Massar, Nom] of one session"""
+        previous = self._sessions.pop((day, time_slot), ())
+        if previous:
+            rows = [self._rows[code] for code in previous]
+            np.subtract.at(self.counts, (rows, self._columns[day]), 1)
+        if absences:
+            rows = [self._row(str(code), nom) for code, nom in absences]
+            # Inserting a new column replaces self.counts, look it up first
+            column = self._column(day)
+            np.add.at(self.counts, (rows, column), 1)
+            self._sessions[(day, time_slot)] = [str(code) for code, _ in absences]
+
+    def load(self, rows):
+        """Fill the matrix from (Classe, Date, Heure, Code Massar, Nom) rows"""
+        sessions = {}
+        for _, day, time_slot, code, nom in rows:
+            sessions.setdefault((day, time_slot), []).append([code, nom])
+        for day, time_slot in sorted(sessions):
+            # Every session needs its column before the bulk add below
+            self._column(day)
+            for code, nom in sessions[(day, time_slot)]:
+                self._row(str(code), nom)
+        cells = [(self._rows[str(code)], self._columns[day])
+                 for (day, _), absences in sessions.items() for code, _ in absences]
+        if cells:
+            rows, columns = np.array(cells).T
+            np.add.at(self.counts, (rows, columns), 1)
+        self._sessions = {key: [str(code) for code, _ in absences]
+                          for key, absences in sessions.items()}
+
+    def snapshot(self):
+        """Return (codes, names, days, counts) copies, safe to use outside the cache lock"""
+        return list(self.codes), list(self.names), list(self.days), self.counts.copy()
+
+
+class HeatmapCache:
+    """LRU cache of the absence matrices of one store, kept current by its journal"""
+
+    def __init__(self, store, maxsize=DEFAULT_MAXSIZE):
+        self.store = store
+        self.maxsize = maxsize
+        self._matrices = OrderedDict()  # (class_key, start, end) -> AbsenceMatrix
+        self._lock = threading.Lock()
+        self._journal = None  # (inode, offset read up to)
+
+    @staticmethod
+    def _apply(matrices, records):
+        for record in records:
+            class_key = sanitize_filename(record['class_name'])
+            for (key, start, end), matrix in matrices:
+                if key == class_key and start <= record['date'] <= end:
+                    matrix.apply(record['date'], record['time_slot'], record['absences'])
+
+    def _catch_up(self):
+        """Apply the sessions journaled since the last call, under the lock"""
+        path = self.store.journal_path
+        try:
+            stat = os.stat(path)
+        except (TypeError, OSError):
+            return
+        if self._journal is None or self._journal[0] != stat.st_ino \
+                or stat.st_size < self._journal[1]:
+            # First call or rewritten journal
+            self._matrices.clear()
+            self._journal = (stat.st_ino, stat.st_size)
+            return
+        if stat.st_size > self._journal[1]:
+            records, offset = tail_journal(path, self._journal[1])
+            self._apply(list(self._matrices.items()), records)
+            self._journal = (stat.st_ino, offset)
+
+    def _recent_records(self):
+        """Return the records of the last JOURNAL_OVERLAP bytes of the journal"""
+        path = self.store.journal_path
+        if path is None or self._journal is None:
+            return []
+        offset = max(0, self._journal[1] - JOURNAL_OVERLAP)
+        if offset:
+            with open(path, 'rb') as f:
+                f.seek(offset - 1)
+                # Start at the next line
+                offset += len(f.readline()) - 1
+        records, _ = tail_journal(path, offset)
+        return records
+
+    def _build(self, key, class_name, start, end):
+        if class_name in available_classes():
+            _, roster = load_class(class_path(class_name))
+        else:
+            roster = pd.DataFrame(columns=['Code Massar', 'Nom'])
+        matrix = AbsenceMatrix(class_name, start, end, roster)
+        matrix.load(self.store.iter_rows(class_name, start, end))
+        self._apply([(key, matrix)], self._recent_records())
+        return matrix
+
+    def get(self, class_name, start, end):
+        """
+        Return the matrix of a class between two days, built on first use
+
+        Returns:
+            tuple: (codes, names, days, counts), see AbsenceMatrix
+        """
+        key = (sanitize_filename(class_name), start, end)
+        with self._lock:
+            self._catch_up()
+            matrix = self._matrices.get(key)
+            if matrix is not None:
+                self._matrices.move_to_end(key)
+                return matrix.snapshot()
+
+            matrix = self._build(key, class_name, start, end)
+            self._matrices[key] = matrix
+            while len(self._matrices) > self.maxsize:
+                self._matrices.popitem(last=False)
+            return matrix.snapshot()
+
+    def check(self):
+        """
+        Compare the cached matrices, updated in place, with fresh builds
+
+        Returns:
+            list: (class_key, start, end) of the matrices that differ
+        """
+        mismatches = []
+        with self._lock:
+            self._catch_up()
+            for key, matrix in self._matrices.items():
+                fresh = self._build(key, matrix.class_name, matrix.start, matrix.end)
+                cached = pd.DataFrame(matrix.counts, index=matrix.codes, columns=matrix.days)
+                expected = pd.DataFrame(fresh.counts, index=fresh.codes, columns=fresh.days)
+                # Rows and columns may come in another order, or only hold zeros
+                cached, expected = cached.align(expected, fill_value=0)
+                if not cached.equals(expected):
+                    mismatches.append(key)
+        return mismatches
+
+    def invalidate(self, class_name=None):
+        """Drop the matrices of a class, or all of them when None"""
+        with self._lock:
+            if class_name is None:
+                self._matrices.clear()
+                return
+            class_key = sanitize_filename(class_name)
+            for key in [key for key in self._matrices if key[0] == class_key]:
+                del self._matrices[key]
+
+
+_caches = []
+
+
+def attach_heatmaps(store, maxsize=DEFAULT_MAXSIZE):
+    """Cache the absence matrices of store"""
+    cache = HeatmapCache(store, maxsize)
+    store.heatmaps = cache
+    _caches.append(cache)
+    return cache
+
+
+@on_class_saved
+def _invalidate_saved_class(class_name, path):
+    for cache in _caches:
+        cache.invalidate(class_name)
@@ -0,0 +1,266 @@
+"""Readers for Massar class exports (export_notesCC_*.xlsx)"""
+import json
+import warnings
+from pathlib import Path
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from config import file_stamp
+from storage import atomic_write_bytes
+
+
+# Header cells of a Massar export as 1-based (row, column) coordinates
+HEADER_CELLS = {
+    'Année Scolaire': (13, 4),
+    'Semestre': (11, 4),
+    'Matière': (11, 15),
+    'Académie': (7, 4),
+    'Province': (7, 9),
+    'Ecole': (7, 15),
+    'Niveau': (9, 4),
+    'Professeur': (9, 15),
+    'Classe': (9, 9),
+}
+
+# Header and roster compiled at import time, stored next to the workbook
+COMPILED_SUFFIX = ".roster.json"
+COMPILED_VERSION = 1
+
+# Continuous assessment scores as 0-based columns of the student rows, each
+# followed by its absence flag column
+GRADE_COLUMNS = {
+    6: 'Devoir 1',
+    8: 'Devoir 2',
+    10: 'Devoir 3',
+    12: 'Activités intégrées',
+}
+
+HEADER_LAST_ROW = max(row for row, _ in HEADER_CELLS.values())
+HEADER_LAST_COL = max(col for _, col in HEADER_CELLS.values())
+
+
+def read_general_info(file):
+    """
+    Read the class header of a Massar export in a single pass
+
+    The workbook is opened once in read-only mode and only the rows
+    holding the header cells are streamed.
+
+    Args:
+        file: Path or file-like object of the workbook
+
+    Returns:
+        dict: Header label -> cell value
+    """
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        rows = list(ws.iter_rows(
+            min_row=1, max_row=HEADER_LAST_ROW,
+            max_col=HEADER_LAST_COL, values_only=True
+        ))
+    finally:
+        wb.close()
+
+    info = {}
+    for label, (row, col) in HEADER_CELLS.items():
+        values = rows[row - 1] if row <= len(rows) else ()
+        info[label] = values[col - 1] if col <= len(values) else None
+    return info
+
+
+def read_students(file):
+    """
+    Read the student roster of a Massar export
+
+    Args:
+        file: Path or file-like object of the workbook
+
+    Returns:
+        pd.DataFrame: Code Massar, Nom and Absence (all False) columns
+    """
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        df = pd.read_excel(file, engine="openpyxl")
+    code_massar = df.iloc[16:, 2].reset_index(drop=True)
+    nom = df.iloc[16:, 3].reset_index(drop=True)
+    # Create DataFrame with Absence column initialized to False
+    return pd.DataFrame({
+        'Code Massar': code_massar,
+        'Nom': nom,
+        'Absence': False  # Initialize all students as present
+    })
+
+
+def read_grades(file):
+    """
+    Read the continuous assessment scores of a Massar export
+
+    Args:
+        file: Path or file-like object of the workbook
+
+    Returns:
+        pd.DataFrame: Code Massar, Nom and one float64 column per
+            GRADE_COLUMNS entry, NaN where no score was entered
+    """
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        df = pd.read_excel(file, engine="openpyxl")
+    rows = df.iloc[16:]
+    rows = rows[rows.iloc[:, 2].notna()]
+    grades = pd.DataFrame({
+        'Code Massar': rows.iloc[:, 2].astype(str).str.strip().to_numpy(),
+        'Nom': rows.iloc[:, 3].to_numpy(),
+    })
+    for col, label in GRADE_COLUMNS.items():
+        values = rows.iloc[:, col] if col < rows.shape[1] else pd.Series(index=rows.index)
+        grades[label] = pd.to_numeric(values, errors='coerce').astype('float64').to_numpy()
+    return grades
+
+
+def compiled_path(path):
+    """Return the path of the compiled roster of a class file"""
+    path = Path(path)
+    return path.with_name(f"{path.stem}{COMPILED_SUFFIX}")
+
+
+def write_compiled(target, info, students, source_stamp=None):
+    """
+    Write a compiled roster file
+
+    Args:
+        target (Path): Destination .roster.json path
+        info (dict): General info of the class
+        students (pd.DataFrame): Roster with Code Massar and Nom columns
+        source_stamp (tuple): Stamp of the workbook the roster comes from,
+            None for rosters imported without a per-class workbook
+    """
+    compiled = {
+        'version': COMPILED_VERSION,
+        'source_stamp': list(source_stamp) if source_stamp is not None else None,
+        'info': info,
+        'students': [
+            [None if pd.isna(code) else str(code), None if pd.isna(nom) else str(nom)]
+            for code, nom in zip(students['Code Massar'], students['Nom'])
+        ],
+    }
+    atomic_write_bytes(target, json.dumps(compiled, ensure_ascii=False, default=str).encode('utf-8'))
+
+
+def compile_class(path):
+    """
+    Parse a class file once and store header and roster next to it
+
+    The compiled file records the stamp of the workbook it was built
+    from, the workbook stays the source of truth.
+
+    Returns:
+        tuple: (general info dict, students DataFrame)
+    """
+    path = Path(path)
+    stamp = file_stamp(path)
+    info = read_general_info(path)
+    students = read_students(path)
+    write_compiled(compiled_path(path), info, students, stamp)
+    return info, students
+
+
+def _load_compiled(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        compiled = json.load(f)
+    if compiled.get('version') != COMPILED_VERSION:
+        raise ValueError(f"Unsupported roster version in {path}")
+    students = pd.DataFrame(compiled['students'], columns=['Code Massar', 'Nom'])
+    students['Absence'] = False
+    return compiled, students
+
+
+def read_class(path):
+    """
+    Return (general info, students DataFrame) of a saved class file
+
+    For a workbook, the compiled roster is used when it matches the
+    current file, otherwise the workbook is parsed and compiled again.
+    A .roster.json path is read as is.
+    """
+    path = Path(path)
+    if path.name.endswith(COMPILED_SUFFIX):
+        compiled, students = _load_compiled(path)
+        return compiled['info'], students
+    try:
+        compiled, students = _load_compiled(compiled_path(path))
+        if compiled.get('source_stamp') == list(file_stamp(path)):
+            return compiled['info'], students
+    except (OSError, ValueError, KeyError):
+        pass
+    return compile_class(path)
+
+
+# Cells of a ListEleve_*.xls sheet as 0-based (row, column) coordinates
+STUDENT_LIST_CELLS = {
+    'Année Scolaire': (5, 2),
+    'Académie': (5, 19),
+    'Province': (7, 20),
+    'Ecole': (7, 7),
+    'Niveau': (9, 19),
+    'Classe': (10, 8),
+}
+STUDENT_LIST_FIRST_ROW = 15
+STUDENT_LIST_CODE_COL = 23
+STUDENT_LIST_LAST_NAME_COL = 16
+STUDENT_LIST_FIRST_NAME_COL = 12
+
+
+def _clean(value):
+    if pd.isna(value):
+        return None
+    return str(value).strip() if isinstance(value, str) else value
+
+
+def read_student_list(file):
+    """
+    Read a Massar student list (ListEleve_*.xls), one class per sheet
+
+    The list has no subject, semester or teacher, those header fields
+    are None.
+
+    Args:
+        file: Path or file-like object of the workbook
+
+    Returns:
+        list: (general info dict, students DataFrame) per class sheet
+    """
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    sheets = pd.read_excel(file, sheet_name=None, header=None)
+    classes = []
+    for df in sheets.values():
+        if df.shape[0] <= STUDENT_LIST_FIRST_ROW or df.shape[1] <= STUDENT_LIST_CODE_COL:
+            continue
+        info = dict.fromkeys(HEADER_CELLS)
+        for label, (row, col) in STUDENT_LIST_CELLS.items():
+            info[label] = _clean(df.iat[row, col])
+        if not info['Classe']:
+            continue
+
+        rows = df.iloc[STUDENT_LIST_FIRST_ROW:]
+        rows = rows[rows[STUDENT_LIST_CODE_COL].notna()]
+        last_names = rows[STUDENT_LIST_LAST_NAME_COL].map(_clean)
+        first_names = rows[STUDENT_LIST_FIRST_NAME_COL].map(_clean)
+        students = pd.DataFrame({
+            'Code Massar': rows[STUDENT_LIST_CODE_COL].map(_clean).astype(str).to_numpy(),
+            'Nom': [' '.join(part for part in (last, first) if part)
+                    for last, first in zip(last_names, first_names)],
+            'Absence': False,
+        })
+        classes.append((info, students))
+    return classes
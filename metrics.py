@@ -0,0 +1,234 @@
+"""
+In-process metrics of the hot paths
+
+timed(name) is a decorator and a context manager: each call feeds the
+duration histogram of the operation and, on the Streamlit script thread,
+the trace of the current rerun started by start_trace(). inc(name) adds to
+a counter. Everything lands in one process-wide registry, rendered in the
+Prometheus text format by render_prometheus(): the API serves it on
+/metrics and the Streamlit app dumps it to metrics.prom (see maybe_dump),
+e.g. for the node_exporter textfile collector.
+
+Background threads (the attendance writer, thread pools) feed the
+histograms but no trace, their work is not part of a rerun.
+"""
+import contextvars
+import re
+import threading
+import time
+from contextlib import ContextDecorator
+
+from storage import atomic_write_bytes
+
+
+METRICS_FILE = "metrics.prom"
+METRIC_PREFIX = "attendance"
+DUMP_INTERVAL = 60  # seconds between two dumps of metrics.prom
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+NAME_RE = re.compile(r'[^a-zA-Z0-9_]')
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observed durations"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Return the upper bound of the bucket holding quantile q, an estimate"""
+        rank = q * self.count
+        for bound, count in zip(self.buckets, self.counts):
+            if count >= rank:
+                return bound
+        return self.max
+
+
+class MetricsRegistry:
+    """Thread-safe counters and duration histograms of one process"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        """
+        Return a copy of the metrics
+
+        Returns:
+            dict: 'counters' {name: value} and 'operations' {name: dict
+                with count, total, mean, p95 and max in seconds}
+        """
+        with self._lock:
+            operations = {
+                name: {
+                    'count': h.count,
+                    'total': h.sum,
+                    'mean': h.sum / h.count if h.count else 0.0,
+                    'p95': h.quantile(0.95),
+                    'max': h.max,
+                }
+                for name, h in self._histograms.items()
+            }
+            return {'counters': dict(self._counters), 'operations': operations}
+
+    def render_prometheus(self, prefix=METRIC_PREFIX):
+        """Return the metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                metric = f"{prefix}_{NAME_RE.sub('_', name)}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {self._counters[name]}")
+
+            family = f"{prefix}_operation_seconds"
+            if self._histograms:
+                lines.append(f"# HELP {family} Duration of the instrumented operations")
+                lines.append(f"# TYPE {family} histogram")
+            for name in sorted(self._histograms):
+                h = self._histograms[name]
+                label = f'operation="{name}"'
+                for bound, count in zip(h.buckets, h.counts):
+                    lines.append(f'{family}_bucket{{{label},le="{bound}"}} {count}')
+                lines.append(f'{family}_bucket{{{label},le="+Inf"}} {h.count}')
+                lines.append(f"{family}_sum{{{label}}} {h.sum:.6f}")
+                lines.append(f"{family}_count{{{label}}} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+class Trace:
+    """Operations timed during one rerun"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []  # (name, start offset, seconds, nesting depth)
+        self.depth = 0
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def breakdown(self):
+        """Return the spans in start order, callers before the operations they call"""
+        return sorted(self.spans, key=lambda span: (span[1], span[3]))
+
+
+_registry = MetricsRegistry()
+_trace = contextvars.ContextVar('metrics_trace', default=None)
+_last_dump = 0.0
+_dump_lock = threading.Lock()
+
+
+def get_registry():
+    """Return the metrics registry shared by the whole process"""
+    return _registry
+
+
+def start_trace():
+    """Start collecting the operations of the current rerun"""
+    trace = Trace()
+    _trace.set(trace)
+    return trace
+
+
+def current_trace():
+    """Return the trace of the current rerun, None outside of one"""
+    return _trace.get()
+
+
+def inc(name, value=1):
+    """Add value to a counter"""
+    _registry.inc(name, value)
+
+
+class timed(ContextDecorator):
+    """
+    Time a block or every call of a function
+
+    Failed calls are timed too and also counted in '<name>.errors'.
+
+    Args:
+        name (str): Operation name, e.g. 'load_class'
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._starts = threading.local()
+
+    def __enter__(self):
+        trace = _trace.get()
+        if trace is not None:
+            trace.depth += 1
+        stack = getattr(self._starts, 'stack', None)
+        if stack is None:
+            stack = self._starts.stack = []
+        stack.append(time.perf_counter())
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        start = self._starts.stack.pop()
+        seconds = time.perf_counter() - start
+        _registry.observe(self.name, seconds)
+        if exc_type is not None:
+            _registry.inc(f"{self.name}.errors")
+        trace = _trace.get()
+        if trace is not None:
+            trace.depth -= 1
+            trace.spans.append((self.name, start - trace.started, seconds, trace.depth))
+        return False
+
+
+def render_prometheus():
+    """Return the process metrics in the Prometheus text format"""
+    return _registry.render_prometheus()
+
+
+def dump(path=METRICS_FILE):
+    """Write the Prometheus text of the process metrics to a file"""
+    atomic_write_bytes(path, render_prometheus().encode())
+
+
+def maybe_dump(path=METRICS_FILE, interval=DUMP_INTERVAL):
+    """
+    Dump the metrics when the last dump is older than interval seconds
+
+    Returns:
+        bool: True when the file was written
+    """
+    global _last_dump
+    now = time.monotonic()
+    with _dump_lock:
+        if now - _last_dump < interval:
+            return False
+        _last_dump = now
+    dump(path)
+    return True
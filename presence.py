@@ -0,0 +1,326 @@
+"""
+Presence bitmaps of every roll-call session
+
+The absence store only keeps absent students, a session where everybody
+was present leaves no trace. Here every session is kept, as one bit per
+student in the order of the class roster (np.packbits, 1 = present): 4
+bytes for a class of 32. Rosters are stored once per version in the
+rosters table and referenced by the sessions, in absences/presence.sqlite.
+
+The log is fed by the session records written to the absence store (a
+store listener, whatever the backend). Records journaled before the
+rosters were recorded carry no roster and are skipped.
+
+load() unpacks the sessions of a period into a PresenceMatrix, on which
+attendance rates, absence streaks and slot coverage are computed with
+whole-array NumPy operations.
+"""
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from alerts import slot_key
+from config import ABSENCE_DIR, sanitize_filename
+
+
+PRESENCE_FILENAME = "presence.sqlite"
+RATE_COLUMN = "Taux de présence"
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS rosters (
+        roster_id INTEGER PRIMARY KEY,
+        digest TEXT NOT NULL UNIQUE,
+        students TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS sessions (
+        class_key TEXT NOT NULL,
+        classe TEXT NOT NULL,
+        date TEXT NOT NULL,
+        heure TEXT NOT NULL,
+        roster_id INTEGER NOT NULL REFERENCES rosters (roster_id),
+        absent INTEGER NOT NULL,
+        bits BLOB NOT NULL,
+        saved_at TEXT,
+        PRIMARY KEY (class_key, date, heure)
+    ) WITHOUT ROWID;
+"""
+
+
+def pack_presence(roster, absences):
+    """
+    Return the presence bitmap of a session
+
+    Args:
+        roster (list): [Code Massar, Nom] pairs in roster order
+        absences (list): [Code Massar, Nom] pairs of the absent students
+
+    Returns:
+        bytes: np.packbits of the presence vector, 1 = present
+    """
+    absent = {code for code, _ in absences}
+    present = np.fromiter((code not in absent for code, _ in roster), dtype=bool,
+                          count=len(roster))
+    return np.packbits(present).tobytes()
+
+
+def _longest_runs(flags, breaks):
+    """
+    Return the longest and the trailing run of flags per column of a 2D array
+
+    A run ends at a row where breaks is True, rows where both are False
+    are skipped.
+    """
+    if len(flags) == 0:
+        empty = np.zeros(flags.shape[1], dtype=int)
+        return empty, empty
+    counts = np.cumsum(flags, axis=0)
+    # Count reached at the last break before each row, runs restart from it
+    resets = np.maximum.accumulate(np.where(breaks, counts, 0), axis=0)
+    runs = counts - resets
+    return runs.max(axis=0), runs[-1]
+
+
+class PresenceMatrix:
+    """
+    Presence of the students over a list of sessions
+
+    Attributes:
+        sessions (pd.DataFrame): Date, Heure and Classe of each row, in
+            chronological order
+        students (pd.DataFrame): Code Massar and Nom of each column
+        present (np.ndarray): sessions x students, True when present
+        enrolled (np.ndarray): sessions x students, True when the student
+            was on the roster of the session
+    """
+
+    def __init__(self, sessions, students, present, enrolled):
+        self.sessions = sessions
+        self.students = students
+        self.present = present
+        self.enrolled = enrolled
+
+    def __len__(self):
+        return len(self.sessions)
+
+    @property
+    def absent(self):
+        return self.enrolled & ~self.present
+
+    def rates(self):
+        """
+        Return the attendance of each student
+
+        Returns:
+            pd.DataFrame: Code Massar, Nom, Séances, Présences, Absences and
+                the presence rate in %, lowest rate first
+        """
+        sessions = self.enrolled.sum(axis=0)
+        present = (self.present & self.enrolled).sum(axis=0)
+        df = self.students.copy()
+        df['Séances'] = sessions
+        df['Présences'] = present
+        df['Absences'] = sessions - present
+        with np.errstate(invalid='ignore', divide='ignore'):
+            df[RATE_COLUMN] = np.round(100 * present / sessions, 1)
+        return df.sort_values([RATE_COLUMN, 'Nom'], ignore_index=True)
+
+    def streaks(self):
+        """
+        Return the consecutive sessions missed by each student
+
+        Only the sessions the student was enrolled in count, a session
+        attended ends a streak.
+
+        Returns:
+            pd.DataFrame: Code Massar, Nom, the longest streak and the
+                current one (ending at the last session), longest first
+        """
+        longest, current = _longest_runs(self.absent, self.present & self.enrolled)
+        df = self.students.copy()
+        df['Série la plus longue'] = longest
+        df['Série en cours'] = current
+        return df.sort_values(['Série la plus longue', 'Série en cours'], ascending=False,
+                              ignore_index=True)
+
+    def slot_coverage(self):
+        """
+        Return the sessions held and the attendance per time slot
+
+        Returns:
+            pd.DataFrame: Heure, Séances, Présences attendues, Présences
+                and the presence rate in %, in slot order
+        """
+        expected = self.enrolled.sum(axis=1)
+        present = (self.present & self.enrolled).sum(axis=1)
+        df = pd.DataFrame({
+            'Heure': self.sessions['Heure'].to_numpy(),
+            'Séances': 1,
+            'Présences attendues': expected,
+            'Présences': present,
+        }).groupby('Heure', as_index=False).sum()
+        df[RATE_COLUMN] = np.round(100 * df['Présences'] / df['Présences attendues'].clip(lower=1), 1)
+        order = sorted(df['Heure'], key=slot_key)
+        return df.set_index('Heure').loc[order].reset_index()
+
+    def summary(self):
+        """Return the number of sessions, expected presences and the overall rate in %"""
+        expected = int(self.enrolled.sum())
+        present = int((self.present & self.enrolled).sum())
+        return {
+            'sessions': len(self),
+            'expected': expected,
+            'present': present,
+            'rate': round(100 * present / expected, 1) if expected else None,
+        }
+
+
+class PresenceLog:
+    """Presence bitmaps of the roll-call sessions under one absence folder"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def _roster_id(conn, roster):
+        """Return the id of a roster version, stored on first use"""
+        students = json.dumps(roster, ensure_ascii=False)
+        digest = hashlib.sha1(students.encode()).hexdigest()
+        conn.execute("INSERT OR IGNORE INTO rosters (digest, students) VALUES (?, ?)",
+                     (digest, students))
+        return conn.execute("SELECT roster_id FROM rosters WHERE digest = ?",
+                            (digest,)).fetchone()[0]
+
+    @staticmethod
+    def _where(class_name, start, end):
+        where, params = [], []
+        if class_name is not None:
+            where.append("class_key = ?")
+            params.append(sanitize_filename(class_name))
+        if start is not None:
+            where.append("date >= ?")
+            params.append(start)
+        if end is not None:
+            where.append("date <= ?")
+            params.append(end)
+        return where, params
+
+    def apply_records(self, records):
+        """Store the presence of session records carrying their roster, in one transaction"""
+        with self._connect() as conn:
+            for record in records:
+                roster = record.get('roster')
+                if roster is None:
+                    continue
+                conn.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (
+                    sanitize_filename(record['class_name']), record['class_name'],
+                    record['date'], record['time_slot'], self._roster_id(conn, roster),
+                    len(record['absences']), pack_presence(roster, record['absences']),
+                    record.get('saved_at'),
+                ))
+
+    def load(self, class_name=None, start=None, end=None):
+        """
+        Unpack the sessions of a period
+
+        Args:
+            class_name (str): Restrict to one class, all classes when None
+            start (str): First day 'YYYY-MM-DD' included, no bound when None
+            end (str): Last day 'YYYY-MM-DD' included, no bound when None
+
+        Returns:
+            PresenceMatrix: One row per session, one column per student
+                found on any of their rosters
+        """
+        where, params = self._where(class_name, start, end)
+        sql = "SELECT date, heure, classe, roster_id, bits FROM sessions"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        with self._connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+            roster_ids = sorted({row[3] for row in rows})
+            rosters = {
+                roster_id: json.loads(students) for roster_id, students in conn.execute(
+                    f"SELECT roster_id, students FROM rosters WHERE roster_id IN "
+                    f"({','.join('?' * len(roster_ids))})", roster_ids)
+            } if roster_ids else {}
+        rows.sort(key=lambda row: (row[0], slot_key(row[1]), row[2]))
+
+        # Columns: every student of the rosters involved, first seen first
+        columns, names = {}, []
+        for roster_id in roster_ids:
+            for code, nom in rosters[roster_id]:
+                if code not in columns:
+                    columns[code] = len(names)
+                    names.append(nom)
+        present = np.zeros((len(rows), len(columns)), dtype=bool)
+        enrolled = np.zeros_like(present)
+
+        by_roster = {}
+        for i, row in enumerate(rows):
+            by_roster.setdefault(row[3], []).append(i)
+        for roster_id, indexes in by_roster.items():
+            roster = rosters[roster_id]
+            packed = np.frombuffer(b''.join(rows[i][4] for i in indexes), dtype=np.uint8)
+            bits = np.unpackbits(packed.reshape(len(indexes), -1), axis=1, count=len(roster))
+            cells = np.ix_(indexes, [columns[code] for code, _ in roster])
+            present[cells] = bits.astype(bool)
+            enrolled[cells] = True
+
+        sessions = pd.DataFrame([row[:3] for row in rows], columns=['Date', 'Heure', 'Classe'])
+        sessions['Date'] = pd.to_datetime(sessions['Date'])
+        students = pd.DataFrame({'Code Massar': list(columns), 'Nom': names})
+        return PresenceMatrix(sessions, students, present, enrolled)
+
+    def session_count(self, class_name=None, start=None, end=None):
+        """Return the number of sessions recorded over a period"""
+        where, params = self._where(class_name, start, end)
+        sql = "SELECT COUNT(*) FROM sessions"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        with self._connect() as conn:
+            return conn.execute(sql, params).fetchone()[0]
+
+    def saved_time(self, class_key, date, heure):
+        """Return the saved_at of one recorded session, None when it is not recorded"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT saved_at FROM sessions WHERE class_key = ? AND date = ? AND heure = ?",
+                (class_key, date, heure)
+            ).fetchone()
+            return row[0] if row else None
+
+    def purge(self, before):
+        """Delete the sessions dated before a day and the rosters left unused"""
+        with self._connect() as conn:
+            removed = conn.execute("DELETE FROM sessions WHERE date < ?", (before,)).rowcount
+            conn.execute("""
+                DELETE FROM rosters WHERE roster_id NOT IN (SELECT roster_id FROM sessions)
+            """)
+        return removed
+
+    def compact(self):
+        conn = self._connect()
+        try:
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            conn.close()
+
+
+def attach_presence(store, root=ABSENCE_DIR):
+    """Record the presence bitmap of every session written to store"""
+    log = PresenceLog(Path(root) / PRESENCE_FILENAME)
+    store.add_listener(log.apply_records)
+    store.presence = log
+    return log
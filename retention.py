@@ -0,0 +1,204 @@
+"""
+Retention and compaction of the absence history
+
+run_retention enforces the data_retention_days setting:
+
+    1. absences dated before the cutoff are archived to
+       absences/archive/absences_<YYYY-MM>.csv.gz (or only dropped),
+    2. deleted from the store, together with their records in the journal
+       and its history and the presence bitmaps of their sessions (not
+       archived),
+    3. the store is compacted: VACUUM for SQLite, one workbook per class
+       and past month for the xlsx layout; legacy workbooks moved to
+       absences/legacy_xlsx by the SQLite migration are deleted once
+       they only hold absences before the cutoff,
+    4. the rollups are rebuilt from what is left and the cached heatmaps
+       dropped.
+
+With dry_run=True nothing is written, the report tells what would be done.
+"""
+import csv
+import gzip
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from absence_store import (
+    LEGACY_DIRNAME, commit_journal, MONTH_FILE_RE, ROW_COLUMNS, SESSION_FILE_RE, format_date
+)
+from config import ABSENCE_DIR
+from storage import read_journal, rewrite_journal
+
+
+ARCHIVE_DIRNAME = "archive"
+DEFAULT_RETENTION_DAYS = 365
+
+
+def retention_cutoff(retention_days, today=None):
+    """Return the first day kept, 'YYYY-MM-DD'"""
+    today = today or datetime.today()
+    return format_date(today - timedelta(days=int(retention_days)))
+
+
+def tree_usage(root, exclude=(ARCHIVE_DIRNAME,)):
+    """Return (file count, bytes) of a folder, skipping top-level sub-folders in exclude"""
+    files, size = 0, 0
+    root = Path(root)
+    for path in root.rglob('*'):
+        if path.is_file() and path.relative_to(root).parts[0] not in exclude:
+            files += 1
+            size += path.stat().st_size
+    return files, size
+
+
+def format_bytes(size):
+    """Return a byte count as a short human readable string"""
+    for unit in ('o', 'Ko', 'Mo', 'Go'):
+        if abs(size) < 1024 or unit == 'Go':
+            return f"{size:.0f} {unit}" if unit == 'o' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def archive_rows(rows, folder):
+    """
+    Append absence rows to gzipped monthly CSV archives
+
+    Each run adds a gzip member to the archive of the month, existing
+    archives stay readable as a single CSV.
+
+    Returns:
+        tuple: (rows written, list of archive paths)
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    files, writers, count = {}, {}, 0
+    try:
+        for row in rows:
+            month = row[1][:7]
+            writer = writers.get(month)
+            if writer is None:
+                path = folder / f"absences_{month}.csv.gz"
+                new = not path.exists()
+                files[month] = gzip.open(path, 'at', encoding='utf-8', newline='')
+                writer = writers[month] = csv.writer(files[month])
+                if new:
+                    writer.writerow(ROW_COLUMNS)
+            writer.writerow(row)
+            count += 1
+    finally:
+        for f in files.values():
+            f.close()
+    return count, sorted(str(folder / f"absences_{month}.csv.gz") for month in files)
+
+
+def _xlsx_plan(store, cutoff, last_month):
+    """Return (files purged, bytes purged, files merged, month files written) of an xlsx store"""
+    purged, purged_bytes, months = 0, 0, {}
+    for file in store.class_files():
+        match = SESSION_FILE_RE.match(file.name)
+        month_match = MONTH_FILE_RE.match(file.name)
+        if ((match and match.group(1) < cutoff)
+                or (month_match and month_match.group(1) < cutoff[:7])):
+            purged += 1
+            purged_bytes += file.stat().st_size
+        elif match and match.group(1)[:7] < last_month:
+            months.setdefault((file.parent, match.group(1)[:7]), []).append(file)
+    merged = [files for files in months.values() if len(files) > 1]
+    return purged, purged_bytes, sum(map(len, merged)), len(merged)
+
+
+def expired_legacy_files(root, cutoff):
+    """Return the migrated legacy workbooks dated before the cutoff"""
+    expired = []
+    for file in sorted((Path(root) / LEGACY_DIRNAME).glob('*/*.xlsx')):
+        match = SESSION_FILE_RE.match(file.name)
+        month_match = MONTH_FILE_RE.match(file.name)
+        if ((match and match.group(1) < cutoff)
+                or (month_match and month_match.group(1) < cutoff[:7])):
+            expired.append(file)
+    return expired
+
+
+def run_retention(store, root=ABSENCE_DIR, retention_days=DEFAULT_RETENTION_DAYS,
+                  archive=True, dry_run=False, today=None):
+    """
+    Apply the retention window to an absence store
+
+    Args:
+        store (AbsenceStore): Store to clean up
+        root: Absence folder, holding the journal and the archive folder
+        retention_days (int): Days of history kept
+        archive (bool): Archive removed absences instead of only deleting them
+        dry_run (bool): Only report what would be done
+        today: Reference day, today when None
+
+    Returns:
+        dict: Report with the cutoff, the rows, journal records, legacy
+            workbooks, files and bytes removed; byte counts of a dry run
+            are estimates
+    """
+    today = today or datetime.today()
+    cutoff = retention_cutoff(retention_days, today)
+    last_day = format_date(datetime.fromisoformat(cutoff) - timedelta(days=1))
+    root = Path(root)
+    files_before, bytes_before = tree_usage(root)
+    report = {
+        'cutoff': cutoff,
+        'dry_run': dry_run,
+        'rows_removed': 0,
+        'archives': [],
+        'journal_records_removed': 0,
+        'presence_sessions_removed': 0,
+        'legacy_files_removed': 0,
+        'files_merged': 0,
+        'files_before': files_before,
+        'bytes_before': bytes_before,
+    }
+
+    journals = [path for path in (store.journal_history_path, store.journal_path) if path]
+    legacy = expired_legacy_files(root, cutoff)
+    report['legacy_files_removed'] = len(legacy)
+    if dry_run:
+        report['rows_removed'] = sum(1 for _ in store.iter_rows(end=last_day))
+        report['journal_records_removed'] = sum(
+            1 for path in journals for record in read_journal(path) if record['date'] < cutoff
+        )
+        if store.presence is not None:
+            report['presence_sessions_removed'] = store.presence.session_count(end=last_day)
+        if store.name == 'xlsx':
+            files, size, merged, written = _xlsx_plan(store, cutoff, format_date(today)[:7])
+            report['files_merged'] = merged
+            report['files_after'] = files_before - files - merged + written
+            report['bytes_after'] = bytes_before - size
+        else:
+            total = sum(1 for _ in store.iter_rows())
+            share = report['rows_removed'] / total if total else 0
+            report['files_after'] = files_before
+            report['bytes_after'] = int(bytes_before - share * Path(store.path).stat().st_size)
+        # Their absences were imported, they are not archived again
+        report['files_after'] -= len(legacy)
+        report['bytes_after'] -= sum(file.stat().st_size for file in legacy)
+    else:
+        if archive:
+            _, report['archives'] = archive_rows(store.iter_rows(end=last_day),
+                                                 root / ARCHIVE_DIRNAME)
+        report['rows_removed'] = store.purge(cutoff)
+        for path in journals:
+            _, removed = rewrite_journal(path, lambda record: record['date'] >= cutoff)
+            report['journal_records_removed'] += removed
+        # The rewritten journal has lost its checkpoint
+        commit_journal(store)
+        if store.presence is not None:
+            report['presence_sessions_removed'] = store.presence.purge(cutoff)
+            store.presence.compact()
+        report['files_merged'] = store.compact(before=today)
+        for file in legacy:
+            file.unlink()
+        if store.rollups is not None:
+            store.rollups.rebuild(store)
+        if store.heatmaps is not None:
+            store.heatmaps.invalidate()
+        report['files_after'], report['bytes_after'] = tree_usage(root)
+
+    report['files_reclaimed'] = report['files_before'] - report['files_after']
+    report['bytes_reclaimed'] = report['bytes_before'] - report['bytes_after']
+    return report
@@ -0,0 +1,341 @@
+"""
+Pre-aggregated absence counts for the dashboards
+
+Three rollup tables live in absences/<backend>_rollups.sqlite, next to the
+store:
+
+    student_month  absences per class, month and student
+    class_day      absences per class and day
+    class_slot     absences per class, month and time slot
+
+The same database indexes the absences by Code Massar (student_absences),
+across classes, for the student history lookup.
+
+They are updated from the session records written by the absence store,
+whatever its backend. Each session's absent students are remembered so
+that saving a session again first subtracts its previous contribution.
+rebuild() recomputes everything from the raw absences and check() reports
+the keys where the rollups and the raw data disagree. A database written
+by an older version of this module is rebuilt when opened.
+"""
+import json
+import sqlite3
+from collections import Counter
+from itertools import groupby
+from pathlib import Path
+
+import pandas as pd
+
+from config import sanitize_filename
+
+
+ROLLUP_FILENAME = "rollups.sqlite"
+ROLLUP_VERSION = 2  # bump when the tables change, stored as PRAGMA user_version
+COUNT_COLUMN = "Nombre d'absences"
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sessions (
+        class_key TEXT NOT NULL,
+        date TEXT NOT NULL,
+        heure TEXT NOT NULL,
+        absences TEXT NOT NULL,
+        PRIMARY KEY (class_key, date, heure)
+    );
+    CREATE TABLE IF NOT EXISTS student_month (
+        class_key TEXT NOT NULL,
+        month TEXT NOT NULL,
+        code_massar TEXT NOT NULL,
+        nom TEXT,
+        n INTEGER NOT NULL,
+        PRIMARY KEY (class_key, month, code_massar)
+    );
+    CREATE TABLE IF NOT EXISTS class_day (
+        class_key TEXT NOT NULL,
+        classe TEXT NOT NULL,
+        date TEXT NOT NULL,
+        n INTEGER NOT NULL,
+        PRIMARY KEY (class_key, date)
+    );
+    CREATE TABLE IF NOT EXISTS class_slot (
+        class_key TEXT NOT NULL,
+        month TEXT NOT NULL,
+        heure TEXT NOT NULL,
+        n INTEGER NOT NULL,
+        PRIMARY KEY (class_key, month, heure)
+    );
+    CREATE TABLE IF NOT EXISTS student_absences (
+        code_massar TEXT NOT NULL,
+        date TEXT NOT NULL,
+        heure TEXT NOT NULL,
+        class_key TEXT NOT NULL,
+        classe TEXT NOT NULL,
+        nom TEXT,
+        PRIMARY KEY (code_massar, date, heure, class_key)
+    ) WITHOUT ROWID;
+"""
+
+ROLLUP_TABLES = ('student_month', 'class_day', 'class_slot')
+
+
+class AbsenceRollups:
+    """Rollup tables of one absence store"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+        # New or outdated, to be filled by rebuild()
+        self.created = version != ROLLUP_VERSION
+
+    def _connect(self):
+        # Autocommit mode, transactions are opened explicitly with BEGIN IMMEDIATE
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    @staticmethod
+    def _add(conn, class_name, date, time_slot, absences, sign):
+        """Add (sign=1) or subtract (sign=-1) the absences of one session"""
+        if not absences:
+            return
+        class_key = sanitize_filename(class_name)
+        month = date[:7]
+        n = sign * len(absences)
+        conn.executemany("""
+            INSERT INTO student_month VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (class_key, month, code_massar)
+            DO UPDATE SET n = n + excluded.n, nom = COALESCE(excluded.nom, nom)
+        """, [(class_key, month, str(code), nom, sign) for code, nom in absences])
+        conn.execute("""
+            INSERT INTO class_day VALUES (?, ?, ?, ?)
+            ON CONFLICT (class_key, date) DO UPDATE SET n = n + excluded.n
+        """, (class_key, class_name, date, n))
+        conn.execute("""
+            INSERT INTO class_slot VALUES (?, ?, ?, ?)
+            ON CONFLICT (class_key, month, heure) DO UPDATE SET n = n + excluded.n
+        """, (class_key, month, time_slot, n))
+        if sign > 0:
+            conn.executemany(
+                "INSERT OR REPLACE INTO student_absences VALUES (?, ?, ?, ?, ?, ?)",
+                [(str(code), date, time_slot, class_key, class_name, nom) for code, nom in absences]
+            )
+        else:
+            conn.executemany("""
+                DELETE FROM student_absences
+                WHERE code_massar = ? AND date = ? AND heure = ? AND class_key = ?
+            """, [(str(code), date, time_slot, class_key) for code, _ in absences])
+
+    @staticmethod
+    def _prune(conn):
+        for table in ROLLUP_TABLES:
+            conn.execute(f"DELETE FROM {table} WHERE n <= 0")
+
+    def apply_records(self, records):
+        """Replace the contribution of session records, in one transaction"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for record in records:
+                class_name, date, time_slot = (
+                    record['class_name'], record['date'], record['time_slot'])
+                key = (sanitize_filename(class_name), date, time_slot)
+                row = conn.execute(
+                    "SELECT absences FROM sessions WHERE class_key = ? AND date = ? AND heure = ?",
+                    key
+                ).fetchone()
+                if row:
+                    self._add(conn, class_name, date, time_slot, json.loads(row[0]), -1)
+                absences = [[code, nom] for code, nom in record['absences']]
+                self._add(conn, class_name, date, time_slot, absences, 1)
+                if absences:
+                    conn.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)",
+                                 key + (json.dumps(absences, ensure_ascii=False),))
+                else:
+                    conn.execute(
+                        "DELETE FROM sessions WHERE class_key = ? AND date = ? AND heure = ?", key)
+            self._prune(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def rebuild(self, store):
+        """
+        Recompute every rollup from the raw absences of a store
+
+        Returns:
+            int: Number of sessions found
+        """
+        conn = self._connect()
+        sessions = 0
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM sessions")
+            conn.execute("DELETE FROM student_absences")
+            for table in ROLLUP_TABLES:
+                conn.execute(f"DELETE FROM {table}")
+            for (class_name, date, time_slot), rows in groupby(
+                    store.iter_rows(), key=lambda row: row[:3]):
+                absences = [[code, nom] for _, _, _, code, nom in rows]
+                self._add(conn, class_name, date, time_slot, absences, 1)
+                key = (sanitize_filename(class_name), date, time_slot)
+                previous = conn.execute(
+                    "SELECT absences FROM sessions WHERE class_key = ? AND date = ? AND heure = ?",
+                    key
+                ).fetchone()
+                if previous:
+                    absences = json.loads(previous[0]) + absences
+                else:
+                    sessions += 1
+                conn.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)",
+                             key + (json.dumps(absences, ensure_ascii=False),))
+            conn.execute(f"PRAGMA user_version = {ROLLUP_VERSION}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        self.created = False
+        return sessions
+
+    def check(self, store):
+        """
+        Compare the rollups with counts recomputed from the raw absences
+
+        Returns:
+            dict: Number of mismatching keys per table
+        """
+        expected = {table: Counter() for table in ROLLUP_TABLES}
+        expected_students = set()
+        for class_name, date, time_slot, code, _ in store.iter_rows():
+            class_key = sanitize_filename(class_name)
+            expected_students.add((str(code), date, time_slot, class_key))
+            expected['student_month'][(class_key, date[:7], str(code))] += 1
+            expected['class_day'][(class_key, date)] += 1
+            expected['class_slot'][(class_key, date[:7], time_slot)] += 1
+
+        keys = {
+            'student_month': "class_key, month, code_massar",
+            'class_day': "class_key, date",
+            'class_slot': "class_key, month, heure",
+        }
+        mismatches = {}
+        with self._connect() as conn:
+            for table, columns in keys.items():
+                actual = Counter({
+                    tuple(row[:-1]): row[-1]
+                    for row in conn.execute(f"SELECT {columns}, n FROM {table}")
+                })
+                differing = set(actual) ^ set(expected[table])
+                differing.update(key for key in set(actual) & set(expected[table])
+                                 if actual[key] != expected[table][key])
+                mismatches[table] = len(differing)
+            actual_students = set(conn.execute(
+                "SELECT code_massar, date, heure, class_key FROM student_absences"))
+            mismatches['student_absences'] = len(actual_students ^ expected_students)
+        return mismatches
+
+    @staticmethod
+    def _months(start, end):
+        return start[:7], end[:7]
+
+    def summary(self, class_name, start, end):
+        """
+        Return the dashboard metrics of a class over whole months
+
+        Args:
+            class_name (str): Class name
+            start (str): First day 'YYYY-MM-DD', its month is included
+            end (str): Last day 'YYYY-MM-DD', its month is included
+
+        Returns:
+            dict: total, students and days counts
+        """
+        class_key = sanitize_filename(class_name)
+        first_month, last_month = self._months(start, end)
+        with self._connect() as conn:
+            total, days = conn.execute("""
+                SELECT COALESCE(SUM(n), 0), COUNT(*) FROM class_day
+                WHERE class_key = ? AND date BETWEEN ? AND ?
+            """, (class_key, start, end)).fetchone()
+            students = conn.execute("""
+                SELECT COUNT(DISTINCT code_massar) FROM student_month
+                WHERE class_key = ? AND month BETWEEN ? AND ?
+            """, (class_key, first_month, last_month)).fetchone()[0]
+        return {'total': total, 'students': students, 'days': days}
+
+    def student_counts(self, class_name, start, end):
+        """Return the absences per student of a class over whole months"""
+        first_month, last_month = self._months(start, end)
+        with self._connect() as conn:
+            return pd.read_sql_query(f"""
+                SELECT code_massar AS "Code Massar", MAX(nom) AS "Nom",
+                       SUM(n) AS "{COUNT_COLUMN}"
+                FROM student_month
+                WHERE class_key = ? AND month BETWEEN ? AND ?
+                GROUP BY code_massar
+                ORDER BY "{COUNT_COLUMN}" DESC
+            """, conn, params=(sanitize_filename(class_name), first_month, last_month))
+
+    def day_counts(self, class_name, start, end):
+        """Return the absences per day of a class"""
+        with self._connect() as conn:
+            df = pd.read_sql_query(f"""
+                SELECT date AS "Date", n AS "{COUNT_COLUMN}" FROM class_day
+                WHERE class_key = ? AND date BETWEEN ? AND ?
+                ORDER BY date
+            """, conn, params=(sanitize_filename(class_name), start, end))
+        df['Date'] = pd.to_datetime(df['Date'])
+        return df
+
+    def slot_counts(self, class_name, start, end):
+        """Return the absences per time slot of a class over whole months"""
+        first_month, last_month = self._months(start, end)
+        with self._connect() as conn:
+            return pd.read_sql_query(f"""
+                SELECT heure AS "Heure", SUM(n) AS "{COUNT_COLUMN}" FROM class_slot
+                WHERE class_key = ? AND month BETWEEN ? AND ?
+                GROUP BY heure ORDER BY heure
+            """, conn, params=(sanitize_filename(class_name), first_month, last_month))
+
+    def student_history(self, code_massar, start=None, end=None):
+        """
+        Return every absence of a student, whatever the class
+
+        Args:
+            code_massar (str): Student Code Massar
+            start (str): First day 'YYYY-MM-DD' included, no bound when None
+            end (str): Last day 'YYYY-MM-DD' included, no bound when None
+
+        Returns:
+            pd.DataFrame: Date, Heure, Classe, Code Massar and Nom, by date
+        """
+        sql = """
+            SELECT date AS "Date", heure AS "Heure", classe AS "Classe",
+                   code_massar AS "Code Massar", nom AS "Nom"
+            FROM student_absences WHERE code_massar = ?
+        """
+        params = [str(code_massar)]
+        if start is not None:
+            sql += " AND date >= ?"
+            params.append(start)
+        if end is not None:
+            sql += " AND date <= ?"
+            params.append(end)
+        sql += " ORDER BY date, heure"
+        with self._connect() as conn:
+            df = pd.read_sql_query(sql, conn, params=params)
+        df['Date'] = pd.to_datetime(df['Date'])
+        return df
+
+    def student_count(self, code_massar, start, end):
+        """Return the number of absences of a student between two days"""
+        with self._connect() as conn:
+            return conn.execute("""
+                SELECT COUNT(*) FROM student_absences
+                WHERE code_massar = ? AND date BETWEEN ? AND ?
+            """, (str(code_massar), start, end)).fetchone()[0]
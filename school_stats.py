@@ -0,0 +1,110 @@
+"""School-wide absence reports computed across every class at once"""
+import re
+
+import pandas as pd
+
+
+WEEKDAYS = ['Lundi', 'Mardi', 'Mercredi', 'Jeudi', 'Vendredi', 'Samedi', 'Dimanche']
+TIME_SLOTS = ["8h30-9h30", "9h30-10h30", "10h30-11h30", "11h30-12h30",
+              "13h30-14h30", "14h30-15h30", "15h30-16h30", "16h30-17h30"]
+COUNT_COLUMN = "Nombre d'absences"
+
+LEVEL_RE = re.compile(r'^\s*(\d+\s*[A-Za-z]+)')
+
+
+def class_level(class_name):
+    """Return the level of a class name, e.g. '1APIC' for '1APIC-3'"""
+    match = LEVEL_RE.match(str(class_name))
+    return match.group(1).replace(' ', '').upper() if match else str(class_name)
+
+
+def load_absences(store, start=None, end=None):
+    """
+    Load the absences of every class into one frame
+
+    Classe, Niveau, Heure and Jour are categorical so that the reports
+    below run as integer-coded groupbys.
+
+    Args:
+        store (AbsenceStore): Absence store to read from
+        start: First date included, no lower bound when None
+        end: Last date included, no upper bound when None
+
+    Returns:
+        pd.DataFrame: Absence rows with the extra Niveau and Jour columns
+    """
+    df = store.query(None, start, end)
+    df['Classe'] = df['Classe'].astype(str).astype('category')
+    # Mapping a categorical only evaluates class_level once per class
+    df['Niveau'] = df['Classe'].map(class_level).astype('category')
+    slots = TIME_SLOTS + sorted(set(df['Heure'].astype(str)) - set(TIME_SLOTS))
+    df['Heure'] = pd.Categorical(df['Heure'], categories=slots)
+    df['Jour'] = pd.Categorical.from_codes(
+        df['Date'].dt.dayofweek.to_numpy(dtype='int64'), categories=WEEKDAYS)
+    df['Code Massar'] = df['Code Massar'].astype(str).astype('category')
+    return df
+
+
+def _count(df, keys):
+    counts = df.groupby(keys, observed=True).agg(**{
+        COUNT_COLUMN: ('Code Massar', 'size'),
+        'Élèves absents': ('Code Massar', 'nunique'),
+        'Jours': ('Date', 'nunique'),
+    })
+    return counts.reset_index()
+
+
+def report_by_class(df):
+    """Absences per class, most affected first"""
+    return _count(df, ['Niveau', 'Classe']).sort_values(
+        COUNT_COLUMN, ascending=False, ignore_index=True)
+
+
+def report_by_level(df):
+    """Absences per level (1APIC, 2APIC, ...)"""
+    return _count(df, ['Niveau'])
+
+
+def report_by_slot(df):
+    """Absences per time slot, in timetable order"""
+    return _count(df, ['Heure'])
+
+
+def report_by_weekday(df):
+    """Absences per day of the week"""
+    return _count(df, ['Jour'])
+
+
+def report_by_student(df):
+    """Absences per student, most absent first"""
+    counts = df.groupby(['Code Massar'], observed=True).agg(**{
+        'Nom': ('Nom', 'first'),
+        'Classe': ('Classe', 'last'),
+        COUNT_COLUMN: ('Date', 'size'),
+        'Jours': ('Date', 'nunique'),
+        'Première absence': ('Date', 'min'),
+        'Dernière absence': ('Date', 'max'),
+    })
+    return counts.reset_index().sort_values(COUNT_COLUMN, ascending=False, ignore_index=True)
+
+
+REPORTS = {
+    'Par classe': report_by_class,
+    'Par niveau': report_by_level,
+    'Par créneau': report_by_slot,
+    'Par jour': report_by_weekday,
+    'Par élève': report_by_student,
+}
+
+
+def school_report(store, start=None, end=None):
+    """
+    Compute every school-wide report over a period
+
+    Returns:
+        dict: Report name -> DataFrame, plus 'absences' holding the rows
+    """
+    df = load_absences(store, start, end)
+    reports = {name: func(df) for name, func in REPORTS.items()}
+    reports['absences'] = df
+    return reports
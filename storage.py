@@ -0,0 +1,273 @@
+"""
+Crash and concurrency safe file writes
+
+Writes go to a temporary file in the same folder that replaces the target
+with os.replace, readers never see a truncated file. Read-modify-write
+cycles of shared files hold an advisory lock on a sidecar <file>.lock so
+that several worker processes do not lose each other's updates.
+"""
+import copy
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+LOCK_TIMEOUT = 10.0
+LOCK_POLL_INTERVAL = 0.01
+UPDATE_RETRIES = 3
+
+
+def atomic_write_bytes(path, data):
+    """Replace the content of path with data in one step"""
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def atomic_write_json(path, data, **kwargs):
+    """Serialize data as JSON and replace path with it in one step"""
+    kwargs.setdefault('ensure_ascii', False)
+    atomic_write_bytes(path, json.dumps(data, **kwargs).encode('utf-8'))
+
+
+def _try_lock(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+
+
+def _unlock(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(path, timeout=LOCK_TIMEOUT):
+    """
+    Hold an exclusive advisory lock on path for the duration of the block
+
+    The lock is taken on the sidecar file <path>.lock, which is never
+    replaced, so it stays valid while path itself is atomically swapped.
+
+    Raises:
+        TimeoutError: The lock could not be acquired within timeout seconds
+    """
+    fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                _try_lock(fd)
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Could not lock {path} within {timeout}s")
+                time.sleep(LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            _unlock(fd)
+    finally:
+        os.close(fd)
+
+
+def read_json(path, default=None):
+    """Return the JSON content of path, a copy of default when missing"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return copy.deepcopy(default)
+
+
+def update_json(path, update, default=None, retries=UPDATE_RETRIES, **dump_kwargs):
+    """
+    Apply update(data) to a JSON file under its lock
+
+    update receives the current content, modifies it in place and may
+    return a value; the file is only rewritten when the content changed.
+    Acquiring the lock is retried when other writers hold it too long.
+
+    Returns:
+        The value returned by update
+    """
+    for attempt in range(retries):
+        try:
+            with file_lock(path):
+                data = read_json(path, default)
+                before = copy.deepcopy(data)
+                result = update(data)
+                if data != before:
+                    atomic_write_json(path, data, **dump_kwargs)
+                return result
+        except TimeoutError:
+            if attempt == retries - 1:
+                raise
+
+
+def append_journal(path, record):
+    """
+    Append one JSON record as a line of an append-only journal
+
+    The line is written with a single O_APPEND write under the journal
+    lock and synced before returning.
+    """
+    line = (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode('utf-8')
+    with file_lock(path):
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def read_journal(path):
+    """Yield the records of a journal, skipping a torn last line"""
+    try:
+        f = open(path, 'r', encoding='utf-8')
+    except FileNotFoundError:
+        return
+    with f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            yield json.loads(line)
+
+
+def _iter_lines(f, offset):
+    f.seek(offset)
+    for line in f:
+        if not line.endswith(b"\n"):
+            break
+        offset += len(line)
+        yield json.loads(line), offset
+
+
+def tail_journal(path, offset=0):
+    """
+    Return the complete records appended to a journal after a byte offset
+
+    offset must be the start of a line, e.g. the offset returned by a
+    previous call.
+
+    Returns:
+        tuple: (list of records, offset after the last complete line)
+    """
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return [], offset
+    records = []
+    with f:
+        for record, offset in _iter_lines(f, offset):
+            records.append(record)
+    return records, offset
+
+
+def _checkpoint_offset(path, f):
+    """Return the checkpoint of the open journal f, 0 when it belongs to another file"""
+    checkpoint = read_json(f"{path}.checkpoint", {})
+    stat = os.fstat(f.fileno())
+    if checkpoint.get('inode') != stat.st_ino or checkpoint.get('offset', 0) > stat.st_size:
+        # Rewritten journal
+        return 0
+    return checkpoint['offset']
+
+
+def uncommitted_journal(path):
+    """Return the complete records of a journal after its checkpoint"""
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return []
+    with f:
+        return [record for record, _ in _iter_lines(f, _checkpoint_offset(path, f))]
+
+
+def checkpoint_journal(path, committed, history_path=None, rotate_bytes=None):
+    """
+    Move the checkpoint of a journal past its committed records
+
+    The checkpoint, the offset before which every record is committed, is
+    kept in <path>.checkpoint with the inode of the journal, so that a
+    rewritten journal is read again from its start. It moves to the first
+    record after it for which committed(record) is false. Once it passes
+    rotate_bytes, the records before it are moved to the end of
+    history_path: a crash in between leaves them in both journals.
+
+    Returns:
+        int: Checkpoint offset in the journal
+    """
+    with file_lock(path):
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return 0
+        with f:
+            start = offset = _checkpoint_offset(path, f)
+            for record, end in _iter_lines(f, offset):
+                if not committed(record):
+                    break
+                offset = end
+            inode = os.fstat(f.fileno()).st_ino
+            if history_path is not None and rotate_bytes is not None and offset >= rotate_bytes:
+                f.seek(0)
+                done, rest = f.read(offset), f.read()
+            elif offset == start:
+                return offset
+            else:
+                done = None
+        if done is not None:
+            with file_lock(history_path):
+                fd = os.open(history_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, done)
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            atomic_write_bytes(path, rest)
+            inode, offset = os.stat(path).st_ino, 0
+        atomic_write_json(f"{path}.checkpoint", {'inode': inode, 'offset': offset})
+        return offset
+
+
+def rewrite_journal(path, keep):
+    """
+    Rewrite a journal with the records for which keep(record) is true
+
+    Returns:
+        tuple: (records kept, records dropped)
+    """
+    with file_lock(path):
+        records = list(read_journal(path))
+        kept = [record for record in records if keep(record)]
+        if len(kept) != len(records):
+            data = "".join(json.dumps(record, ensure_ascii=False, default=str) + "\n"
+                           for record in kept)
+            atomic_write_bytes(path, data.encode('utf-8'))
+    return len(kept), len(records) - len(kept)
@@ -0,0 +1,212 @@
+"""
+School-wide student search by partial name or Code Massar
+
+Every student of the saved rosters is indexed once under the trigrams of
+its normalized text (name and Code Massar, lower case, accents and
+punctuation removed, Arabic names without their diacritics and hamzas):
+"Aït-Bénali" is found by "benal" or "ait ben", "أحمد" by "احمد". A
+query keeps the students holding every trigram of each of its words,
+the candidates are then checked word by word, so a search only touches
+the posting sets of its own trigrams whatever the size of the school.
+
+Saving a class re-indexes that class (a class_registry.on_class_saved
+listener), refresh() catches up with classes saved by other processes
+by comparing file stamps, unchanged rosters are not reloaded.
+"""
+import heapq
+import re
+import threading
+import unicodedata
+from pathlib import Path
+
+import pandas as pd
+
+from class_cache import load_class
+from class_registry import available_classes, class_path, on_class_saved
+from config import CLASSES_DIR, file_stamp
+from metrics import timed
+
+
+DEFAULT_LIMIT = 20
+
+_SEPARATORS = re.compile(r'[\W_]+')
+# Arabic letters written interchangeably in names, the hamza forms of alef
+# already lose their hamza with the other diacritics
+_ARABIC_FOLDS = str.maketrans({'ى': 'ي', 'ة': 'ه', 'ـ': None})
+
+
+def normalize(text):
+    """Return text in lower case without accents, words separated by one space"""
+    decomposed = unicodedata.normalize('NFKD', str(text).casefold())
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return _SEPARATORS.sub(' ', stripped.translate(_ARABIC_FOLDS)).strip()
+
+
+def trigrams(word):
+    """Return the trigrams indexed for a word: its own and its start (" xy")"""
+    padded = f" {word}"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _query_trigrams(word):
+    """Return the trigrams a word matching a query word must hold"""
+    if len(word) < 3:
+        # Short query words only match the start of a word
+        return {f" {word}"} if len(word) == 2 else set()
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def _matches(word, student_word):
+    return student_word.startswith(word) if len(word) < 3 else word in student_word
+
+
+class StudentIndex:
+    """Trigram index of the students of one classes folder"""
+
+    def __init__(self, classes_dir=CLASSES_DIR):
+        self.classes_dir = Path(classes_dir)
+        self._lock = threading.Lock()
+        self._students = {}  # id -> (class name, code, nom, normalized name and code, words)
+        self._postings = {}  # trigram -> set of ids
+        self._classes = {}  # class name -> (stamp, ids)
+        self._next_id = 0
+
+    def _remove(self, class_name):
+        _, ids = self._classes.pop(class_name, (None, ()))
+        for student_id in ids:
+            words = self._students.pop(student_id)[-1]
+            for word in words:
+                for gram in trigrams(word):
+                    postings = self._postings.get(gram)
+                    if postings is not None:
+                        postings.discard(student_id)
+                        if not postings:
+                            del self._postings[gram]
+
+    def _add(self, class_name, stamp, students):
+        ids = []
+        for code, nom in zip(students['Code Massar'], students['Nom']):
+            if pd.isna(code):
+                continue
+            code, nom = str(code), '' if pd.isna(nom) else str(nom)
+            name, code_text = normalize(nom), normalize(code)
+            words = tuple(set(f"{name} {code_text}".split()))
+            student_id = self._next_id
+            self._next_id += 1
+            self._students[student_id] = (class_name, code, nom, name, code_text, words)
+            for word in words:
+                for gram in trigrams(word):
+                    self._postings.setdefault(gram, set()).add(student_id)
+            ids.append(student_id)
+        self._classes[class_name] = (stamp, ids)
+
+    def update_class(self, class_name, path=None):
+        """(Re)index the roster of a class, or forget it when its file is gone"""
+        path = Path(path) if path is not None else class_path(class_name, self.classes_dir)
+        try:
+            stamp = file_stamp(path)
+        except OSError:
+            stamp = None
+        students = load_class(path)[1] if stamp is not None else None
+        with self._lock:
+            self._remove(class_name)
+            if students is not None:
+                self._add(class_name, stamp, students)
+
+    @timed("student_search.refresh")
+    def refresh(self):
+        """
+        Index the classes that are new or changed since they were indexed
+
+        Returns:
+            int: Number of classes indexed or removed
+        """
+        saved = {}
+        for class_name in available_classes(self.classes_dir):
+            path = class_path(class_name, self.classes_dir)
+            try:
+                saved[class_name] = (path, file_stamp(path))
+            except OSError:
+                continue
+        with self._lock:
+            known = {name: stamp for name, (stamp, _) in self._classes.items()}
+        changed = 0
+        for class_name, (path, stamp) in saved.items():
+            if known.get(class_name) != stamp:
+                self.update_class(class_name, path)
+                changed += 1
+        for class_name in set(known) - set(saved):
+            with self._lock:
+                self._remove(class_name)
+            changed += 1
+        return changed
+
+    @timed("student_search.search")
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """
+        Return the students matching every word of a query
+
+        A query word matches the start or the middle of a word of the
+        student name or Code Massar, words shorter than 3 letters only
+        match the start and one-letter words alone find nothing. Exact
+        Code Massar matches come first, then names starting with the
+        query, then the other matches.
+
+        Returns:
+            list: (class name, Code Massar, Nom) tuples, at most limit
+        """
+        words = normalize(query).split()
+        if not words:
+            return []
+        with self._lock:
+            candidates = None
+            # Rarest trigram first, the intersection shrinks fastest
+            grams = sorted(set().union(*map(_query_trigrams, words)),
+                           key=lambda gram: len(self._postings.get(gram, ())))
+            for gram in grams:
+                postings = self._postings.get(gram, set())
+                candidates = set(postings) if candidates is None else candidates & postings
+                if not candidates:
+                    return []
+            if candidates is None:
+                # Only one-letter words, too vague to scan every student for
+                return []
+            matches = [self._students[student_id] for student_id in candidates]
+
+        text = ' '.join(words)
+        results = []
+        for class_name, code, nom, name, code_text, student_words in matches:
+            if not all(any(_matches(word, student_word) for student_word in student_words)
+                       for word in words):
+                continue
+            rank = 0 if code_text == text else 1 if name.startswith(text) else 2
+            results.append((rank, nom, class_name, code))
+        best = heapq.nsmallest(limit, results)
+        return [(class_name, code, nom) for _, nom, class_name, code in best]
+
+    def __len__(self):
+        return len(self._students)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_student_index(classes_dir=CLASSES_DIR):
+    """Return the process-wide student index of a classes folder"""
+    key = str(Path(classes_dir).resolve())
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = StudentIndex(classes_dir)
+        return index
+
+
+@on_class_saved
+def _index_saved_class(class_name, path):
+    key = str(Path(path).parent.resolve())
+    with _indexes_lock:
+        index = _indexes.get(key)
+    # Folders never searched are indexed on their first refresh()
+    if index is not None:
+        index.update_class(class_name, path)
@@ -0,0 +1,156 @@
+"""
+Background warmup of the caches read by the first requests of the day
+
+After a restart every cache is cold: the first teacher opening a class
+pays for its parse, the first statistics page for reading the rollup,
+presence and absence databases from disk and for building the heatmap
+matrix. start_warmup() runs once per process and queues, on a small
+thread pool, one task per saved class doing what its pages read first:
+
+- the parsed roster (class_cache.load_class)
+- the current month's rollup statistics and presence bitmaps, which
+  brings their database pages into the OS cache
+- the heatmap matrix of the current term (store.heatmaps)
+
+followed by the school-wide student index and grade book sync.
+warm_class() queues the same task for a class just saved. The requests
+served meanwhile are not slowed down, they share the caches being
+filled and at worst do the work themselves.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date as date_type
+from pathlib import Path
+
+from absence_store import month_bounds
+from class_cache import load_class
+from class_registry import available_classes, class_path
+from config import CLASSES_DIR
+from grades import get_gradebook
+from heatmap import current_term, term_bounds
+from metrics import timed
+from student_search import get_student_index
+
+
+DEFAULT_WORKERS = 4
+
+logger = logging.getLogger(__name__)
+
+
+@timed("warmup.class")
+def warm_class_caches(store, class_name, classes_dir=CLASSES_DIR, today=None):
+    """Fill the caches read by the pages of one class for the current month and term"""
+    today = today or date_type.today()
+    load_class(class_path(class_name, classes_dir))
+    start, end = month_bounds(today.year, today.month)
+    store.rollups.summary(class_name, start, end)
+    store.rollups.student_counts(class_name, start, end)
+    store.rollups.day_counts(class_name, start, end)
+    store.rollups.slot_counts(class_name, start, end)
+    if store.presence is not None:
+        store.presence.load(class_name, start, end)
+    if store.heatmaps is not None:
+        start_year = today.year if today.month >= 9 else today.year - 1
+        store.heatmaps.get(class_name, *term_bounds(start_year, current_term(start_year, today)))
+
+
+@timed("warmup.school")
+def warm_school_caches(classes_dir=CLASSES_DIR):
+    """Fill the school-wide student index and grade book"""
+    get_student_index(classes_dir).refresh()
+    get_gradebook(classes_dir).sync()
+
+
+class Warmup:
+    """Thread pool running warmup tasks and counting their progress"""
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="warmup")
+        self._lock = threading.Lock()
+        self.total = 0
+        self.done = 0
+        self.failed = []
+        self.started = None
+        self.finished = None
+
+    def submit(self, name, func, *args):
+        """Queue func(*args), name identifies the task in the failures"""
+        with self._lock:
+            if self.done == self.total:
+                # Idle: a new round starts
+                self.total = self.done = 0
+                self.failed = []
+                self.started, self.finished = time.time(), None
+            self.total += 1
+        return self._pool.submit(self._run, name, func, args)
+
+    def _run(self, name, func, args):
+        try:
+            func(*args)
+        except Exception:
+            logger.exception("Warmup of %s failed", name)
+            with self._lock:
+                self.failed.append(name)
+        finally:
+            with self._lock:
+                self.done += 1
+                if self.done == self.total:
+                    self.finished = time.time()
+
+    def progress(self):
+        """
+        Return the progress of the current or last round
+
+        Returns:
+            dict: total, done, failed (task names), running (bool) and
+                seconds elapsed or taken
+        """
+        with self._lock:
+            end = self.finished or time.time()
+            return {
+                'total': self.total,
+                'done': self.done,
+                'failed': list(self.failed),
+                'running': self.done < self.total,
+                'seconds': end - self.started if self.started else 0.0,
+            }
+
+
+_warmup = None
+_warmed = set()
+_warmup_lock = threading.Lock()
+
+
+def get_warmup():
+    """Return the process-wide warmup pool"""
+    global _warmup
+    with _warmup_lock:
+        if _warmup is None:
+            _warmup = Warmup()
+        return _warmup
+
+
+def start_warmup(store, classes_dir=CLASSES_DIR):
+    """
+    Warm the caches of every saved class, once per process and store
+
+    Returns:
+        bool: True when the warmup was started by this call
+    """
+    key = (id(store), str(Path(classes_dir).resolve()))
+    with _warmup_lock:
+        if key in _warmed:
+            return False
+        _warmed.add(key)
+    warmup = get_warmup()
+    for class_name in available_classes(classes_dir):
+        warmup.submit(class_name, warm_class_caches, store, class_name, classes_dir)
+    warmup.submit("school", warm_school_caches, classes_dir)
+    return True
+
+
+def warm_class(store, class_name, classes_dir=CLASSES_DIR):
+    """Warm the caches of a class in the background, e.g. after it is saved"""
+    return get_warmup().submit(class_name, warm_class_caches, store, class_name, classes_dir)